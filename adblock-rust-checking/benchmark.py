@@ -0,0 +1,54 @@
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from common.filterlist import FilterEngine, load_engine
+
+from check_lists import LIST_FOLDER, read_lists, read_resources
+
+def timed(function, *args):
+    start = time.time()
+    result = function(*args)
+    return result, time.time() - start
+
+def run(engine, resources, repeat):
+    for run in range(repeat):
+        start = time.time()
+        blocked = 0
+        for page_url, request_type, resource_url, _imaged_data in resources:
+            if engine.check(resource_url, page_url, request_type):
+                blocked += 1
+        duration = time.time() - start
+        print('  run ' + str(run + 1) + ': ' + str(len(resources)) + ' requests, ' + str(blocked) + ' blocked, '
+              + '%.0f' % (len(resources) / duration) + ' requests/s')
+
+def benchmark(region, repeat, snapshot_dir):
+    lists = read_lists(region)['combined_filterlists']
+    resources = read_resources(region)
+
+    engine, parse_time = timed(FilterEngine, lists)
+    print('parsed: ' + str(len(engine)) + ' filters in ' + '%.3f' % parse_time + 's')
+    run(engine, resources, repeat)
+
+    # the first load writes the snapshot, the second one reads it
+    _engine, save_time = timed(load_engine, lists, snapshot_dir)
+    engine, load_time = timed(load_engine, lists, snapshot_dir)
+    print('snapshot: saved in ' + '%.3f' % save_time + 's, loaded in ' + '%.3f' % load_time + 's ('
+          + '%.0f' % (parse_time / load_time) + 'x faster than parsing)')
+    run(engine, resources, repeat)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='throughput of the filter list engine on the bundled lists and resources')
+    parser.add_argument('--region', action='append', help='regions to benchmark, defaults to all of filter_lists')
+    parser.add_argument('--repeat', type=int, default=3, help='passes over the resources of a region')
+
+    args = parser.parse_args()
+    regions = args.region or sorted(name for name in os.listdir(LIST_FOLDER) if os.path.isdir(os.path.join(LIST_FOLDER, name)))
+    # a fresh folder, so that the snapshots are written by this run
+    with tempfile.TemporaryDirectory() as snapshot_dir:
+        for region in regions:
+            print(region)
+            benchmark(region, args.repeat, snapshot_dir)
@@ -0,0 +1,198 @@
+import argparse
+import json
+import os
+import re
+import sys
+import time
+import psycopg2
+from tqdm import tqdm
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from common.filterlist import add_snapshot_arguments, load_multi_list_engine
+from common.urls import hostname
+
+from insertion import LIST_COLUMNS, update_lists
+from insert_all import update_chain_blocking
+
+BASE_FOLDER = os.path.dirname(os.path.abspath(__file__))
+LIST_FOLDER = os.path.join(BASE_FOLDER, 'filter_lists')
+RESOURCE_FOLDER = os.path.join(BASE_FOLDER, 'resources')
+CHAINS_FOLDER = os.path.join(BASE_FOLDER, '..', 'chains_resources')
+
+# (file, classified as ad, request type), frames are checked as sub_frame and
+# images with the resource type given on their line
+RESOURCE_FILES = [
+    ('classified_ad_images.txt', True, None),
+    ('classified_nonad_images.txt', False, None),
+    ('classified_ad_frames.txt', True, 'sub_frame'),
+    ('classified_nonad_frames.txt', False, 'sub_frame')
+]
+
+FIELD_RE = re.compile(r'("[^"]*")|[^,]+')
+
+# the bit of each list in the lists mask of the engine
+LIST_BITS = {name: 1 << i for i, name in enumerate(LIST_COLUMNS)}
+
+def read_rules(path):
+    with open(path, 'r', encoding='utf-8') as list_file:
+        return list_file.read().split('\n')
+
+def read_lists(region):
+    # same files as checking.js and checkAll.js
+    supplement_folder = os.path.join(LIST_FOLDER, region)
+    supplement_file = sorted(os.listdir(supplement_folder))[0]
+
+    lists = dict()
+    lists['easylist'] = read_rules(os.path.join(LIST_FOLDER, 'easylist.txt'))
+    lists['supplement'] = read_rules(os.path.join(supplement_folder, supplement_file))
+    lists['easyprivacy'] = read_rules(os.path.join(LIST_FOLDER, 'easyprivacy.txt'))
+    lists['combined_filterlists'] = lists['easylist'] + lists['supplement'] + lists['easyprivacy']
+    return lists
+
+def build_engine(lists, snapshot_dir):
+    # one engine for all the lists, that tells which of them block a request
+    start = time.time()
+    engine = load_multi_list_engine([lists[name] for name in LIST_COLUMNS], snapshot_dir)
+    print(str(len(engine)) + ' filters in ' + '%.2f' % (time.time() - start) + 's')
+    return engine
+
+def parse_line(line):
+    # page url, resource type, resource url, imaged data
+    return [match.group(0).replace('"', '') for match in FIELD_RE.finditer(line)][:4]
+
+def read_resources(region):
+    resources = []
+    for file_name, is_ad, request_type in RESOURCE_FILES:
+        path = os.path.join(RESOURCE_FOLDER, region, file_name)
+        if not os.path.exists(path):
+            print('skipping missing ' + path)
+            continue
+        with open(path, 'r', encoding='utf-8') as resource_file:
+            for line in resource_file:
+                line = line.rstrip('\n')
+                if not line:
+                    continue
+                page_url, resource_type, resource_url, imaged_data = parse_line(line)
+                # checking.js only leaves out these urls for the images we don't see as ads
+                if not is_ad and request_type is None and resource_url.startswith(('data:', 'blob:')):
+                    continue
+                resources.append((page_url, request_type or resource_type, resource_url, imaged_data))
+    return resources
+
+def check_resources(engine, resources):
+    # the results for update_lists, an image that is listed more than once is
+    # only blocked by a list if it is every time
+    results = dict()
+    for page_url, request_type, resource_url, imaged_data in tqdm(resources):
+        lists = engine.matching_lists(resource_url, page_url, request_type)
+        row = results.setdefault(imaged_data, dict())
+        for name, bit in LIST_BITS.items():
+            row[name] = row.get(name, True) and lists & bit != 0
+
+    for name in LIST_COLUMNS:
+        print(name + ': ' + str(sum(1 for row in results.values() if row[name])) + ' of ' + str(len(results)) + ' blocked')
+    return results
+
+class ChainTrie:
+    # the chains of a page merged on their common top, every node is a script
+    # with its children and the images at the end of the chains through it
+    def __init__(self):
+        self.children = dict()
+
+    def add(self, chain, imaged_data):
+        # chain starts at the top most script
+        children = self.children
+        node = None
+        for script_url in chain:
+            node = children.setdefault(script_url, (dict(), []))
+            children = node[0]
+        if node is not None:
+            node[1].append(imaged_data)
+
+    def top_most_blocked(self, is_blocked):
+        # maps the images to the top most blocked script of their chain and its
+        # depth, every script is checked at most once, none under a blocked one
+        blocking = dict()
+        stack = [(self.children, 0, None)]
+        while stack:
+            children, depth, blocked = stack.pop()
+            for script_url, (grandchildren, images) in children.items():
+                node_blocked = blocked
+                if node_blocked is None and not script_url.startswith(('blob:', 'data:')) and is_blocked(script_url):
+                    node_blocked = (script_url, depth)
+                if node_blocked is not None:
+                    for imaged_data in images:
+                        blocking[imaged_data] = node_blocked
+                stack.append((grandchildren, depth + 1, node_blocked))
+        return blocking
+
+def check_chains(engine, chains):
+    # same result as checkAll.js, the top most blocked script of each chain
+    # blocks the image. the chains of a page are walked as a trie and each
+    # script is checked once per page host, which is all the engine looks at
+    combined = LIST_BITS['combined_filterlists']
+    checked = dict()
+    elements = 0
+
+    blocking = dict()
+    blocked_per_page = dict()
+    unique_blocked = set()
+    for page_url in tqdm(chains):
+        page_host = hostname(page_url)
+
+        def is_blocked(script_url):
+            key = (script_url, page_host)
+            if key not in checked:
+                checked[key] = engine.matching_lists(script_url, page_url, 'script', combined) != 0
+            return checked[key]
+
+        trie = ChainTrie()
+        top_down = dict()
+        for imaged_data, (_resource_url, _resource_type, chain) in chains[page_url].items():
+            top_down[imaged_data] = chain[::-1]
+            trie.add(top_down[imaged_data], imaged_data)
+            elements += len(chain)
+        page_blocking = trie.top_most_blocked(is_blocked)
+
+        # the counts of checkAll.js depend on the order of the chains, the
+        # first chain a script is blocked in counts its elements
+        for imaged_data, chain in top_down.items():
+            if imaged_data not in page_blocking:
+                continue
+            script_url, depth = page_blocking[imaged_data]
+            blocking[imaged_data] = script_url
+            page_blocked = blocked_per_page.setdefault(page_url, dict())
+            if script_url not in page_blocked:
+                page_blocked[script_url] = len(chain) - depth
+                unique_blocked.update(chain[depth:])
+
+    print(str(len(checked)) + ' checks for ' + str(elements) + ' chain elements')
+    print('additional resources: ' + str(sum(sum(page_blocked.values()) for page_blocked in blocked_per_page.values())))
+    print('unique resources: ' + str(len(unique_blocked)))
+    return blocking
+
+def check(region, chains_folder, skip_chains, snapshot_dir):
+    engine = build_engine(read_lists(region), snapshot_dir)
+    results = check_resources(engine, read_resources(region))
+
+    blocking = None
+    if not skip_chains:
+        with open(os.path.join(chains_folder, region, 'downstream_everything.json'), 'r') as chains_file:
+            blocking = check_chains(engine, json.load(chains_file))
+
+    pg_conn = psycopg2.connect(os.environ['PG_CONNECTION_STRING'])
+    # the chains set the combined column as well, so they go in after the lists
+    update_lists(pg_conn, results)
+    if blocking is not None:
+        update_chain_blocking(pg_conn, blocking)
+    pg_conn.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='check the classified resources and chains against the filter lists')
+    parser.add_argument('--region', required=True, help='supplement list and resources to use')
+    parser.add_argument('--chains-folder', default=CHAINS_FOLDER, help='folder with the chain resources of chain_generation/generate_chains.py')
+    parser.add_argument('--skip-chains', action='store_true', help='only check the classified resources')
+    add_snapshot_arguments(parser)
+
+    args = parser.parse_args()
+    check(args.region, args.chains_folder, args.skip_chains, args.snapshot_dir)
@@ -3,19 +3,39 @@ import json
 import psycopg2
 import psycopg2.extras
 import os
+import sys
 from tqdm import tqdm
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from common.pgwriter import BufferedWriter
+
+def update_chain_blocking(pg_conn, blocking):
+    # blocking maps imaged_data to the top most blocked element of its chain
+    cur = pg_conn.cursor()
+
+    # everything happens in one transaction, the temporary table is dropped on commit
+    cur.execute('create temporary table chain_blocking (imaged_data text, chain_element_block text) on commit drop')
+    with BufferedWriter(pg_conn, 'chain_blocking', ['imaged_data', 'chain_element_block'], commit=False) as writer:
+        for imaged_data in tqdm(blocking):
+            writer.write({'imaged_data': imaged_data, 'chain_element_block': blocking[imaged_data]})
+
+    cur.execute('''
+        update classifications
+        set chain_element_block = chain_blocking.chain_element_block,
+            is_classified_as_ad_combined_filter_lists = true
+        from chain_blocking
+        where classifications.imaged_data = chain_blocking.imaged_data
+    ''')
+    print(str(cur.rowcount) + ' rows updated')
+
+    pg_conn.commit()
+    cur.close()
+
 def insert(region):
     pg_conn = psycopg2.connect(os.environ['PG_CONNECTION_STRING'])
-    insert_cur = pg_conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
-
     with open('chain_blocking_' + region + '.json', 'r') as input_file:
-        blocking = json.load(input_file)
-        for imaged_data in tqdm(blocking):
-            insert_cur.execute('update classifications set chain_element_block=%s where imaged_data=%s', [blocking[imaged_data], imaged_data])
-            pg_conn.commit()
-            insert_cur.execute('update classifications set is_classified_as_ad_combined_filter_lists=%s where imaged_data=%s', [True, imaged_data])
-            pg_conn.commit()
+        update_chain_blocking(pg_conn, json.load(input_file))
+    pg_conn.close()
 
 
 if __name__ == "__main__":
@@ -23,4 +43,4 @@ if __name__ == "__main__":
     parser.add_argument('--region', help='Region to insert for')
 
     args = parser.parse_args()
-    insert(args.region)
\ No newline at end of file
+    insert(args.region)
@@ -2,47 +2,60 @@ import json
 import psycopg2
 import psycopg2.extras
 import os
+import sys
 from tqdm import tqdm
 
-pg_conn = psycopg2.connect(os.environ['PG_CONNECTION_STRING'])
-insert_cur = pg_conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
-region = psycopg2.connect(os.environ['REGION'])
-with open('blocking_' + region + '.json', 'r') as input_file:
-    blocking = json.load(input_file)
-    for key in blocking:
-        if key == 'easylist':
-            for imaged_data in tqdm(blocking[key]):
-                insert_cur.execute('update classifications set is_classified_as_ad_easylist=%s where imaged_data=%s', [True, imaged_data])
-                pg_conn.commit()
-        elif key == 'supplement':
-            for imaged_data in tqdm(blocking[key]):
-                insert_cur.execute('update classifications set is_classified_as_ad_supplement=%s where imaged_data=%s', [True, imaged_data])
-                pg_conn.commit()
-        elif key == 'easyprivacy':
-            for imaged_data in tqdm(blocking[key]):
-                insert_cur.execute('update classifications set is_classified_as_ad_easyprivacy=%s where imaged_data=%s', [True, imaged_data])
-                pg_conn.commit()
-        elif key == 'combined_filterlists':
-            for imaged_data in tqdm(blocking[key]):
-                insert_cur.execute('update classifications set is_classified_as_ad_combined_filter_lists=%s where imaged_data=%s', [True, imaged_data])
-                pg_conn.commit()
-
-with open('non_blocking_' + region + '.json', 'r') as input_file:
-    non_blocking = json.load(input_file)
-    for key in non_blocking:
-        if key == 'easylist':
-            for imaged_data in tqdm(non_blocking[key]):
-                insert_cur.execute('update classifications set is_classified_as_ad_easylist=%s where imaged_data=%s', [False, imaged_data])
-                pg_conn.commit()
-        elif key == 'supplement':
-            for imaged_data in tqdm(non_blocking[key]):
-                insert_cur.execute('update classifications set is_classified_as_ad_supplement=%s where imaged_data=%s', [False, imaged_data])
-                pg_conn.commit()
-        elif key == 'easyprivacy':
-            for imaged_data in tqdm(non_blocking[key]):
-                insert_cur.execute('update classifications set is_classified_as_ad_easyprivacy=%s where imaged_data=%s', [False, imaged_data])
-                pg_conn.commit()
-        elif key == 'combined_filterlists':
-            for imaged_data in tqdm(non_blocking[key]):
-                insert_cur.execute('update classifications set is_classified_as_ad_combined_filter_lists=%s where imaged_data=%s', [False, imaged_data])
-                pg_conn.commit()
\ No newline at end of file
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from common.pgwriter import BufferedWriter
+
+# which column in classifications each key of the checking.js output sets
+LIST_COLUMNS = {
+    'easylist': 'is_classified_as_ad_easylist',
+    'supplement': 'is_classified_as_ad_supplement',
+    'easyprivacy': 'is_classified_as_ad_easyprivacy',
+    'combined_filterlists': 'is_classified_as_ad_combined_filter_lists'
+}
+
+def load_results(file_name, blocked, results):
+    # results maps imaged_data to whether each list blocks it, an image that is
+    # listed more than once is only blocked if it is every time
+    with open(file_name, 'r') as input_file:
+        lists = json.load(input_file)
+        for key in lists:
+            if key in LIST_COLUMNS:
+                for imaged_data in tqdm(lists[key]):
+                    row = results.setdefault(imaged_data, dict())
+                    row[key] = row.get(key, True) and blocked
+
+def update_lists(pg_conn, results):
+    # results maps imaged_data to {list: blocked}, with the keys of LIST_COLUMNS,
+    # columns of lists missing from a row keep their value
+    cur = pg_conn.cursor()
+
+    # everything happens in one transaction, the temporary table is dropped on commit
+    cur.execute('create temporary table blocking_results (imaged_data text, %s) on commit drop' % ', '.join(key + ' boolean' for key in LIST_COLUMNS))
+    with BufferedWriter(pg_conn, 'blocking_results', ['imaged_data'] + list(LIST_COLUMNS), commit=False) as writer:
+        for imaged_data, row in results.items():
+            writer.write(dict(row, imaged_data=imaged_data))
+
+    cur.execute('''
+        update classifications
+        set %s
+        from blocking_results
+        where classifications.imaged_data = blocking_results.imaged_data
+    ''' % ', '.join('%s = coalesce(blocking_results.%s, classifications.%s)' % (column, key, column) for key, column in LIST_COLUMNS.items()))
+    print(str(cur.rowcount) + ' rows updated')
+
+    pg_conn.commit()
+    cur.close()
+
+def insert(region):
+    pg_conn = psycopg2.connect(os.environ['PG_CONNECTION_STRING'])
+    results = dict()
+    load_results('blocking_' + region + '.json', True, results)
+    load_results('non_blocking_' + region + '.json', False, results)
+    update_lists(pg_conn, results)
+    pg_conn.close()
+
+if __name__ == "__main__":
+    insert(os.environ['REGION'])
@@ -1,303 +1,400 @@
-from networkx import graphml
-
 import argparse
 import os
 import psycopg2
 import psycopg2.extras
 
 from s3fs.core import S3FileSystem
-from tempfile import TemporaryDirectory
 
-from urllib.parse import urlsplit
 from tqdm import tqdm
 
-import html
 import json
 import sys
 
-# utility functions
-def edges_from_mapping(edges):
-    mapping = dict()
-    for edge in edges:
-        if edge[0] in mapping:
-            mapping[edge[0]].append(edge)
-        else:
-            mapping[edge[0]] = [edge]
-
-    return mapping
+from multiprocessing import Pool
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from common.pagegraph import (
+    load_compact_page_graph,
+    UrlIndex,
+    NO_NODE,
+    SCRIPT_NODE,
+    EXTERNAL_FILE_SCRIPT,
+    REQUEST_START_EDGE,
+    REQUEST_COMPLETE_EDGE,
+    CROSS_DOM_EDGE,
+    EXECUTE_EDGE,
+    CREATE_NODE_EDGE,
+    INSERT_NODE_EDGE
+)
+from common.s3cache import S3Cache, add_cache_arguments
+from common.checkpoint import add_checkpoint_arguments, pending_entries
 
-def edges_to_mapping(edges):
-    mapping = dict()
-    for edge in edges:
-        if edge[1] in mapping:
-            mapping[edge[1]].append(edge)
-        else:
-            mapping[edge[1]] = [edge]
+# utility functions
+def get_image_node(url_index, resource_url):
+    return url_index.images.get(resource_url)
 
-    return mapping
+def get_remote_frame_node(url_index, frame_url):
+    return url_index.frames.get(frame_url)
 
-def get_resource_nodes(all_nodes):
-    resource_nodes = []
+def is_external_script(node, page_graph):
+    return page_graph.node_types[node] == SCRIPT_NODE and page_graph.script_types[node] == EXTERNAL_FILE_SCRIPT
 
-    for node in all_nodes:
-        node_info = node[1]
-        if node_info['node type'] == 'resource':
-            decoded_resource_url = html.unescape(node_info['url'])
-            while decoded_resource_url != html.unescape(decoded_resource_url):
-                decoded_resource_url = html.unescape(decoded_resource_url)
+def get_injector(node, page_graph):
+    # scripts are either executed or created, everything else is created
+    if page_graph.node_types[node] == SCRIPT_NODE:
+        return page_graph.first_in_neighbor(node, (EXECUTE_EDGE, CREATE_NODE_EDGE))
 
-            node_info['url'] = decoded_resource_url
-            resource_nodes.append(node)
+    return page_graph.first_in_neighbor(node, (CREATE_NODE_EDGE,))
 
-    return resource_nodes
+def is_safe_script(node, page_graph):
+    # the script makes at most two modifications outside of what it created itself
+    created_nodes = page_graph.out_neighbors(node, (CREATE_NODE_EDGE,))
+    nodes_created_by_script = set(page_graph.dom_node_ids[created_nodes].tolist())
 
-def get_remote_frame_nodes(all_nodes):
-    remote_frame_nodes = []
-    for node in all_nodes:
-        node_info = node[1]
-        if node_info['node type'] == 'remote frame':
-            decoded_resource_url = html.unescape(node_info['url'])
-            while decoded_resource_url != html.unescape(decoded_resource_url):
-                decoded_resource_url = html.unescape(decoded_resource_url)
+    insert_edges = page_graph.out_edges_of_type(node, (INSERT_NODE_EDGE,))
+    parents_to_nodes_created_by_script = set(page_graph.edge_parents[insert_edges].tolist())
 
-            node_info['url'] = decoded_resource_url
-            remote_frame_nodes.append(node)
+    parents_not_created_by_script = parents_to_nodes_created_by_script.difference(nodes_created_by_script)
+    return len(parents_not_created_by_script) <= 2
+
+class ChainWalker:
+    # walks injector chains of a single page graph. ads injected by the same
+    # scripts share the upper part of their chains, so the injector of every
+    # node, the chain above it and the safe_to_remove results are memoized.
+    # all walks are iterative and stop at cycles, so deep or cyclic graphs
+    # can't hit the recursion limit
+    def __init__(self, page_graph):
+        self.page_graph = page_graph
+        self.injectors = dict()
+        self.chains = dict()
+        self.safe = dict()
+        self.script_urls = dict()
+
+    def injector(self, node):
+        if node not in self.injectors:
+            self.injectors[node] = get_injector(node, self.page_graph)
+        return self.injectors[node]
+
+    def injector_chain(self, node):
+        # the injectors above node, up to but without the root
+        path = []
+        seen = {node}
+        current = node
+        cyclic = False
+        while current not in self.chains:
+            injector_node = self.injector(current)
+            if injector_node == NO_NODE or injector_node == self.page_graph.root:
+                self.chains[current] = ()
+                break
+            if injector_node in seen:
+                cyclic = True
+                break
 
-    return remote_frame_nodes
+            seen.add(injector_node)
+            path.append(current)
+            current = injector_node
+
+        chain = () if cyclic else self.chains[current]
+        for path_node in reversed(path):
+            chain = (self.injector(path_node),) + chain
+            # a chain that was cut at a cycle depends on where the walk started
+            if not cyclic:
+                self.chains[path_node] = chain
+
+        return list(chain)
+
+    def new_starting_node(self, node, script_url):
+        # the first external script from node upwards which was loaded from script_url
+        for current in [node] + self.injector_chain(node):
+            if is_external_script(current, self.page_graph) and self.script_url(current) == script_url:
+                return current
+
+        return None
+
+    def script_url(self, node):
+        if node not in self.script_urls:
+            script_url = find_script_request_url(node, self.page_graph)
+            self.script_urls[node] = self.page_graph.urls[node] if script_url is None else script_url
+        return self.script_urls[node]
+
+    def safe_to_remove(self, node):
+        # a script is safe to remove if it and every script it created,
+        # directly or through other scripts, is safe on its own
+        if node in self.safe:
+            return self.safe[node]
+
+        page_graph = self.page_graph
+        visited = {node}
+        stack = [node]
+        while stack:
+            current = stack.pop()
+            if self.safe.get(current):
+                continue
 
-def get_image_node(resource_nodes, value_edges, resource_url):
-    for resource in resource_nodes:
-        node_id = resource[0]
-        node_info = resource[1]
-        if node_info['url'] == resource_url:
-            return node_id
+            if self.safe.get(current) is False or not is_safe_script(current, page_graph):
+                self.safe[node] = False
+                return False
+
+            created_nodes = page_graph.out_neighbors(current, (CREATE_NODE_EDGE,))
+            for script_node in created_nodes[page_graph.node_types[created_nodes] == SCRIPT_NODE].tolist():
+                if script_node not in visited:
+                    visited.add(script_node)
+                    stack.append(script_node)
+
+        # every script reachable from a visited node was safe
+        for visited_node in visited:
+            self.safe[visited_node] = True
+        return True
+
+
+# which classifications are ads in each mode. only the lists mode starts its
+# chains at the script that blocks them (chain_element_block)
+MODES = {
+    'lists': 'is_classified_as_ad_combined_filter_lists',
+    'us_difference_lists': '(is_classified_as_ad and (not is_classified_as_ad_combined_filter_lists))',
+    'everything': 'true'
+}
+
+# the output files of each direction as (mode, chains, file name), where chains
+# is either the upstream (cut) chains or the original ones
+OUTPUTS = {
+    'downstream': [('everything', 'original', 'downstream_everything.json')],
+    'upstream': [
+        ('lists', 'upstream', 'upstream_lists.json'),
+        ('us_difference_lists', 'upstream', 'upstream_us_difference_lists.json')
+    ]
+}
+
+def get_ads(pg_conn, modes):
+    # a single query for all modes, every row says which modes it is an ad in.
+    # the resource url and type of the output come from image_data_table,
+    # joined in here instead of being looked up per image afterwards
+    ad_cur = pg_conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+    ad_cur.execute(
+        'select c.imaged_data, c.page_url, c.resource_url, c.resource_type, c.frame_url, c.chain_element_block, ' +
+        'i.resource_url as image_resource_url, i.resource_type as image_resource_type, ' +
+        ', '.join(MODES[mode] + ' as ' + mode for mode in modes) +
+        ' from classifications c left join lateral (select resource_url, resource_type from image_data_table' +
+        ' where image_data_table.imaged_data = c.imaged_data limit 1) i on true' +
+        ' where ' + ' or '.join(MODES[mode] for mode in modes)
+    )
 
-    for edge in value_edges:
-        node_id = edge[1]
-        edge_info = edge[2]
-        if edge_info['value'] == resource_url:
-            return node_id
+    ads = dict()
+    for ad in ad_cur.fetchall():
+        page_ads, resources = ads.setdefault(ad['page_url'], (dict(), dict()))
+        resources[ad['imaged_data']] = (ad['image_resource_url'], ad['image_resource_type'])
+        for mode in modes:
+            if ad[mode]:
+                chain_element_block = ad['chain_element_block'] if mode == 'lists' else None
+                page_ads.setdefault(mode, []).append((ad['imaged_data'], ad['resource_url'], ad['resource_type'], chain_element_block))
 
-    return None
+    ad_cur.close()
+    return ads
 
-def get_remote_frame_node(frame_nodes, frame_url):
-    for frame in frame_nodes:
-        node_id = frame[0]
-        node_info = frame[1]
-        if node_info['url'] == frame_url:
-            return node_id
+def get_graphml_files(pg_conn, page_urls):
+    dict_cur = pg_conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+    dict_cur.execute('select distinct on (queried_url) queried_url, file_name from graphml_mappings where queried_url = ANY(%s) order by queried_url, id', [page_urls])
+    graphml_files = {row['queried_url']: row['file_name'] for row in dict_cur.fetchall()}
+    dict_cur.close()
+    return graphml_files
+
+def get_injector_chains(ads, page_graph, url_index, walker):
+    injector_chains = dict()
+    for imaged_data, resource_url, resource_type, chain_element_block in ads:
+        if resource_type == 'image':
+            resource_node = get_image_node(url_index, resource_url)
+            if resource_node is None:
+                continue
+            starting_node = page_graph.first_in_neighbor(resource_node, (REQUEST_START_EDGE,))
+        else:
+            frame_node = get_remote_frame_node(url_index, resource_url)
+            if frame_node is None:
+                continue
+            starting_node = page_graph.first_in_neighbor(frame_node, (CROSS_DOM_EDGE,))
 
-    return None
+        if starting_node == NO_NODE:
+            continue
 
-def get_value_edges(all_edges):
-    value_edges = []
-    for edge in all_edges:
-        if 'value' in edge[2]:
-            decoded_url = html.unescape(edge[2]['value'])
-            while decoded_url != html.unescape(decoded_url):
-                decoded_url = html.unescape(decoded_url)
-
-            edge[2]['value'] = decoded_url
-            value_edges.append(edge)
-
-    return value_edges
-
-def is_modifying_edge(edge):
-    edge_type = edge[2]['edge type']
-    return (
-        edge_type == 'set attribute'
-        or edge_type == 'delete attribute'
-        or edge_type == 'remove node'
-        or edge_type == 'delete node'
-    )
+        if chain_element_block is not None:
+            new_starting_node = walker.new_starting_node(starting_node, chain_element_block)
+            if new_starting_node is not None:
+                starting_node = new_starting_node
+
+        injector_chains[imaged_data] = walker.injector_chain(starting_node)
+
+    return injector_chains
+
+def get_page_chains(local_file, page_ads):
+    # the chains of every mode from a single parse of the page graph, the
+    # walker is shared so that modes reuse each other's walks
+    try:
+        page_graph = load_compact_page_graph(local_file)
+        url_index = UrlIndex(page_graph)
+        walker = ChainWalker(page_graph)
+    except Exception:
+        return dict()
+
+    page_chains = dict()
+    for mode in page_ads:
+        try:
+            injector_chains = get_injector_chains(page_ads[mode], page_graph, url_index, walker)
+        except Exception:
+            continue
 
-def is_event_listener_edge(edge):
-    edge_type = edge[2]['edge type']
-    return edge_type == 'add event listener' or edge_type == 'remove event listener'
-
-def is_creation_edge(edge):
-    return edge[2]['edge type'] == 'create node' or edge[2]['edge type'] == 'insert node'
-
-def get_injector_chain(node, injectors, all_nodes, to_edges_mapping):
-    injector_node = None
-    if node in to_edges_mapping:
-        if all_nodes[node]['node type'] == 'script':
-            for edge in to_edges_mapping[node]:
-                if 'edge type' in edge[2] and edge[2]['edge type'] == 'execute':
-                    injector_node = edge[0]
-                    injectors.append(injector_node)
-                    break
-                elif 'edge type' in edge[2] and edge[2]['edge type'] == 'create node':
-                    injector_node = edge[0]
-                    injectors.append(injector_node)
-                    break
-        else:
-            for edge in to_edges_mapping[node]:
-                if 'edge type' in edge[2] and edge[2]['edge type'] == 'create node':
-                    injector_node = edge[0]
-                    injectors.append(injector_node)
-                    break
+        # now, cut the injector chains to only store the ones which
+        # makes no other modifications
+        cutted_chains = cut(injector_chains, walker)
+        page_chains[mode] = {
+            'upstream': gen_script_chains(cutted_chains, walker),
+            'original': gen_script_chains(injector_chains, walker)
+        }
 
-    if injector_node is not None and injector_node != 'n1':
-        get_injector_chain(injector_node, injectors, all_nodes, to_edges_mapping)
+    return page_chains
 
-    if injectors[-1] == 'n1':
-        return injectors[:-1]
+def with_resources(chains, resources):
+    return {imaged_data: [resources[imaged_data][0], resources[imaged_data][1], chain] for imaged_data, chain in chains.items()}
 
-    return injectors
+def process_page(s3_cache, bucket, page_url, graphml_path, page_ads, resources):
+    # the etag of the page graph is returned as its content hash, None when
+    # the file could not be fetched
+    try:
+        local_file, content_hash = s3_cache.fetch_with_etag(bucket, graphml_path)
+    except Exception:
+        return page_url, graphml_path, None, dict()
 
-def get_new_starting_node(node, script_url, all_nodes, to_edges_mapping):
-    if all_nodes[node]['node type'] == 'script' and all_nodes[node]['script type'] == 'external file':
-        node_script_url = find_script_request_url(node, all_nodes, to_edges_mapping)
-        if node_script_url is None:
-            node_script_url = all_nodes[node]['url']
+    page_chains = get_page_chains(local_file, page_ads)
+    for mode in page_chains:
+        for chains in page_chains[mode]:
+            page_chains[mode][chains] = with_resources(page_chains[mode][chains], resources)
 
-        if node_script_url == script_url:
-            return node
+    return page_url, graphml_path, content_hash, page_chains
 
-    start_node = None
-    if node in to_edges_mapping:
-        if all_nodes[node]['node type'] == 'script':
-            for edge in to_edges_mapping[node]:
-                if 'edge type' in edge[2] and edge[2]['edge type'] == 'execute':
-                    start_node = edge[0]
-                    break
-                elif 'edge type' in edge[2] and edge[2]['edge type'] == 'create node':
-                    start_node = edge[0]
-                    break
-        else:
-            for edge in to_edges_mapping[node]:
-                if 'edge type' in edge[2] and edge[2]['edge type'] == 'create node':
-                    start_node = edge[0]
-                    break
+def open_s3_cache(s3_options):
+    aws_access_key, aws_secret_key, cache_dir, cache_size = s3_options
+    s3Bucket = S3FileSystem(anon=False, key=aws_access_key, secret=aws_secret_key)
+    return S3Cache(s3Bucket.s3, cache_dir, cache_size)
 
-    if start_node is not None and start_node != 'n1':
-        return get_new_starting_node(start_node, script_url, all_nodes, to_edges_mapping)
+# state of a worker process, set up once by init_worker
+worker = dict()
 
-    return None
+def init_worker(s3_options):
+    worker['s3_cache'] = open_s3_cache(s3_options)
 
+def process_page_in_worker(task):
+    return process_page(worker['s3_cache'], *task)
 
-def generate_chains(bucket, s3, filter_list):
+def generate_chains(bucket, s3_options, modes, workers=1, processed=None, resume=False, incremental=False):
+    # yields (page url, graphml file, content hash, chains per mode) as pages
+    # finish, so that the results can be written out instead of being kept
+    # around for every page
     pg_conn = psycopg2.connect(os.environ['PG_CONNECTION_STRING'])
-    dict_cur = pg_conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
-    ad_cur = pg_conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
 
-    upstream_chains = dict()
-    original_script_chains = dict()
-    ads = dict()
-    if filter_list == 'lists':
-        print(filter_list)
-        ad_cur.execute('select imaged_data, page_url, resource_url, resource_type, frame_url, chain_element_block from classifications where is_classified_as_ad_combined_filter_lists')
-    elif filter_list == 'us_difference_lists':
-        print(filter_list)
-        ad_cur.execute('select imaged_data, page_url, resource_url, resource_type, frame_url from classifications where (is_classified_as_ad and (not is_classified_as_ad_combined_filter_lists))')
-    elif filter_list == 'everything':
-        print(filter_list)
-        ad_cur.execute('select imaged_data, page_url, resource_url, resource_type, frame_url from classifications')
+    print(', '.join(modes))
+    ads = get_ads(pg_conn, modes)
+    graphml_files = get_graphml_files(pg_conn, list(ads))
+    pg_conn.close()
+
+    s3_cache = open_s3_cache(s3_options) if workers <= 1 or incremental else None
+    entries = [{'queried_url': page_url, 'file_name': graphml_files[page_url]} for page_url in ads if page_url in graphml_files]
+    if resume or incremental:
+        entries = pending_entries(entries, processed or dict(), resume, incremental, lambda file_name: s3_cache.etag(bucket, file_name))
+        print('pages left to process: ' + str(len(entries)))
+
+    tasks = [(bucket, entry['queried_url'], entry['file_name']) + ads[entry['queried_url']] for entry in entries]
+    if workers > 1:
+        with Pool(workers, initializer=init_worker, initargs=(s3_options,)) as pool:
+            yield from reported(tqdm(pool.imap_unordered(process_page_in_worker, tasks), total=len(tasks)))
     else:
-        print('PANIC! Got unknown command: ' + filter_list)
-        sys.exit(1)
-
-    for ad in ad_cur.fetchall():
-        ad_data = None
-        if 'chain_element_block' in ad:
-            ad_data = (ad['imaged_data'], ad['resource_url'], ad['resource_type'], ad['chain_element_block'])
-        else:
-            ad_data = (ad['imaged_data'], ad['resource_url'], ad['resource_type'], None)
-        if ad['page_url'] in ads:
-            ads[ad['page_url']].append(ad_data)
-        else:
-            ads[ad['page_url']] = [ad_data]
-
-    for page_url in tqdm(ads):
-        dict_cur.execute('select file_name from graphml_mappings where queried_url=%s', [page_url])
-        data = dict_cur.fetchone()
-        if data is None:
-            continue
-
-        graphml_path = data['file_name']
-        with TemporaryDirectory() as temp_dir:
-            local_file = os.path.join(temp_dir, graphml_path.split('/')[-1])
-            try:
-                s3.s3.download_file(bucket, graphml_path, local_file)
-            except Exception as e:
-                print('cannot find file ' + graphml_path)
+        yield from reported(process_page(s3_cache, *task) for task in tqdm(tasks))
+
+def reported(results):
+    # the workers don't print, the pages whose file couldn't be fetched are
+    # reported here, in the process that draws the progress bar
+    for result in results:
+        if result[2] is None:
+            print('cannot find file ' + result[1])
+        yield result
+
+def ndjson_path(json_path):
+    return os.path.splitext(json_path)[0] + '.ndjson'
+
+def read_checkpoint(checkpoint_path, outputs, regions_folder):
+    # the checkpoint has a [graphml file, content hash, ndjson sizes] line per
+    # processed page. the ndjson files are cut back to the sizes of the last
+    # line, dropping pages that were written but not checkpointed
+    processed = dict()
+    sizes = dict()
+    if os.path.exists(checkpoint_path):
+        with open(checkpoint_path, 'r') as checkpoint_file:
+            for line in checkpoint_file:
+                try:
+                    graphml_path, content_hash, sizes = json.loads(line)
+                except ValueError:
+                    # the last line can be cut off
+                    break
+                processed[graphml_path] = content_hash
+
+    for _mode, _mode_chains, file_name in outputs:
+        output_path = ndjson_path(os.path.join(regions_folder, file_name))
+        with open(output_path, 'a') as output_file:
+            output_file.truncate(sizes.get(file_name, 0))
+
+    return processed
+
+def write_chains(chains, outputs, regions_folder, checkpoint_path, append=False):
+    # every page is appended to the ndjson file of each output as soon as it is
+    # done, the json files the checkers read are assembled from those at the end
+    file_mode = 'a' if append else 'w'
+    output_files = [(mode, mode_chains, file_name, open(ndjson_path(os.path.join(regions_folder, file_name)), file_mode)) for mode, mode_chains, file_name in outputs]
+    with open(checkpoint_path, file_mode) as checkpoint_file:
+        for page_url, graphml_path, content_hash, page_chains in chains:
+            for mode, mode_chains, _file_name, output_file in output_files:
+                if mode in page_chains:
+                    output_file.write(json.dumps([page_url, page_chains[mode][mode_chains]]) + '\n')
+
+            if content_hash is None:
                 continue
 
-            all_nodes = None
-            with open(local_file, 'r') as graphml_file:
-                page_graph_data = ''
-                for line in graphml_file:
-                    page_graph_data += line
-
-                try:
-                    page_graph = graphml.parse_graphml(page_graph_data)
-                    all_nodes = page_graph.nodes(data=True)
-                    all_edges = page_graph.edges(data=True)
-                    value_edges = get_value_edges(all_edges)
-                    edges_to_map = edges_to_mapping(all_edges)
-
-                    all_resource_nodes = get_resource_nodes(all_nodes)
-                    all_remote_frames = get_remote_frame_nodes(all_nodes)
-
-                    injector_chains = dict()
-                    for imaged_data, resource_url, resource_type, chain_element_block in ads[page_url]:
-                        starting_node = None
-                        if resource_type == 'image':
-                            resource_node = get_image_node(all_resource_nodes, value_edges, resource_url)
-                            if resource_node is None:
-                                continue
-                            for edge in edges_to_map[resource_node]:
-                                if edge[2]['edge type'] == 'request start':
-                                    starting_node = edge[0]
-                                    break
-                        else:
-                            frame_node = get_remote_frame_node(all_remote_frames, resource_url)
-                            if frame_node is None:
-                                continue
-                            for edge in edges_to_map[frame_node]:
-                                if edge[2]['edge type'] == 'cross DOM':
-                                    starting_node = edge[0]
-                                    break
-
-                        if starting_node is None:
-                            continue
-
-                        if chain_element_block is None:
-                            injector_chains[imaged_data] = get_injector_chain(starting_node, [], all_nodes, edges_to_map)
-                        else:
-                            new_starting_node = get_new_starting_node(starting_node, chain_element_block, all_nodes, edges_to_map)
-                            if new_starting_node is None:
-                                injector_chains[imaged_data] = get_injector_chain(starting_node, [], all_nodes, edges_to_map)
-                            else:
-                                injector_chains[imaged_data] = get_injector_chain(new_starting_node, [], all_nodes, edges_to_map)
-
-                except e:
-                    continue
-
-                # now, cut the injector chains to only store the ones which
-                # makes no other modifications
-                from_edges_mapping = edges_from_mapping(all_edges)
-                original_script_chains[page_url] = gen_script_chains(injector_chains, all_nodes, edges_to_map)
-                cutted_chains = cut(injector_chains, from_edges_mapping, all_nodes)
-                script_chains = gen_script_chains(cutted_chains, all_nodes, edges_to_map)
-                upstream_chains[page_url] = script_chains
-
-    return upstream_chains, original_script_chains
-
-def cut(injector_chains, from_edges_mapping, all_nodes):
-    all_injector_nodes = set()
-    for start_node in injector_chains:
-        all_injector_nodes.add(start_node)
-        for node in injector_chains[start_node]:
-            all_injector_nodes.add(node)
+            # the page only counts as done once its lines are on disk
+            for _mode, _mode_chains, _file_name, output_file in output_files:
+                output_file.flush()
+            sizes = {file_name: output_file.tell() for _mode, _mode_chains, file_name, output_file in output_files}
+            checkpoint_file.write(json.dumps([graphml_path, content_hash, sizes]) + '\n')
+            checkpoint_file.flush()
+
+    for _mode, _mode_chains, _file_name, output_file in output_files:
+        output_file.close()
+
+    for _mode, _mode_chains, file_name in outputs:
+        output_path = os.path.join(regions_folder, file_name)
+        ndjson_to_json(ndjson_path(output_path), output_path)
+
+def ndjson_to_json(input_path, output_path):
+    # one page at a time, the ndjson lines are [page url, chains] pairs. a page
+    # that was processed again (--incremental) is taken from its last line
+    last_lines = dict()
+    with open(input_path, 'r') as input_file:
+        for i, line in enumerate(input_file):
+            last_lines[json.loads(line)[0]] = i
+
+    with open(input_path, 'r') as input_file, open(output_path, 'w') as output_file:
+        output_file.write('{')
+        first = True
+        for i, line in enumerate(input_file):
+            page_url, chains = json.loads(line)
+            if last_lines[page_url] != i:
+                continue
+            output_file.write(('' if first else ', ') + json.dumps(page_url) + ': ' + json.dumps(chains))
+            first = False
+        output_file.write('}')
 
+def cut(injector_chains, walker):
     cutted_chains = dict()
     for start_node in injector_chains:
         found_cut = False
         current_chain = injector_chains[start_node]
         for i in range(0, len(current_chain)):
-            if not safe_to_remove(current_chain[i], from_edges_mapping, all_nodes):
+            if not walker.safe_to_remove(current_chain[i]):
                 found_cut = True
                 cutted_chains[start_node] = current_chain[:i]
                 break
@@ -307,92 +404,38 @@ def cut(injector_chains, from_edges_mapping, all_nodes):
 
     return cutted_chains
 
-def find_script_request_url(node, all_nodes, to_edges):
-    execute_node = None
-    for edge in to_edges[node]:
-        if 'edge type' in edge[2] and edge[2]['edge type'] == 'execute':
-            execute_node = edge[0]
-            break
-
-    if execute_node is not None:
-        request_node = None
-        for edge in to_edges[execute_node]:
-            if 'edge type' in edge[2] and edge[2]['edge type'] == 'request complete':
-                request_node = edge[0]
-                break
-
-        if request_node is not None:
-            if 'url' in all_nodes[request_node]:
-                return all_nodes[request_node]['url']
+def find_script_request_url(node, page_graph):
+    execute_node = page_graph.first_in_neighbor(node, (EXECUTE_EDGE,))
+    if execute_node != NO_NODE:
+        request_node = page_graph.first_in_neighbor(execute_node, (REQUEST_COMPLETE_EDGE,))
+        if request_node != NO_NODE:
+            return page_graph.urls[request_node]
 
     return None
 
 
-def gen_script_chains(chains, all_nodes, to_edges):
+def gen_script_chains(chains, walker):
     script_resources = dict()
 
     for start_node in chains:
         current_chain = chains[start_node]
-        scripts = []
-        for node in current_chain:
-            if all_nodes[node]['node type'] == 'script' and all_nodes[node]['script type'] == 'external file':
-                script_url = find_script_request_url(node, all_nodes, to_edges)
-                if script_url is None:
-                    scripts.append(all_nodes[node]['url'])
-                else:
-                    scripts.append(script_url)
-
-        script_resources[start_node] = scripts
+        script_resources[start_node] = [walker.script_url(node) for node in current_chain if is_external_script(node, walker.page_graph)]
 
     return script_resources
 
-def safe_to_remove(node, from_edges_mapping, all_nodes):
-    nodes_created_by_script = set()
-    parents_to_nodes_created_by_script = set()
-    scripts_from_node = set()
-
-    for edge in from_edges_mapping[node]:
-        if edge[2]['edge type'] == 'create node':
-            graphml_node = edge[1]
-            actual_id = all_nodes[graphml_node]['node id']
-            nodes_created_by_script.add(actual_id)
-            if all_nodes[graphml_node]['node type'] == 'script':
-                scripts_from_node.add(graphml_node)
-        elif edge[2]['edge type'] == 'insert node':
-            parents_to_nodes_created_by_script.add(edge[2]['parent'])
-
-    scripts_safe_to_remove = all(safe_to_remove(script_node, from_edges_mapping, all_nodes) for script_node in scripts_from_node)
-    parents_not_created_by_script = parents_to_nodes_created_by_script.difference(nodes_created_by_script)
-    return len(parents_not_created_by_script) <= 2 and scripts_safe_to_remove
-
-
-def update(input_dict):
-    pg_conn = psycopg2.connect(os.environ['PG_CONNECTION_STRING'])
-    dict_cur = pg_conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
-    output_dict = dict()
-    for key in tqdm(input_dict):
-        page_dict = input_dict[key]
-        updated_page_dict = dict()
-        for img in page_dict:
-            chain = page_dict[img]
-            dict_cur.execute('select resource_url, resource_type from image_data_table where imaged_data=%s', [img])
-            data = dict_cur.fetchone()
-            updated_page_dict[img] = [data['resource_url'], data['resource_type'], chain]
-
-        output_dict[key] = updated_page_dict
-
-    return output_dict
-
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description='Generates the nodes which corresponds to ads')
     parser.add_argument('--aws-access-key', help='aws access key')
     parser.add_argument('--aws-secret-key', help='aws secret key')
     parser.add_argument('--pg-bucket', help='aws bucket address')
     parser.add_argument('--region', help='region to generate for')
-    parser.add_argument('--direction', help='generate upstream or downstream')
+    parser.add_argument('--direction', choices=['upstream', 'downstream', 'both'], default='upstream', help='generate upstream, downstream or both in a single pass')
+    parser.add_argument('--workers', type=int, default=1, help='amount of worker processes to generate chains with')
+    add_checkpoint_arguments(parser)
+    add_cache_arguments(parser)
 
     args = parser.parse_args()
-    s3Bucket = S3FileSystem(anon=False, key=args.aws_access_key, secret=args.aws_secret_key)
+    s3_options = (args.aws_access_key, args.aws_secret_key, args.cache_dir, args.cache_size)
 
     resources_folder = os.path.join('..', 'chains_resources')
     if not os.path.isdir(resources_folder):
@@ -402,18 +445,9 @@ if __name__ == "__main__":
     if not os.path.isdir(regions_folder):
         os.mkdir(regions_folder)
 
-    if args.direction == 'downstream':
-        upstream_everything, original_everything = generate_chains(args.pg_bucket, s3Bucket, 'everything')
-        output_path = os.path.join(regions_folder, 'downstream_everything.json')
-        with open(output_path, 'w') as original:
-            json.dump(update(original_everything), original)
-    else:
-        upstream_intersection, original_intersection = generate_chains(args.pg_bucket, s3Bucket, 'lists')
-        output_path = os.path.join(regions_folder, 'upstream_lists.json')
-        with open(output_path, 'w') as upstream:
-            json.dump(update(upstream_intersection), upstream)
-
-        upstream_us_difference_lists, original_us_difference_lists = generate_chains(args.pg_bucket, s3Bucket, 'us_difference_lists')
-        output_path = os.path.join(regions_folder, 'upstream_us_difference_lists.json')
-        with open(output_path, 'w') as upstream:
-            json.dump(update(upstream_us_difference_lists), upstream)
\ No newline at end of file
+    outputs = OUTPUTS[args.direction] if args.direction in OUTPUTS else OUTPUTS['downstream'] + OUTPUTS['upstream']
+    # every page graph is fetched and parsed once, for all modes
+    checkpoint_path = os.path.join(regions_folder, 'checkpoint_' + args.direction + '.ndjson')
+    processed = read_checkpoint(checkpoint_path, outputs, regions_folder) if args.resume or args.incremental else dict()
+    chains = generate_chains(args.pg_bucket, s3_options, sorted(set(mode for mode, _chains, _file_name in outputs)), args.workers, processed, args.resume, args.incremental)
+    write_chains(chains, outputs, regions_folder, checkpoint_path, args.resume or args.incremental)
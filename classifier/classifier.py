@@ -1,92 +1,155 @@
 import numpy
 from sklearn.model_selection import KFold
-from sklearn.metrics import classification_report, precision_recall_fscore_support, roc_auc_score
+from sklearn.metrics import precision_recall_fscore_support, roc_auc_score
 from sklearn import svm
 from sklearn.ensemble import RandomForestClassifier, GradientBoostingClassifier
+from sklearn.impute import SimpleImputer
+from sklearn.pipeline import make_pipeline
+from sklearn.preprocessing import StandardScaler
 
+import argparse
+import hashlib
+import joblib
+import json
 import os
+import sys
+import time
+
+from multiprocessing import Pool
 import psycopg2
 import psycopg2.extras
-from psycopg2.extensions import AsIs
 from tqdm import tqdm
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from common.pgwriter import BufferedWriter
+from common.schema import CLASSIFICATIONS_COLUMNS, ordered_columns
+
 ads = set()
 non_ads = set()
 
+# the features the classifier is trained on, in order, with how each column
+# of image_features is turned into a number:
+#   value: the value itself
+#   flag: 1 if the value is true, 0 otherwise
+#   not_null: 1 if the value is set at all, 0 otherwise
+FEATURE_COLUMNS = [
+    ('in_degree', 'value'),
+    ('in_average_degree_connectivity', 'value'),
+    ('out_degree', 'value'),
+    ('out_average_degree_connectivity', 'value'),
+    ('in_out_degree', 'value'),
+    ('in_out_average_degree_connectivity', 'value'),
+    ('is_modified_by_script', 'not_null'),
+    ('parent_in_degree', 'value'),
+    ('parent_in_average_degree_connectivity', 'value'),
+    ('parent_out_degree', 'value'),
+    ('parent_out_average_degree_connectivity', 'value'),
+    ('parent_in_out_degree', 'value'),
+    ('parent_in_out_average_degree_connectivity', 'value'),
+    ('parent_modified_by_script', 'not_null'),
+    ('is_classified_as_ad', 'flag'),
+    ('ad_probability', 'value'),
+    ('nodes', 'value'),
+    ('edges', 'value'),
+    ('nodes_edge_ratio', 'value'),
+    ('width', 'value'),
+    ('height', 'value'),
+    ('standard_ad_width', 'flag'),
+    ('standard_ad_height', 'flag'),
+    ('standard_ad_size', 'flag'),
+    ('length_of_url', 'value'),
+    ('is_subdomain', 'flag'),
+    ('is_third_party', 'flag'),
+    ('base_domain_in_query_string', 'flag'),
+    ('semi_colon_in_query_string', 'flag'),
+    ('is_iframe', 'flag')
+]
+
+FEATURE_QUERY_COLUMNS = ', '.join(column for column, _kind in FEATURE_COLUMNS)
+
+DEFAULT_CHUNK_SIZE = 10000
+
+MODEL_FAMILIES = ['random_forest', 'gradient_boosting', 'svm']
+
+VECTOR_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'vector_cache')
+DEFAULT_MODEL_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'models')
+
+# training data per resource type, relative to the working directory
+TRAINING_DATA = {
+    'image': ('ads_images.csv', 'nonads_images.csv'),
+    'iframe': ('ads_frames.csv', 'nonads_frames.csv')
+}
+
+def feature_value(value, kind):
+    if kind == 'flag':
+        return 1 if value else 0
+    elif kind == 'not_null':
+        return 0 if value is None else 1
+
+    # NULL becomes nan in the float matrix
+    return numpy.nan if value is None else value
+
+def read_training_lines(training_file):
+    with open(training_file, 'r') as input_file:
+        return [line.strip() for line in input_file.readlines()]
+
+def feature_schema_hash():
+    # changes whenever a feature column is added, removed, reordered or encoded differently
+    return hashlib.sha256(repr(FEATURE_COLUMNS).encode('utf-8')).hexdigest()
+
+def training_data_hash(ads_training, nonads_training):
+    digest = hashlib.sha256()
+    for training_file in [ads_training, nonads_training]:
+        with open(training_file, 'rb') as input_file:
+            digest.update(hashlib.sha256(input_file.read()).digest())
+
+    return digest.hexdigest()
+
+def training_cache_path(ads_training, nonads_training):
+    digest = hashlib.sha256((feature_schema_hash() + training_data_hash(ads_training, nonads_training)).encode('utf-8'))
+    return os.path.join(VECTOR_CACHE_DIR, digest.hexdigest() + '.npz')
+
 def initiate_vectors(ads_training, nonads_training):
-    all_features = []
-    all_labels = []
-    ads = 0
-    non_ads = 0
-    pg_conn = psycopg2.connect(os.environ['PG_CONNECTION_STRING_TRAINING_DATA'])
-    dict_cur = pg_conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+    cache_path = training_cache_path(ads_training, nonads_training)
+    if os.path.exists(cache_path):
+        with numpy.load(cache_path) as cached:
+            X, Y = cached['X'], cached['Y']
+        print('training vectors loaded from ' + cache_path)
+    else:
+        X, Y = load_vectors(ads_training, nonads_training)
+        os.makedirs(VECTOR_CACHE_DIR, exist_ok=True)
+        numpy.savez(cache_path, X=X, Y=Y)
 
-    with open(ads_training, 'r') as input_file:
-        for line in tqdm(input_file.readlines()):
-            line = line.strip()
-            dict_cur.execute('select * from image_features where imaged_data = %s', [line])
-            data = dict_cur.fetchone()
-            if data is None:
-                continue
-
-            features = get_features(data)
-            all_features.append(features)
-            all_labels.append(1)
-            ads += 1
-
-    with open(nonads_training, 'r') as input_file:
-        for line in tqdm(input_file.readlines()):
-            line = line.strip()
-            dict_cur.execute('select * from image_features where imaged_data = %s', [line])
-            data = dict_cur.fetchone()
-            if data is None:
-                continue
-
-            features = get_features(data)
-            all_features.append(features)
-            all_labels.append(0)
-            non_ads += 1
+    print('training ads: ' + str(int(Y.sum())))
+    print('training non ads: ' + str(int(len(Y) - Y.sum())))
+    return X, Y
 
-    dict_cur.close()
+def load_vectors(ads_training, nonads_training):
+    ads_lines = read_training_lines(ads_training)
+    nonads_lines = read_training_lines(nonads_training)
+
+    pg_conn = psycopg2.connect(os.environ['PG_CONNECTION_STRING_TRAINING_DATA'])
+    cur = pg_conn.cursor()
+    # a single query for all labels, with one row per image like the old fetchone
+    cur.execute(
+        'select distinct on (imaged_data) imaged_data, ' + FEATURE_QUERY_COLUMNS + ' from image_features where imaged_data = ANY(%s)',
+        [list(set(ads_lines + nonads_lines))]
+    )
+    rows = {row[0]: row[1:] for row in cur.fetchall()}
+    cur.close()
     pg_conn.close()
-    print('training ads: ' + str(ads))
-    print('training non ads: ' + str(non_ads))
-    return numpy.array(all_features), numpy.array(all_labels)
+
+    labelled = [(line, 1) for line in ads_lines if line in rows] + [(line, 0) for line in nonads_lines if line in rows]
+    X = numpy.empty((len(labelled), len(FEATURE_COLUMNS)), dtype=numpy.float32)
+    Y = numpy.empty(len(labelled), dtype=numpy.int64)
+    for i, (line, label) in enumerate(tqdm(labelled)):
+        X[i] = [feature_value(value, kind) for value, (_column, kind) in zip(rows[line], FEATURE_COLUMNS)]
+        Y[i] = label
+
+    return X, Y
 
 def get_features(data):
-    features = []
-    features.append(data['in_degree'])
-    features.append(data['in_average_degree_connectivity'])
-    features.append(data['out_degree'])
-    features.append(data['out_average_degree_connectivity'])
-    features.append(data['in_out_degree'])
-    features.append(data['in_out_average_degree_connectivity'])
-    features.append(0 if data['is_modified_by_script'] is None else 1)
-    features.append(data['parent_in_degree'])
-    features.append(data['parent_in_average_degree_connectivity'])
-    features.append(data['parent_out_degree'])
-    features.append(data['parent_out_average_degree_connectivity'])
-    features.append(data['parent_in_out_degree'])
-    features.append(data['parent_in_out_average_degree_connectivity'])
-    features.append(0 if data['parent_modified_by_script'] is None else 1)
-    features.append(1 if data['is_classified_as_ad'] else 0)
-    features.append(data['ad_probability'])
-    features.append(data['nodes'])
-    features.append(data['edges'])
-    features.append(data['nodes_edge_ratio'])
-    features.append(data['width'])
-    features.append(data['height'])
-    features.append(1 if data['standard_ad_width'] else 0)
-    features.append(1 if data['standard_ad_height'] else 0)
-    features.append(1 if data['standard_ad_size'] else 0)
-    features.append(data['length_of_url'])
-    features.append(1 if data['is_subdomain'] else 0)
-    features.append(1 if data['is_third_party'] else 0)
-    features.append(1 if data['base_domain_in_query_string'] else 0)
-    features.append(1 if data['semi_colon_in_query_string'] else 0)
-    features.append(1 if data['is_iframe'] else 0)
-
-    return features
+    return [feature_value(data[column], kind) for column, kind in FEATURE_COLUMNS]
 
 def split_s3_path(s3path):
     path_parts = s3path.replace('s3://', '').split('/')
@@ -94,101 +157,243 @@ def split_s3_path(s3path):
     key = '/'.join(path_parts)
     return bucket, key
 
-def run_classifier_with_kFold(X, Y, k):
-    kf = KFold(n_splits=k, shuffle=True)
-    target_names = ['non-ad', 'ad']
-    recall = 0
-    precision = 0
-    f1_score = 0
-    roc_auc = 0
-    for train_index, test_index in kf.split(X):
-        #print("TRAIN:", train_index, "TEST:", test_index)
-        X_train, X_test = X[train_index], X[test_index]
-        Y_train, Y_test = Y[train_index], Y[test_index]
-
-        clf_rand_forest = RandomForestClassifier(n_estimators=100).fit(X_train, Y_train)
-        Y_pred_rand_forest = clf_rand_forest.predict(X_test)
-        print(classification_report(Y_test, Y_pred_rand_forest, target_names=target_names))
-        prec, rec, f1, _sup = precision_recall_fscore_support(Y_test, Y_pred_rand_forest)
-        precision += sum(prec)
-        recall += sum(rec)
-        f1_score += sum(f1)
-        roc_auc += roc_auc_score(Y_test, Y_pred_rand_forest)
-
-    print ('average precision: ' + str(precision / (k * 2)))
-    print ('average recall: ' + str(recall / (k * 2)))
-    print ('average f1-score: ' + str(f1_score / (k * 2)))
-    print ('average roc_auc_score: ' + str(roc_auc / k))
-
-def run_classifier(ads_training, nonads_training, resource_type):
+def build_model(family, n_estimators):
+    # the forest handles missing values itself, the other families need them filled in
+    if family == 'random_forest':
+        return RandomForestClassifier(n_estimators=n_estimators, class_weight='balanced', n_jobs=1)
+    elif family == 'gradient_boosting':
+        return make_pipeline(SimpleImputer(), GradientBoostingClassifier(n_estimators=n_estimators))
+    elif family == 'svm':
+        return make_pipeline(SimpleImputer(), StandardScaler(), svm.SVC(class_weight='balanced'))
+
+    raise ValueError('unknown model family ' + family)
+
+def model_scores(model, X):
+    if hasattr(model, 'predict_proba'):
+        return model.predict_proba(X)[:, 1]
+    return model.decision_function(X)
+
+# training set of an evaluation worker, sent once by init_evaluation_worker
+evaluation = dict()
+
+def init_evaluation_worker(X, Y):
+    evaluation['X'] = X
+    evaluation['Y'] = Y
+
+def evaluate_fold(family, n_estimators, fold, train_index, test_index):
+    X, Y = evaluation['X'], evaluation['Y']
+    model = build_model(family, n_estimators)
+
+    start = time.perf_counter()
+    model.fit(X[train_index], Y[train_index])
+    fit_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    Y_pred = model.predict(X[test_index])
+    scores = model_scores(model, X[test_index])
+    predict_time = time.perf_counter() - start
+
+    precision, recall, f1, support = precision_recall_fscore_support(Y[test_index], Y_pred, labels=[0, 1], zero_division=0)
+    return {
+        'family': family,
+        'n_estimators': n_estimators,
+        'fold': fold,
+        'precision': precision.tolist(),
+        'recall': recall.tolist(),
+        'f1': f1.tolist(),
+        'support': support.tolist(),
+        'roc_auc': float(roc_auc_score(Y[test_index], scores)) if len(set(Y[test_index])) == 2 else None,
+        'fit_time': fit_time,
+        'predict_time': predict_time,
+        'predict_time_per_image': predict_time / len(test_index)
+    }
+
+def evaluate_fold_task(task):
+    return evaluate_fold(*task)
+
+def summarize_folds(folds):
+    summary = dict()
+    for metric in ['precision', 'recall', 'f1']:
+        values = numpy.array([fold[metric] for fold in folds])
+        # averaged over both classes and all folds, like the old report
+        summary[metric] = float(values.mean())
+        summary[metric + '_ad'] = float(values[:, 1].mean())
+    roc_auc = [fold['roc_auc'] for fold in folds if fold['roc_auc'] is not None]
+    summary['roc_auc'] = float(numpy.mean(roc_auc)) if roc_auc else None
+    for timing in ['fit_time', 'predict_time', 'predict_time_per_image']:
+        summary[timing] = float(numpy.mean([fold[timing] for fold in folds]))
+
+    return summary
+
+def evaluate_models(X, Y, k, families, estimators, workers, seed=0):
+    kf = KFold(n_splits=k, shuffle=True, random_state=seed)
+    splits = list(kf.split(X))
+    configurations = []
+    for family in families:
+        # the svm has no estimator count to sweep
+        for n_estimators in (estimators if family != 'svm' else [None]):
+            configurations.append((family, n_estimators))
+
+    tasks = [
+        (family, n_estimators, fold, train_index, test_index)
+        for family, n_estimators in configurations
+        for fold, (train_index, test_index) in enumerate(splits)
+    ]
+
+    start = time.perf_counter()
+    with Pool(workers, initializer=init_evaluation_worker, initargs=(X, Y)) as pool:
+        folds = list(tqdm(pool.imap(evaluate_fold_task, tasks), total=len(tasks)))
+    wall_time = time.perf_counter() - start
+
+    results = []
+    for family, n_estimators in configurations:
+        config_folds = [fold for fold in folds if fold['family'] == family and fold['n_estimators'] == n_estimators]
+        summary = summarize_folds(config_folds)
+        print(family + (' ' + str(n_estimators) if n_estimators else '') + ': precision ' + str(round(summary['precision'], 4)) +
+            ', recall ' + str(round(summary['recall'], 4)) + ', f1 ' + str(round(summary['f1'], 4)) +
+            ', roc_auc ' + str(summary['roc_auc'] and round(summary['roc_auc'], 4)) + ', fit ' + str(round(summary['fit_time'], 2)) + 's')
+        results.append({'family': family, 'n_estimators': n_estimators, 'summary': summary, 'folds': config_folds})
+
+    return {'k': k, 'seed': seed, 'samples': len(Y), 'ads': int(Y.sum()), 'workers': workers, 'wall_time': wall_time, 'models': results}
+
+def predict_labels(classifier, X):
+    # same as classifier.predict, but from the probabilities of the whole chunk
+    probabilities = classifier.predict_proba(X)
+    return classifier.classes_[numpy.argmax(probabilities, axis=1)]
+
+def read_feature_chunks(pg_conn, resource_type, chunk_size):
+    # a named cursor keeps the rows on the server, so only one chunk is in memory
+    cur = pg_conn.cursor(name='image_features_' + resource_type)
+    cur.itersize = chunk_size
+    cur.execute(
+        'select distinct on (imaged_data) imaged_data, ' + FEATURE_QUERY_COLUMNS + ' from image_features where resource_type=%s order by imaged_data',
+        [resource_type]
+    )
+    while True:
+        rows = cur.fetchmany(chunk_size)
+        if not rows:
+            break
+
+        X = numpy.empty((len(rows), len(FEATURE_COLUMNS)), dtype=numpy.float32)
+        for i, row in enumerate(rows):
+            X[i] = [feature_value(value, kind) for value, (_column, kind) in zip(row[1:], FEATURE_COLUMNS)]
+        yield [row[0] for row in rows], X
+
+    cur.close()
+
+def training_files(resource_type):
+    ads_training, nonads_training = TRAINING_DATA[resource_type]
+    return os.path.join(os.getcwd(), 'training_data', ads_training), os.path.join(os.getcwd(), 'training_data', nonads_training)
+
+def model_path(model_dir, resource_type):
+    return os.path.join(model_dir, resource_type + '.joblib')
+
+def train_model(ads_training, nonads_training, n_jobs=-1):
     X, Y = initiate_vectors(ads_training, nonads_training)
-    classifier = RandomForestClassifier(n_estimators=100, class_weight='balanced').fit(X, Y)
-    pg_conn = psycopg2.connect(os.environ['PG_CONNECTION_STRING_CLASSIFICATION_DATA'])
-    dict_cur = pg_conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
-    ads = set()
-    non_ads = set()
-    dict_cur.execute('select * from image_features where resource_type=%s', [resource_type])
-    for img_data in tqdm(dict_cur.fetchall()):
-        classification = classifier.predict([get_features(img_data)])[0]
-        if classification == 1:
-            ads.add(img_data['imaged_data'])
-        else:
-            non_ads.add(img_data['imaged_data'])
+    return RandomForestClassifier(n_estimators=100, class_weight='balanced', n_jobs=n_jobs).fit(X, Y)
 
-    dict_cur.close()
-    pg_conn.close()
+def save_model(classifier, path, ads_training, nonads_training):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # no compression, so that the tree arrays can be memory-mapped when loading
+    joblib.dump({
+        'model': classifier,
+        'feature_columns': FEATURE_COLUMNS,
+        'feature_schema': feature_schema_hash(),
+        'training_data': training_data_hash(ads_training, nonads_training)
+    }, path)
+    print('model saved to ' + path)
 
-    return ads, non_ads
+def load_model(path, n_jobs=-1):
+    if not os.path.exists(path):
+        sys.exit('no model at ' + path + ', run the train command first')
 
+    artifact = joblib.load(path, mmap_mode='r')
+    if artifact['feature_schema'] != feature_schema_hash():
+        sys.exit('the model at ' + path + ' was trained on different feature columns, run the train command again')
 
-def insert_classification(ads, non_ads):
-    pg_conn = psycopg2.connect(os.environ['PG_CONNECTION_STRING_CLASSIFICATION_DATA'])
+    classifier = artifact['model']
+    classifier.n_jobs = n_jobs
+    print('model loaded from ' + path + ', training data ' + artifact['training_data'][:12])
+    return classifier
+
+def run_classifier(ads_training, nonads_training, resource_type, chunk_size=DEFAULT_CHUNK_SIZE, n_jobs=-1):
+    classifier = train_model(ads_training, nonads_training, n_jobs)
+    return score_images(classifier, resource_type, chunk_size)
+
+def score_images(classifier, resource_type, chunk_size=DEFAULT_CHUNK_SIZE):
+    read_conn = psycopg2.connect(os.environ['PG_CONNECTION_STRING_CLASSIFICATION_DATA'])
+    write_conn = psycopg2.connect(os.environ['PG_CONNECTION_STRING_CLASSIFICATION_DATA'])
+    columns = ordered_columns(CLASSIFICATIONS_COLUMNS, ['page_url', 'resource_url', 'resource_type', 'frame_url', 'imaged_data', 'is_classified_as_ad'])
+    ads = 0
+    non_ads = 0
+    with BufferedWriter(write_conn, 'classifications', columns) as writer:
+        for imaged_data, X in tqdm(read_feature_chunks(read_conn, resource_type, chunk_size)):
+            labels = predict_labels(classifier, X)
+            insert_classification(write_conn, writer, dict(zip(imaged_data, (bool(label == 1) for label in labels))))
+            ads += int((labels == 1).sum())
+            non_ads += int((labels != 1).sum())
+
+    read_conn.close()
+    write_conn.close()
+
+    print(resource_type + ' ads: ' + str(ads))
+    print(resource_type + ' non ads: ' + str(non_ads))
+    return ads, non_ads
+
+def insert_classification(pg_conn, writer, labels):
+    # one lookup for the whole chunk instead of one per image
     dict_cur = pg_conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
-    for ad in tqdm(ads):
-        dict_cur.execute('select page_url, resource_url, resource_type, frame_url from image_data_table where imaged_data=%s', [ad])
-        data = dict_cur.fetchone()
-        if data is not None:
-            data['is_classified_as_ad'] = True
-            data['imaged_data'] = ad
-            columns = data.keys()
-            values = [data[column] for column in columns]
-            query = 'INSERT INTO classifications (%s) VALUES %s'
-            cur = pg_conn.cursor()
-            cur.execute(query, (AsIs(','.join(columns)), tuple(values)))
-
-            pg_conn.commit()
-
-    for non_ad in tqdm(non_ads):
-        dict_cur.execute('select page_url, resource_url, resource_type, frame_url from image_data_table where imaged_data=%s', [non_ad])
-        data = dict_cur.fetchone()
-        if data is not None:
-            data['is_classified_as_ad'] = False
-            data['imaged_data'] = non_ad
-            columns = data.keys()
-            values = [data[column] for column in columns]
-            query = 'INSERT INTO classifications (%s) VALUES %s'
-            cur = pg_conn.cursor()
-            cur.execute(query, (AsIs(','.join(columns)), tuple(values)))
-
-            pg_conn.commit()
+    dict_cur.execute(
+        'select distinct on (imaged_data) page_url, resource_url, resource_type, frame_url, imaged_data from image_data_table where imaged_data = ANY(%s)',
+        [list(labels)]
+    )
+    for data in dict_cur.fetchall():
+        data['is_classified_as_ad'] = labels[data['imaged_data']]
+        writer.write(data)
 
     dict_cur.close()
-    pg_conn.close()
 
 if __name__ == "__main__":
-    ads_images = os.path.join(os.getcwd(), 'training_data', 'ads_images.csv')
-    nonads_images = os.path.join(os.getcwd(), 'training_data', 'nonads_images.csv')
-    ads_frames = os.path.join(os.getcwd(), 'training_data', 'ads_frames.csv')
-    nonads_frames = os.path.join(os.getcwd(), 'training_data', 'nonads_frames.csv')
-
-    #X, Y = initiate_vectors(ads_images, nonads_images)
-    #run_classifier_with_kFold(X, Y, 3)
+    parser = argparse.ArgumentParser(description='Classify the extracted image features as ad or non ad.')
+    parser.add_argument('--resource-type', choices=sorted(TRAINING_DATA), action='append', help='only handle this resource type, can be repeated (default: all)')
+    parser.add_argument('--model-dir', default=DEFAULT_MODEL_DIR, help='folder the trained models are kept in')
+    parser.add_argument('--jobs', type=int, default=-1, help='number of cores the random forest uses, -1 for all of them')
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.add_parser('train', help='train the models and save them to the model folder')
+    score_parser = subparsers.add_parser('score', help='classify image_features with the saved models')
+    score_parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE, help='number of images read and scored at once')
+    evaluate_parser = subparsers.add_parser('evaluate', help='compare model families with k-fold cross validation on the training data')
+    evaluate_parser.add_argument('--folds', type=int, default=3, help='number of folds')
+    evaluate_parser.add_argument('--models', type=lambda value: value.split(','), default=['random_forest'], help='comma separated model families: random_forest, gradient_boosting, svm')
+    evaluate_parser.add_argument('--estimators', type=lambda value: [int(n) for n in value.split(',')], default=[100], help='comma separated estimator counts to try')
+    evaluate_parser.add_argument('--workers', type=int, default=os.cpu_count(), help='number of folds evaluated in parallel')
+    evaluate_parser.add_argument('--seed', type=int, default=0, help='seed of the fold split')
+    evaluate_parser.add_argument('--report', default='evaluation.json', help='file the JSON report is written to')
+    args = parser.parse_args()
+    if args.command == 'evaluate' and not set(args.models) <= set(MODEL_FAMILIES):
+        parser.error('--models should be a subset of ' + ', '.join(MODEL_FAMILIES))
 
-    #X, Y = initiate_vectors(ads_frames, nonads_frames)
-    #run_classifier_with_kFold(X, Y, 3)
+    resource_types = args.resource_type or ['image', 'iframe']
 
-    ads, non_ads = run_classifier(ads_images, nonads_images, 'image')
-    insert_classification(ads, non_ads)
+    report = dict()
+    for resource_type in resource_types:
+        if args.command == 'evaluate':
+            print('evaluating ' + resource_type)
+            X, Y = initiate_vectors(*training_files(resource_type))
+            report[resource_type] = evaluate_models(X, Y, args.folds, args.models, args.estimators, args.workers, args.seed)
+        elif args.command == 'train':
+            ads_training, nonads_training = training_files(resource_type)
+            classifier = train_model(ads_training, nonads_training, args.jobs)
+            save_model(classifier, model_path(args.model_dir, resource_type), ads_training, nonads_training)
+        elif args.command == 'score':
+            classifier = load_model(model_path(args.model_dir, resource_type), args.jobs)
+            score_images(classifier, resource_type, args.chunk_size)
+        else:
+            # without a command, train and classify in one go like before
+            ads_training, nonads_training = training_files(resource_type)
+            run_classifier(ads_training, nonads_training, resource_type, DEFAULT_CHUNK_SIZE, args.jobs)
 
-    ads, non_ads = run_classifier(ads_frames, nonads_frames, 'iframe')
-    insert_classification(ads, non_ads)
\ No newline at end of file
+    if args.command == 'evaluate':
+        with open(args.report, 'w') as report_file:
+            json.dump(report, report_file, indent=2)
+        print('report written to ' + args.report)
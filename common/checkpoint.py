@@ -0,0 +1,53 @@
+from concurrent.futures import ThreadPoolExecutor
+
+# amount of etags looked up at once when checking for changed files
+ETAG_LOOKUPS = 16
+
+def add_checkpoint_arguments(parser):
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument('--resume', action='store_true', help='skip the page graph files an earlier run already processed')
+    group.add_argument('--incremental', action='store_true', help='only process page graph files that are new or changed since the last run')
+
+def pending_entries(entries, processed, resume, incremental, etag):
+    # entries are dicts with a file_name, processed maps file names to the etag
+    # they were processed with and etag(file_name) looks up the current one
+    if resume:
+        return [entry for entry in entries if entry['file_name'] not in processed]
+    if not incremental:
+        return entries
+
+    def changed(entry):
+        try:
+            return etag(entry['file_name']) != processed[entry['file_name']]
+        except Exception:
+            # let the run itself report the missing file
+            return True
+
+    seen = [entry for entry in entries if entry['file_name'] in processed]
+    with ThreadPoolExecutor(max_workers=ETAG_LOOKUPS) as executor:
+        changed_files = set(entry['file_name'] for entry, is_changed in zip(seen, executor.map(changed, seen)) if is_changed)
+
+    return [entry for entry in entries if entry['file_name'] not in processed or entry['file_name'] in changed_files]
+
+class ProcessedPages:
+    # the processed_pages table, marks are written in the transaction of the
+    # caller so that they are committed together with the page's results
+    def __init__(self, pg_conn, job):
+        self.pg_conn = pg_conn
+        self.job = job
+
+    def load(self):
+        cur = self.pg_conn.cursor()
+        cur.execute('select file_name, content_hash from processed_pages where job=%s', [self.job])
+        processed = dict(cur.fetchall())
+        cur.close()
+        return processed
+
+    def mark(self, file_name, content_hash):
+        cur = self.pg_conn.cursor()
+        cur.execute(
+            'insert into processed_pages (job, file_name, content_hash) values (%s, %s, %s) ' +
+            'on conflict (job, file_name) do update set content_hash = excluded.content_hash, processed_at = now()',
+            [self.job, file_name, content_hash]
+        )
+        cur.close()
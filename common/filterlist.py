@@ -0,0 +1,717 @@
+import hashlib
+import itertools
+import json
+import mmap
+import os
+import re
+import struct
+import sys
+import tempfile
+import zlib
+
+from array import array
+from functools import lru_cache
+
+from common.urls import hostname, public_suffix, registrable_domain
+
+# request types, as bits of the type mask of a filter
+REQUEST_TYPES = [
+    'other',
+    'script',
+    'image',
+    'stylesheet',
+    'object',
+    'subdocument',
+    'xmlhttprequest',
+    'websocket',
+    'ping',
+    'media',
+    'font',
+    'webrtc',
+    'document',
+    'popup'
+]
+TYPE_BITS = {request_type: 1 << i for i, request_type in enumerate(REQUEST_TYPES)}
+
+# other names of the request types, in the filters and in the checkers
+TYPE_ALIASES = {
+    'xhr': 'xmlhttprequest',
+    'css': 'stylesheet',
+    'frame': 'subdocument',
+    'sub_frame': 'subdocument',
+    'iframe': 'subdocument',
+    'object-subrequest': 'object',
+    'beacon': 'ping',
+    'doc': 'document',
+    'main_frame': 'document'
+}
+
+# filters without type options don't apply to documents and popups
+DEFAULT_TYPES = sum(TYPE_BITS.values()) & ~TYPE_BITS['document'] & ~TYPE_BITS['popup']
+
+# options that change nothing about whether a request is blocked
+IGNORED_OPTIONS = {'collapse', '~collapse', 'redirect', 'empty', 'mp4', 'all'}
+
+# options of filters that don't block requests (content security policies,
+# cosmetic exceptions, rewriting), those filters are skipped
+SKIPPED_OPTIONS = {
+    'csp',
+    'elemhide',
+    'ehide',
+    'generichide',
+    'ghide',
+    'specifichide',
+    'shide',
+    'genericblock',
+    'inline-script',
+    'inline-font',
+    'removeparam',
+    'rewrite',
+    'replace',
+    'redirect-rule'
+}
+
+# flags of a filter
+EXCEPTION = 1
+IMPORTANT = 2
+HOSTNAME_ANCHOR = 4
+LEFT_ANCHOR = 8
+RIGHT_ANCHOR = 16
+THIRD_PARTY = 32
+FIRST_PARTY = 64
+MATCH_CASE = 128
+REGEX = 256
+
+def token_hash(token):
+    # stable between runs, unlike hash()
+    return zlib.crc32(token.encode('utf-8'))
+
+# tokens found in most urls, a filter is only put in their bucket when it has no other
+COMMON_TOKENS = set(token_hash(token) for token in [
+    'http', 'https', 'www', 'com', 'net', 'org', 'html', 'php', 'js', 'css',
+    'jpg', 'jpeg', 'png', 'gif', 'images', 'image', 'img', 'static', 'cdn', 'assets'
+])
+
+COSMETIC_RE = re.compile(r'#@?[$?%]?#')
+TOKEN_RE = re.compile(r'[a-z0-9%]+')
+SEPARATOR = r'(?:[^A-Za-z0-9_\-.%]|$)'
+HOSTNAME_PREFIX = r'^[a-z][a-z0-9+.\-]*:(?://)?(?:[^/?#]*\.)?'
+
+def host_suffixes(host):
+    labels = host.split('.')
+    return [('.'.join(labels[i:])) for i in range(len(labels))]
+
+@lru_cache(maxsize=100000)
+def source_domains(host):
+    # every value of a $domain option that matches a page on host: the host and
+    # its parent domains, and the entities (google.*) of those without the
+    # public suffix
+    domains = set(host_suffixes(host))
+    suffix = public_suffix(host)
+    if suffix and host.endswith('.' + suffix):
+        domains.update(entity + '.*' for entity in host_suffixes(host[:-len(suffix) - 1]))
+    return frozenset(domains)
+
+@lru_cache(maxsize=100000)
+def source_domain_hashes(host):
+    return frozenset(token_hash(domain) for domain in source_domains(host))
+
+class NetworkFilter:
+    __slots__ = ['text', 'pattern', 'flags', 'types', 'domains', 'not_domains', 'lists', '_regex']
+
+    def __init__(self, text, pattern, flags, types, domains, not_domains):
+        self.text = text
+        self.pattern = pattern
+        self.flags = flags
+        self.types = types
+        self.domains = domains
+        self.not_domains = not_domains
+        # the lists of a MultiListEngine the filter is in, as bits
+        self.lists = 1
+        self._regex = None
+
+    def tokens(self):
+        # the tokens of the pattern that a matching url must contain as a whole,
+        # a token next to a wildcard or an unanchored end could be part of a longer one
+        if self.flags & REGEX:
+            return []
+
+        pattern = self.pattern.lower()
+        tokens = []
+        for match in TOKEN_RE.finditer(pattern):
+            start, end = match.span()
+            if start == 0 and not self.flags & (HOSTNAME_ANCHOR | LEFT_ANCHOR):
+                continue
+            if start > 0 and pattern[start - 1] == '*':
+                continue
+            if end == len(pattern) and not self.flags & RIGHT_ANCHOR:
+                continue
+            if end < len(pattern) and pattern[end] == '*':
+                continue
+            tokens.append(match.group())
+
+        return tokens
+
+    def regex(self):
+        if self._regex is None:
+            if self.flags & REGEX:
+                source = self.pattern
+            else:
+                parts = []
+                for part in re.split(r'(\*|\^)', self.pattern):
+                    if part == '*':
+                        parts.append('.*')
+                    elif part == '^':
+                        parts.append(SEPARATOR)
+                    else:
+                        parts.append(re.escape(part))
+                source = ''.join(parts)
+                if self.flags & HOSTNAME_ANCHOR:
+                    source = HOSTNAME_PREFIX + source
+                elif self.flags & LEFT_ANCHOR:
+                    source = '^' + source
+                if self.flags & RIGHT_ANCHOR:
+                    source += '$'
+
+            self._regex = re.compile(source, 0 if self.flags & MATCH_CASE else re.IGNORECASE)
+        return self._regex
+
+    def matches(self, request):
+        if not self.types & request.type_bit:
+            return False
+        if self.flags & THIRD_PARTY and not request.third_party():
+            return False
+        if self.flags & FIRST_PARTY and request.third_party():
+            return False
+        if self.domains is not None and self.domains.isdisjoint(request.source_domains):
+            return False
+        if self.not_domains is not None and not self.not_domains.isdisjoint(request.source_domains):
+            return False
+        return self.matches_url(request)
+
+    def on_every_page(self):
+        return not self.flags & (THIRD_PARTY | FIRST_PARTY) and self.domains is None and self.not_domains is None
+
+    def matches_url(self, request):
+        # the pattern alone, whatever the page and type of the request. plain
+        # patterns are a substring test, everything else a regex
+        if not self.flags & (REGEX | HOSTNAME_ANCHOR | LEFT_ANCHOR | RIGHT_ANCHOR) and '*' not in self.pattern and '^' not in self.pattern:
+            if self.flags & MATCH_CASE:
+                return self.pattern in request.url
+            return self.pattern in request.lower_url
+
+        return self.regex().search(request.url) is not None
+
+# kinds of the lines of a filter list
+COMMENT = 'comment'
+NETWORK = 'network'
+NETWORK_EXCEPTION = 'network exception'
+COSMETIC = 'cosmetic'
+COSMETIC_EXCEPTION = 'cosmetic exception'
+
+def rule_kind(line):
+    line = line.strip()
+    if not line or line.startswith('!') or line.startswith('['):
+        return COMMENT
+    cosmetic = COSMETIC_RE.search(line)
+    if cosmetic is not None:
+        return COSMETIC_EXCEPTION if '@' in cosmetic.group() else COSMETIC
+    return NETWORK_EXCEPTION if line.startswith('@@') else NETWORK
+
+def parse_filter(line):
+    # a NetworkFilter, the text of the filter disabled by a $badfilter, or None
+    # for comments, cosmetic filters and filters that never block a request
+    line = line.strip()
+    if not line or line.startswith('!') or line.startswith('[') or COSMETIC_RE.search(line):
+        return None
+
+    flags = 0
+    text = line
+    if line.startswith('@@'):
+        flags |= EXCEPTION
+        line = line[2:]
+
+    options = []
+    if line.startswith('/') and line.endswith('/') and len(line) > 1:
+        pass
+    elif '$' in line:
+        line, option_text = line.rsplit('$', 1)
+        options = option_text.split(',')
+
+    types = 0
+    not_types = 0
+    domains = None
+    not_domains = None
+    badfilter = False
+    for option in options:
+        option = option.strip()
+        name = option.split('=', 1)[0]
+        if name in SKIPPED_OPTIONS or name.lstrip('~') in SKIPPED_OPTIONS:
+            return None
+        elif option in IGNORED_OPTIONS or name in IGNORED_OPTIONS:
+            continue
+        elif option in ('third-party', '3p', '~first-party', '~1p'):
+            flags |= THIRD_PARTY
+        elif option in ('~third-party', '~3p', 'first-party', '1p'):
+            flags |= FIRST_PARTY
+        elif option == 'match-case':
+            flags |= MATCH_CASE
+        elif option == 'important':
+            flags |= IMPORTANT
+        elif option == 'badfilter':
+            badfilter = True
+        elif name == 'domain':
+            for domain in option[len('domain='):].lower().split('|'):
+                if domain.startswith('~'):
+                    not_domains = (not_domains or frozenset()) | {domain[1:]}
+                elif domain:
+                    domains = (domains or frozenset()) | {domain}
+        else:
+            negated = option.startswith('~')
+            request_type = TYPE_ALIASES.get(option.lstrip('~'), option.lstrip('~'))
+            if request_type not in TYPE_BITS:
+                # unknown option, better to skip the filter than to block too much
+                return None
+            if negated:
+                not_types |= TYPE_BITS[request_type]
+            else:
+                types |= TYPE_BITS[request_type]
+
+    if types == 0:
+        types = DEFAULT_TYPES
+    types &= ~not_types
+
+    if line.startswith('/') and line.endswith('/') and len(line) > 1:
+        flags |= REGEX
+        line = line[1:-1]
+    else:
+        if line.startswith('||'):
+            flags |= HOSTNAME_ANCHOR
+            line = line[2:]
+        elif line.startswith('|'):
+            flags |= LEFT_ANCHOR
+            line = line[1:]
+        if line.endswith('|'):
+            flags |= RIGHT_ANCHOR
+            line = line[:-1]
+        # leading and trailing wildcards change nothing
+        line = line.strip('*') if not flags & (HOSTNAME_ANCHOR | LEFT_ANCHOR | RIGHT_ANCHOR) else line
+
+    if not flags & (MATCH_CASE | REGEX):
+        line = line.lower()
+
+    network_filter = NetworkFilter(text, line, flags, types, domains, not_domains)
+    if flags & REGEX:
+        try:
+            network_filter.regex()
+        except re.error:
+            return None
+
+    if badfilter:
+        remaining = [option for option in options if option.strip() != 'badfilter']
+        return text.rsplit('$', 1)[0] + ('$' + ','.join(remaining) if remaining else '')
+
+    return network_filter
+
+class Request:
+    __slots__ = ['url', 'lower_url', 'source_url', 'type_bit', 'host', 'source_host', 'source_domains', 'source_domain_hashes', '_third_party', '_tokens']
+
+    def __init__(self, url, source_url, request_type):
+        self.url = url
+        self.lower_url = url.lower()
+        self.source_url = source_url
+        request_type = TYPE_ALIASES.get(request_type, request_type)
+        self.type_bit = TYPE_BITS.get(request_type, TYPE_BITS['other'])
+        self.host = hostname(url)
+        self.source_host = hostname(source_url)
+        self.source_domains = source_domains(self.source_host)
+        self.source_domain_hashes = source_domain_hashes(self.source_host)
+        self._third_party = None
+        self._tokens = None
+
+    def third_party(self):
+        if self._third_party is None:
+            self._third_party = registrable_domain(self.host) != registrable_domain(self.source_host)
+        return self._third_party
+
+    def token_hashes(self):
+        if self._tokens is None:
+            self._tokens = set(token_hash(token) for token in TOKEN_RE.findall(self.lower_url))
+        return self._tokens
+
+class FilterIndex:
+    # filters in buckets by the hash of one of their tokens, the rarest one, so
+    # that a request only tests the filters of the tokens in its url and the
+    # few filters without any token. filters limited to some sites with $domain
+    # are in buckets by those sites instead, looked up by the page of the request
+    def __init__(self, filters):
+        counts = dict()
+        filter_tokens = []
+        for network_filter in filters:
+            tokens = set(token_hash(token) for token in network_filter.tokens())
+            filter_tokens.append(tokens)
+            for token in tokens:
+                counts[token] = counts.get(token, 0) + 1
+
+        self.filters = filters
+        self.buckets = dict()
+        self.domain_buckets = dict()
+        self.fallback = []
+        for i, tokens in enumerate(filter_tokens):
+            if filters[i].domains is not None:
+                for domain in filters[i].domains:
+                    self.domain_buckets.setdefault(token_hash(domain), []).append(i)
+            elif tokens:
+                self.buckets.setdefault(min(tokens, key=lambda token: (token in COMMON_TOKENS, counts[token])), []).append(i)
+            else:
+                self.fallback.append(i)
+        self._site_buckets = None
+
+    def __len__(self):
+        return len(self.filters)
+
+    def filter(self, i):
+        return self.filters[i]
+
+    def candidates(self, request):
+        for token in request.token_hashes():
+            bucket = self.buckets.get(token)
+            if bucket is not None:
+                yield from bucket
+        for domain in request.source_domain_hashes:
+            bucket = self.domain_buckets.get(domain)
+            if bucket is not None:
+                yield from bucket
+        yield from self.fallback
+
+    def first_match(self, request):
+        for i in self.candidates(request):
+            network_filter = self.filter(i)
+            if network_filter.matches(request):
+                return network_filter
+        return None
+
+    def first_match_on_every_page(self, request):
+        # a filter that matches the request whichever page it is on
+        for i in self.candidates(request):
+            network_filter = self.filter(i)
+            if network_filter.on_every_page() and network_filter.matches(request):
+                return network_filter
+        return None
+
+    def site_buckets(self):
+        # the filters limited to some sites in buckets by their rarest token as
+        # well, to look them up whatever the page. only built when needed
+        if self._site_buckets is None:
+            ids = sorted(set(itertools.chain.from_iterable(self.domain_buckets.values())))
+            filter_tokens = [set(token_hash(token) for token in self.filter(i).tokens()) for i in ids]
+            counts = dict()
+            for tokens in filter_tokens:
+                for token in tokens:
+                    counts[token] = counts.get(token, 0) + 1
+
+            buckets = dict()
+            fallback = []
+            for i, tokens in zip(ids, filter_tokens):
+                if tokens:
+                    buckets.setdefault(min(tokens, key=lambda token: (token in COMMON_TOKENS, counts[token])), []).append(i)
+                else:
+                    fallback.append(i)
+            self._site_buckets = (buckets, fallback)
+        return self._site_buckets
+
+    def first_match_on_some_page(self, request):
+        # a filter that matches the request on at least one page, including the
+        # ones limited to other sites than that of the request
+        buckets, fallback = self.site_buckets()
+        site_candidates = itertools.chain.from_iterable(buckets.get(token, []) for token in request.token_hashes())
+        for i in itertools.chain(self.candidates(request), site_candidates, fallback):
+            network_filter = self.filter(i)
+            if network_filter.types & request.type_bit and network_filter.matches_url(request):
+                return network_filter
+        return None
+
+    def matching_lists(self, request, wanted):
+        # the lists, out of the wanted ones, with a filter matching the request.
+        # filters of lists that are already known are not tested
+        found = 0
+        for i in self.candidates(request):
+            network_filter = self.filter(i)
+            if network_filter.lists & wanted & ~found and network_filter.matches(request):
+                found |= network_filter.lists
+                if found & wanted == wanted:
+                    break
+        return found & wanted
+
+def parse_list(lines, parsed=None):
+    # the network filters of a list, without the ones its $badfilter filters
+    # disable. parsed keeps the filters of lines seen before, shared between lists
+    if parsed is None:
+        parsed = dict()
+
+    filters = []
+    bad_filters = set()
+    for line in lines:
+        if line in parsed:
+            network_filter = parsed[line]
+        else:
+            network_filter = parsed[line] = parse_filter(line)
+        if isinstance(network_filter, str):
+            bad_filters.add(network_filter)
+        elif network_filter is not None:
+            filters.append(network_filter)
+
+    return [network_filter for network_filter in filters if network_filter.text not in bad_filters]
+
+class FilterEngine:
+    # the network filters of a filter list (or several lists concatenated), with
+    # the same blocking semantics as adblock-rust: a request is blocked if a
+    # filter matches, unless an exception matches too and no $important one does
+    def __init__(self, lines):
+        self.index(parse_list(lines), 1)
+
+    def index(self, filters, all_lists):
+        self.all_lists = all_lists
+        self.important = FilterIndex([f for f in filters if f.flags & IMPORTANT and not f.flags & EXCEPTION])
+        self.blocking = FilterIndex([f for f in filters if not f.flags & (IMPORTANT | EXCEPTION)])
+        self.exceptions = FilterIndex([f for f in filters if f.flags & EXCEPTION])
+
+    def __len__(self):
+        return len(self.important) + len(self.blocking) + len(self.exceptions)
+
+    def matching_filter(self, url, source_url, request_type):
+        # the filter that blocks the request, None if it isn't blocked
+        request = Request(url, source_url, request_type)
+        important = self.important.first_match(request)
+        if important is not None:
+            return important
+
+        blocking = self.blocking.first_match(request)
+        if blocking is None or self.exceptions.first_match(request) is not None:
+            return None
+        return blocking
+
+    def check(self, url, source_url, request_type):
+        return self.matching_filter(url, source_url, request_type) is not None
+
+    def check_on_every_page(self, url, request_type):
+        # whether the request is blocked on every page that could make it: by
+        # filters without $third-party, $first-party and $domain, and without an
+        # exception that could undo them on any page
+        request = Request(url, '', request_type)
+        if self.important.first_match_on_every_page(request) is not None:
+            return True
+        if self.blocking.first_match_on_every_page(request) is None:
+            return False
+        return self.exceptions.first_match_on_some_page(request) is None
+
+    def matching_lists(self, url, source_url, request_type, lists=None):
+        # the lists (all of them, or those of the lists mask) that block the
+        # request, as bits, each list on its own: its exceptions only undo its
+        # own filters
+        wanted = self.all_lists if lists is None else lists & self.all_lists
+        request = Request(url, source_url, request_type)
+        important = self.important.matching_lists(request, wanted)
+        blocking = self.blocking.matching_lists(request, wanted & ~important)
+        exceptions = self.exceptions.matching_lists(request, blocking)
+        return important | (blocking & ~exceptions)
+
+class MultiListEngine(FilterEngine):
+    # several lists in one engine, list i is bit 1 << i of the lists of the
+    # filters, so that matching_lists checks a request against all of them in a
+    # single lookup. a filter in more than one list is only parsed and tested once
+    def __init__(self, lists):
+        parsed = dict()
+        filters = dict()
+        for i, lines in enumerate(lists):
+            for network_filter in parse_list(lines, parsed):
+                if network_filter.text not in filters:
+                    network_filter.lists = 0
+                    filters[network_filter.text] = network_filter
+                filters[network_filter.text].lists |= 1 << i
+
+        self.index(list(filters.values()), (1 << len(lists)) - 1)
+
+# engines are saved as snapshots named after a hash of the lines of the lists,
+# so reading the same lists again loads the snapshot instead of parsing them.
+# they are kept out of the S3 download cache, whose eviction would count them
+# and delete them while they are mmapped
+DEFAULT_SNAPSHOT_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'regional-filterlist-gen-engines')
+
+# part of the hash, change it whenever the parsing or the snapshot layout changes
+SNAPSHOT_VERSION = 2
+SNAPSHOT_MAGIC = b'RFGENGIN'
+INDEXES = ['important', 'blocking', 'exceptions']
+
+def add_snapshot_arguments(parser):
+    parser.add_argument('--snapshot-dir', default=DEFAULT_SNAPSHOT_DIR, help='folder to keep the parsed filter lists in')
+    parser.add_argument('--no-snapshots', dest='snapshot_dir', action='store_const', const=None, help='always parse the filter lists')
+
+def lists_hash(lists):
+    digest = hashlib.sha256(('%d %s %d\n' % (SNAPSHOT_VERSION, sys.byteorder, len(lists))).encode('utf-8'))
+    for lines in lists:
+        digest.update('\n'.join(lines).encode('utf-8'))
+        # not a character of a text file, lists can't run into each other
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+def aligned(size):
+    return (size + 7) & ~7
+
+def bucket_arrays(buckets, base):
+    # a dictionary of buckets as sorted keys, offsets into the ids and the ids
+    keys = array('I', sorted(buckets))
+    offsets = array('I', [0])
+    ids = array('I')
+    for key in keys:
+        ids.extend(base + i for i in buckets[key])
+        offsets.append(len(ids))
+    return keys, offsets, ids
+
+def save_snapshot(engine, path):
+    # the filters are stored as their text, the buckets as flat arrays of
+    # filter numbers, so that loading a snapshot is mostly a mmap
+    texts = []
+    lists = array('I')
+    sections = dict()
+    sizes = dict()
+    for name in INDEXES:
+        index = getattr(engine, name)
+        base = len(texts)
+        texts.extend(network_filter.text for network_filter in index.filters)
+        lists.extend(network_filter.lists for network_filter in index.filters)
+        sizes[name] = len(index.filters)
+        for kind, buckets in [('tokens', index.buckets), ('domains', index.domain_buckets)]:
+            keys, offsets, ids = bucket_arrays(buckets, base)
+            sections[name + '.' + kind + '.keys'] = keys
+            sections[name + '.' + kind + '.offsets'] = offsets
+            sections[name + '.' + kind + '.ids'] = ids
+        sections[name + '.fallback'] = array('I', [base + i for i in index.fallback])
+
+    encoded = [text.encode('utf-8') for text in texts]
+    text_offsets = array('I', [0])
+    for text in encoded:
+        text_offsets.append(text_offsets[-1] + len(text))
+    sections['text_offsets'] = text_offsets
+    sections['texts'] = b''.join(encoded)
+    sections['lists'] = lists
+
+    layout = dict()
+    offset = 0
+    for name, section in sections.items():
+        data = section if isinstance(section, bytes) else section.tobytes()
+        sections[name] = data
+        layout[name] = [offset, len(data)]
+        offset = aligned(offset + len(data))
+    header = json.dumps({'sizes': sizes, 'all_lists': engine.all_lists, 'sections': layout}).encode('utf-8')
+
+    folder = os.path.dirname(path)
+    os.makedirs(folder, exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(dir=folder, suffix='.part')
+    try:
+        with os.fdopen(fd, 'wb') as snapshot_file:
+            snapshot_file.write(SNAPSHOT_MAGIC + struct.pack('<I', len(header)) + header)
+            start = aligned(len(SNAPSHOT_MAGIC) + 4 + len(header))
+            for name, data in sections.items():
+                snapshot_file.seek(start + layout[name][0])
+                snapshot_file.write(data)
+        os.replace(temp_path, path)
+    except:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+class EngineSnapshot:
+    # a mmapped snapshot, the filters are only parsed the first time a request
+    # gets to them
+    def __init__(self, path):
+        with open(path, 'rb') as snapshot_file:
+            self.mmap = mmap.mmap(snapshot_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        view = memoryview(self.mmap)
+        if bytes(view[:len(SNAPSHOT_MAGIC)]) != SNAPSHOT_MAGIC:
+            raise ValueError('not a filter engine snapshot: ' + path)
+        header_size = struct.unpack('<I', view[len(SNAPSHOT_MAGIC):len(SNAPSHOT_MAGIC) + 4])[0]
+        header = json.loads(bytes(view[len(SNAPSHOT_MAGIC) + 4:len(SNAPSHOT_MAGIC) + 4 + header_size]))
+
+        start = aligned(len(SNAPSHOT_MAGIC) + 4 + header_size)
+        self.sizes = header['sizes']
+        self.all_lists = header['all_lists']
+        self.sections = {name: view[start + offset:start + offset + size] for name, (offset, size) in header['sections'].items()}
+        self.texts = self.sections['texts']
+        self.text_offsets = self.array('text_offsets')
+        self.lists = self.array('lists')
+        self.filters = dict()
+
+    def array(self, name):
+        return self.sections[name].cast('I')
+
+    def buckets(self, name):
+        return SnapshotBuckets(self.array(name + '.keys'), self.array(name + '.offsets'), self.array(name + '.ids'))
+
+    def filter(self, i):
+        network_filter = self.filters.get(i)
+        if network_filter is None:
+            text = bytes(self.texts[self.text_offsets[i]:self.text_offsets[i + 1]]).decode('utf-8')
+            network_filter = self.filters[i] = parse_filter(text)
+            network_filter.lists = self.lists[i]
+        return network_filter
+
+class SnapshotBuckets:
+    # the buckets of a snapshot, with the same get as a dictionary of lists
+    def __init__(self, keys, offsets, ids):
+        self.positions = dict(zip(keys, range(len(keys))))
+        self.offsets = offsets
+        self.ids = ids
+
+    def values(self):
+        return [self.ids[self.offsets[i]:self.offsets[i + 1]] for i in range(len(self.positions))]
+
+    def get(self, key):
+        i = self.positions.get(key)
+        if i is None:
+            return None
+        return self.ids[self.offsets[i]:self.offsets[i + 1]]
+
+class SnapshotIndex(FilterIndex):
+    def __init__(self, snapshot, name):
+        self.snapshot = snapshot
+        self.size = snapshot.sizes[name]
+        self.buckets = snapshot.buckets(name + '.tokens')
+        self.domain_buckets = snapshot.buckets(name + '.domains')
+        self.fallback = snapshot.array(name + '.fallback')
+        self._site_buckets = None
+
+    def __len__(self):
+        return self.size
+
+    def filter(self, i):
+        return self.snapshot.filter(i)
+
+class SnapshotEngine(FilterEngine):
+    def __init__(self, path):
+        snapshot = EngineSnapshot(path)
+        self.all_lists = snapshot.all_lists
+        self.important = SnapshotIndex(snapshot, 'important')
+        self.blocking = SnapshotIndex(snapshot, 'blocking')
+        self.exceptions = SnapshotIndex(snapshot, 'exceptions')
+
+def cached_engine(lists, build, snapshot_dir):
+    # the engine of the lists, from its snapshot if there is one, otherwise
+    # built and saved as a snapshot for the next time
+    if snapshot_dir is None:
+        return build()
+
+    path = os.path.join(snapshot_dir, lists_hash(lists) + '.engine')
+    if os.path.exists(path):
+        return SnapshotEngine(path)
+
+    engine = build()
+    save_snapshot(engine, path)
+    return engine
+
+def load_engine(lines, snapshot_dir=DEFAULT_SNAPSHOT_DIR):
+    return cached_engine([lines], lambda: FilterEngine(lines), snapshot_dir)
+
+def load_multi_list_engine(lists, snapshot_dir=DEFAULT_SNAPSHOT_DIR):
+    return cached_engine(lists, lambda: MultiListEngine(lists), snapshot_dir)
@@ -0,0 +1,417 @@
+import html
+import xml.etree.ElementTree as ElementTree
+from array import array
+
+import numpy
+from networkx import DiGraph, MultiDiGraph
+
+GRAPHML_NS = '{http://graphml.graphdrawing.org/xmlns}'
+
+# the only PageGraph attributes read by the feature extractor, the chain
+# generation and the statistics scripts, everything else is dropped while parsing
+NODE_ATTRIBUTES = frozenset([
+    'node type',
+    'node id',
+    'script type',
+    'url',
+    'timestamp'
+])
+
+EDGE_ATTRIBUTES = frozenset([
+    'edge type',
+    'value',
+    'parent'
+])
+
+def _to_bool(value):
+    return value.strip().lower() in ('true', '1')
+
+_TYPE_CONVERTERS = {
+    'boolean': _to_bool,
+    'int': int,
+    'long': int,
+    'float': float,
+    'double': float,
+    'string': str
+}
+
+def read_graphml(path, node_attributes=NODE_ATTRIBUTES, edge_attributes=EDGE_ATTRIBUTES):
+    # yields ('node', node_id, data) and ('edge', source, target, data) while
+    # parsing the file incrementally, so the whole document is never in memory
+    keys = dict()
+    graph_element = None
+    for event, elem in ElementTree.iterparse(path, events=('start', 'end')):
+        tag = elem.tag
+        if event == 'start':
+            if tag == GRAPHML_NS + 'graph':
+                graph_element = elem
+            continue
+
+        if tag == GRAPHML_NS + 'key':
+            name = elem.get('attr.name')
+            wanted = node_attributes if elem.get('for') == 'node' else edge_attributes
+            if name in wanted:
+                convert = _TYPE_CONVERTERS.get(elem.get('attr.type', 'string'), str)
+                default = elem.find(GRAPHML_NS + 'default')
+                if default is not None and default.text is not None:
+                    default = convert(default.text)
+                else:
+                    default = None
+                keys[elem.get('id')] = (elem.get('for'), name, convert, default)
+        elif tag == GRAPHML_NS + 'node' or tag == GRAPHML_NS + 'edge':
+            kind = 'node' if tag == GRAPHML_NS + 'node' else 'edge'
+            data = dict()
+            for key_kind, name, _convert, default in keys.values():
+                if key_kind == kind and default is not None:
+                    data[name] = default
+
+            for data_elem in elem:
+                key = keys.get(data_elem.get('key'))
+                if key is not None:
+                    data[key[1]] = key[2](data_elem.text or '')
+
+            if kind == 'node':
+                yield ('node', elem.get('id'), data)
+            else:
+                yield ('edge', elem.get('source'), elem.get('target'), data)
+
+            # drop everything parsed so far, memory stays bounded by one element
+            if graph_element is not None:
+                graph_element.clear()
+
+def load_page_graph(path, node_attributes=NODE_ATTRIBUTES, edge_attributes=EDGE_ATTRIBUTES):
+    graph = MultiDiGraph()
+    multigraph = False
+    for item in read_graphml(path, node_attributes, edge_attributes):
+        if item[0] == 'node':
+            graph.add_node(item[1], **item[2])
+        else:
+            _, source, target, data = item
+            if not multigraph and graph.has_edge(source, target):
+                multigraph = True
+            graph.add_edge(source, target, **data)
+
+    # same as networkx.graphml, only keep the multigraph if there are parallel edges
+    if not multigraph:
+        return DiGraph(graph)
+
+    return graph
+
+
+###############################################################################
+# compact, array backed representation used by the chain and feature walkers
+
+ROOT_NODE_ID = 'n1'
+NO_NODE = -1
+MISSING = -1
+
+_node_type_codes = dict()
+_script_type_codes = dict()
+_edge_type_codes = dict()
+
+def _intern(codes, name):
+    code = codes.get(name)
+    if code is None:
+        code = len(codes)
+        codes[name] = code
+
+    return code
+
+def node_type_code(name):
+    return _intern(_node_type_codes, name)
+
+def script_type_code(name):
+    return _intern(_script_type_codes, name)
+
+def edge_type_code(name):
+    return _intern(_edge_type_codes, name)
+
+RESOURCE_NODE = node_type_code('resource')
+REMOTE_FRAME_NODE = node_type_code('remote frame')
+SCRIPT_NODE = node_type_code('script')
+
+EXTERNAL_FILE_SCRIPT = script_type_code('external file')
+
+REQUEST_START_EDGE = edge_type_code('request start')
+REQUEST_COMPLETE_EDGE = edge_type_code('request complete')
+CROSS_DOM_EDGE = edge_type_code('cross DOM')
+EXECUTE_EDGE = edge_type_code('execute')
+CREATE_NODE_EDGE = edge_type_code('create node')
+INSERT_NODE_EDGE = edge_type_code('insert node')
+STRUCTURE_EDGE = edge_type_code('structure')
+MODIFYING_EDGES = (
+    edge_type_code('set attribute'),
+    edge_type_code('delete attribute'),
+    edge_type_code('remove node'),
+    edge_type_code('delete node')
+)
+
+def _offsets(keys, size):
+    offsets = numpy.zeros(size + 1, dtype=numpy.int64)
+    numpy.cumsum(numpy.bincount(keys, minlength=size), out=offsets[1:])
+    return offsets
+
+class CompactPageGraph:
+    def __init__(self, node_ids, node_types, script_types, dom_node_ids, timestamps, urls,
+                 edge_sources, edge_targets, edge_types, edge_parents, edge_values):
+        self.node_ids = node_ids
+        self.node_index = {node_id: index for index, node_id in enumerate(node_ids)}
+        self.root = self.node_index.get(ROOT_NODE_ID, NO_NODE)
+
+        self.node_types = node_types
+        self.script_types = script_types
+        self.dom_node_ids = dom_node_ids
+        self.timestamps = timestamps
+        self.urls = urls
+
+        self.edge_sources = edge_sources
+        self.edge_targets = edge_targets
+        self.edge_types = edge_types
+        self.edge_parents = edge_parents
+        self.edge_values = edge_values
+
+        node_count = len(node_ids)
+        edge_count = len(edge_sources)
+
+        # outgoing edges in the order networkx iterates them: by source, then by
+        # the first appearance of each (source, target) pair, then file order
+        edge_indices = numpy.arange(edge_count, dtype=numpy.int64)
+        pairs = edge_sources.astype(numpy.int64) * node_count + edge_targets
+        _unique_pairs, first_seen, pair_of_edge = numpy.unique(pairs, return_index=True, return_inverse=True)
+        self.out_edges = numpy.lexsort((edge_indices, first_seen[pair_of_edge], edge_sources))
+        self.out_offsets = _offsets(edge_sources, node_count)
+        self.out_targets = edge_targets[self.out_edges]
+        self.out_types = edge_types[self.out_edges]
+
+        # incoming edges keep the same relative order, which is what
+        # edges_to_mapping used to produce
+        self.in_edges = self.out_edges[numpy.argsort(edge_targets[self.out_edges], kind='stable')]
+        self.in_offsets = _offsets(edge_targets, node_count)
+        self.in_sources = edge_sources[self.in_edges]
+        self.in_types = edge_types[self.in_edges]
+
+        self.in_degree = numpy.diff(self.in_offsets)
+        self.out_degree = numpy.diff(self.out_offsets)
+        self.degree = self.in_degree + self.out_degree
+
+    def number_of_nodes(self):
+        return len(self.node_ids)
+
+    def number_of_edges(self):
+        return len(self.edge_sources)
+
+    def nodes_of_type(self, node_type):
+        return numpy.flatnonzero(self.node_types == node_type).tolist()
+
+    def value_edges(self):
+        has_value = numpy.zeros(len(self.edge_sources), dtype=bool)
+        has_value[list(self.edge_values)] = True
+        return self.out_edges[has_value[self.out_edges]].tolist()
+
+    def _in_matches(self, node, edge_types):
+        start, end = self.in_offsets[node], self.in_offsets[node + 1]
+        return numpy.flatnonzero(numpy.isin(self.in_types[start:end], edge_types)) + start
+
+    def _out_matches(self, node, edge_types):
+        start, end = self.out_offsets[node], self.out_offsets[node + 1]
+        return numpy.flatnonzero(numpy.isin(self.out_types[start:end], edge_types)) + start
+
+    def first_in_neighbor(self, node, edge_types):
+        matches = self._in_matches(node, edge_types)
+        if len(matches) == 0:
+            return NO_NODE
+
+        return int(self.in_sources[matches[0]])
+
+    def last_in_neighbor(self, node, edge_types):
+        matches = self._in_matches(node, edge_types)
+        if len(matches) == 0:
+            return NO_NODE
+
+        return int(self.in_sources[matches[-1]])
+
+    def has_in_edge(self, node, edge_types):
+        return len(self._in_matches(node, edge_types)) > 0
+
+    def _all_in_matches(self, edge_types):
+        # the incoming edges of the types, for every node at once, with the node
+        # they go to. in_edges is sorted by target, so these are too
+        matches = numpy.flatnonzero(numpy.isin(self.in_types, edge_types))
+        return matches, self.edge_targets[self.in_edges[matches]]
+
+    def first_in_neighbors(self, edge_types):
+        # first_in_neighbor of every node, NO_NODE for those without such an edge
+        neighbors = numpy.full(self.number_of_nodes(), NO_NODE, dtype=numpy.int64)
+        matches, targets = self._all_in_matches(edge_types)
+        first = numpy.ones(len(matches), dtype=bool)
+        first[1:] = targets[1:] != targets[:-1]
+        neighbors[targets[first]] = self.in_sources[matches[first]]
+        return neighbors
+
+    def last_in_neighbors(self, edge_types):
+        neighbors = numpy.full(self.number_of_nodes(), NO_NODE, dtype=numpy.int64)
+        matches, targets = self._all_in_matches(edge_types)
+        last = numpy.ones(len(matches), dtype=bool)
+        last[:-1] = targets[1:] != targets[:-1]
+        neighbors[targets[last]] = self.in_sources[matches[last]]
+        return neighbors
+
+    def has_in_edges(self, edge_types):
+        _matches, targets = self._all_in_matches(edge_types)
+        return numpy.bincount(targets, minlength=self.number_of_nodes()) > 0
+
+    def out_neighbors(self, node, edge_types):
+        return self.out_targets[self._out_matches(node, edge_types)]
+
+    def out_edges_of_type(self, node, edge_types):
+        return self.out_edges[self._out_matches(node, edge_types)]
+
+def average_degree_connectivity(page_graph, source='in+out', target='in+out'):
+    # same definition as networkx.average_degree_connectivity for directed
+    # graphs, returned as an array indexed by degree
+    degrees = {
+        'in': page_graph.in_degree,
+        'out': page_graph.out_degree,
+        'in+out': page_graph.degree
+    }
+    source_degree = degrees[source]
+    target_degree = degrees[target]
+
+    node_count = page_graph.number_of_nodes()
+    if node_count == 0:
+        return numpy.zeros(0)
+
+    # neighbours are only counted once, even when there are parallel edges
+    pairs = numpy.unique(page_graph.edge_sources.astype(numpy.int64) * node_count + page_graph.edge_targets)
+    pair_sources = pairs // node_count
+    pair_targets = pairs % node_count
+    if source == 'in':
+        owners, neighbors = pair_targets, pair_sources
+    else:
+        owners, neighbors = pair_sources, pair_targets
+
+    neighbor_degree_sum = numpy.bincount(owners, weights=target_degree[neighbors], minlength=node_count)
+    size = int(source_degree.max()) + 1
+    degree_sum = numpy.bincount(source_degree, weights=neighbor_degree_sum, minlength=size)
+    degree_norm = numpy.bincount(source_degree, weights=source_degree, minlength=size)
+    return numpy.divide(degree_sum, degree_norm, out=degree_sum.copy(), where=degree_norm > 0)
+
+def decode_url(url):
+    decoded_url = html.unescape(url)
+    while decoded_url != html.unescape(decoded_url):
+        decoded_url = html.unescape(decoded_url)
+
+    return decoded_url
+
+def get_resource_nodes(page_graph):
+    resource_nodes = page_graph.nodes_of_type(RESOURCE_NODE)
+    for node in resource_nodes:
+        if page_graph.urls[node] is not None:
+            page_graph.urls[node] = decode_url(page_graph.urls[node])
+
+    return resource_nodes
+
+def get_remote_frame_nodes(page_graph):
+    remote_frame_nodes = page_graph.nodes_of_type(REMOTE_FRAME_NODE)
+    for node in remote_frame_nodes:
+        if page_graph.urls[node] is not None:
+            page_graph.urls[node] = decode_url(page_graph.urls[node])
+
+    return remote_frame_nodes
+
+def get_value_edges(page_graph):
+    value_edges = page_graph.value_edges()
+    for edge in value_edges:
+        page_graph.edge_values[edge] = decode_url(page_graph.edge_values[edge])
+
+    return value_edges
+
+class UrlIndex:
+    # decodes the urls of the graph in place and maps every decoded url to the
+    # node it belongs to. the first match wins, and for images resource nodes
+    # take priority over the targets of value edges
+    def __init__(self, page_graph):
+        self.images = dict()
+        self.frames = dict()
+
+        for node in get_resource_nodes(page_graph):
+            url = page_graph.urls[node]
+            if url is not None and url not in self.images:
+                self.images[url] = node
+
+        for edge in get_value_edges(page_graph):
+            value = page_graph.edge_values[edge]
+            if value not in self.images:
+                self.images[value] = int(page_graph.edge_targets[edge])
+
+        for node in get_remote_frame_nodes(page_graph):
+            url = page_graph.urls[node]
+            if url is not None and url not in self.frames:
+                self.frames[url] = node
+
+def load_compact_page_graph(path, node_attributes=NODE_ATTRIBUTES, edge_attributes=EDGE_ATTRIBUTES):
+    node_index = dict()
+    node_ids = []
+    node_types = array('h')
+    script_types = array('h')
+    dom_node_ids = array('q')
+    timestamps = array('d')
+    urls = []
+
+    edge_sources = array('i')
+    edge_targets = array('i')
+    edge_types = array('h')
+    edge_parents = array('q')
+    edge_values = dict()
+
+    def add_node(node_id):
+        index = node_index.get(node_id)
+        if index is None:
+            index = len(node_ids)
+            node_index[node_id] = index
+            node_ids.append(node_id)
+            node_types.append(MISSING)
+            script_types.append(MISSING)
+            dom_node_ids.append(MISSING)
+            timestamps.append(numpy.nan)
+            urls.append(None)
+
+        return index
+
+    for item in read_graphml(path, node_attributes, edge_attributes):
+        if item[0] == 'node':
+            index = add_node(item[1])
+            data = item[2]
+            if 'node type' in data:
+                node_types[index] = node_type_code(data['node type'])
+            if 'script type' in data:
+                script_types[index] = script_type_code(data['script type'])
+            if 'node id' in data:
+                dom_node_ids[index] = int(data['node id'])
+            if 'timestamp' in data:
+                timestamps[index] = data['timestamp']
+            if 'url' in data:
+                urls[index] = data['url']
+        else:
+            _, source, target, data = item
+            edge_index = len(edge_sources)
+            edge_sources.append(add_node(source))
+            edge_targets.append(add_node(target))
+            edge_types.append(edge_type_code(data['edge type']) if 'edge type' in data else MISSING)
+            edge_parents.append(int(data['parent']) if 'parent' in data else MISSING)
+            if 'value' in data:
+                edge_values[edge_index] = data['value']
+
+    return CompactPageGraph(
+        node_ids,
+        numpy.array(node_types, dtype=numpy.int16),
+        numpy.array(script_types, dtype=numpy.int16),
+        numpy.array(dom_node_ids, dtype=numpy.int64),
+        numpy.array(timestamps, dtype=numpy.float64),
+        urls,
+        numpy.array(edge_sources, dtype=numpy.int32),
+        numpy.array(edge_targets, dtype=numpy.int32),
+        numpy.array(edge_types, dtype=numpy.int16),
+        numpy.array(edge_parents, dtype=numpy.int64),
+        edge_values
+    )
@@ -0,0 +1,89 @@
+import io
+
+DEFAULT_BATCH_SIZE = 5000
+
+def _copy_value(value):
+    # a single field in the csv format of COPY, where an unquoted empty field is NULL
+    if value is None:
+        return ''
+    if value is True:
+        return 't'
+    if value is False:
+        return 'f'
+    if isinstance(value, (int, float)):
+        return repr(value)
+
+    return '"' + str(value).replace('"', '""') + '"'
+
+class BufferedWriter:
+    # gathers rows and writes them with a single COPY (and commit) per batch,
+    # columns missing from a row are written as NULL. with commit=False the
+    # caller owns the transaction, e.g. when loading a temporary table.
+    # with an upsert_key, the batch is copied into a staging table first and
+    # rows replace the ones with the same key, which needs a unique index on it
+    def __init__(self, pg_conn, table, columns, batch_size=DEFAULT_BATCH_SIZE, commit=True, upsert_key=None):
+        self.pg_conn = pg_conn
+        self.table = table
+        self.columns = list(columns)
+        self.batch_size = batch_size
+        self.commit = commit
+        self.upsert_key = upsert_key
+        self.rows = []
+        self.written = 0
+
+    def write(self, row):
+        self.rows.append(row)
+        if len(self.rows) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if not self.rows:
+            return
+
+        rows = self.rows
+        if self.upsert_key is not None:
+            # a single insert can't update the same row twice, the last one wins
+            keyed_rows = dict()
+            for row in rows:
+                keyed_rows[row.get(self.upsert_key)] = row
+            rows = [row for row in rows if row.get(self.upsert_key) is None] + [row for key, row in keyed_rows.items() if key is not None]
+
+        data = io.StringIO()
+        for row in rows:
+            data.write(','.join(_copy_value(row.get(column)) for column in self.columns))
+            data.write('\n')
+        data.seek(0)
+
+        cur = self.pg_conn.cursor()
+        if self.upsert_key is None:
+            cur.copy_expert('COPY %s (%s) FROM STDIN WITH (FORMAT csv)' % (self.table, ','.join(self.columns)), data)
+        else:
+            staging = 'staging_' + self.table
+            cur.execute('CREATE TEMPORARY TABLE IF NOT EXISTS %s (LIKE %s INCLUDING DEFAULTS)' % (staging, self.table))
+            cur.copy_expert('COPY %s (%s) FROM STDIN WITH (FORMAT csv)' % (staging, ','.join(self.columns)), data)
+            cur.execute('INSERT INTO %s (%s) SELECT %s FROM %s ON CONFLICT (%s) DO UPDATE SET %s' % (
+                self.table,
+                ','.join(self.columns),
+                ','.join(self.columns),
+                staging,
+                self.upsert_key,
+                ','.join('%s = excluded.%s' % (column, column) for column in self.columns if column != self.upsert_key)
+            ))
+            cur.execute('TRUNCATE %s' % staging)
+        cur.close()
+        if self.commit:
+            self.pg_conn.commit()
+
+        self.written += len(self.rows)
+        self.rows = []
+
+    def close(self):
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        # whatever is buffered is valid, so flush it even when stopped early
+        self.flush()
+        return False
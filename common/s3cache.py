@@ -0,0 +1,102 @@
+import hashlib
+import os
+import tempfile
+import threading
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'regional-filterlist-gen')
+DEFAULT_CACHE_SIZE_MB = 20000
+
+# files are only evicted down to this fraction of the limit, so that we don't
+# have to rescan the cache folder for every new download
+EVICTION_TARGET = 0.9
+
+def add_cache_arguments(parser):
+    parser.add_argument('--cache-dir', default=DEFAULT_CACHE_DIR, help='folder to cache S3 downloads in')
+    parser.add_argument('--cache-size', type=int, default=DEFAULT_CACHE_SIZE_MB, help='maximum size of the download cache in MB')
+
+class S3Cache:
+    # on disk cache for S3 objects, keyed by bucket, key and ETag, with the
+    # least recently used files evicted once the cache grows above its limit
+    def __init__(self, client, cache_dir=DEFAULT_CACHE_DIR, max_size_mb=DEFAULT_CACHE_SIZE_MB):
+        self.client = client
+        self.cache_dir = cache_dir
+        self.max_size = max_size_mb * 1000000
+        self.lock = threading.Lock()
+
+        os.makedirs(cache_dir, exist_ok=True)
+        self.size = sum(os.path.getsize(path) for path, _mtime in self._cached_files())
+
+    def cache_path(self, bucket, key, etag):
+        digest = hashlib.sha256('\n'.join([bucket, key, etag]).encode('utf-8')).hexdigest()
+        # keep the extension, the image loaders look at it
+        return os.path.join(self.cache_dir, digest[:2], digest + os.path.splitext(key)[1])
+
+    def etag(self, bucket, key):
+        return self.client.head_object(Bucket=bucket, Key=key)['ETag'].strip('"')
+
+    def fetch(self, bucket, key):
+        return self.fetch_with_etag(bucket, key)[0]
+
+    def fetch_with_etag(self, bucket, key):
+        # the etag doubles as a content hash of the object
+        etag = self.etag(bucket, key)
+        path = self.cache_path(bucket, key, etag)
+        if os.path.exists(path):
+            # the modification time is what the eviction orders on
+            os.utime(path)
+            return path, etag
+
+        folder = os.path.dirname(path)
+        os.makedirs(folder, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=folder, suffix='.part')
+        os.close(fd)
+        try:
+            self.client.download_file(bucket, key, temp_path)
+            os.replace(temp_path, path)
+        except:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+
+        with self.lock:
+            self.size += os.path.getsize(path)
+            if self.size > self.max_size:
+                self._evict(path)
+
+        return path, etag
+
+    def _cached_files(self):
+        for folder, _dirs, files in os.walk(self.cache_dir):
+            for name in files:
+                if name.endswith('.part'):
+                    continue
+                path = os.path.join(folder, name)
+                try:
+                    yield path, os.path.getmtime(path)
+                except FileNotFoundError:
+                    # evicted by another process
+                    continue
+
+    def _evict(self, keep):
+        # other processes may share the folder, so look at what is actually there
+        cached_files = sorted(self._cached_files(), key=lambda cached_file: cached_file[1])
+        self.size = 0
+        sizes = dict()
+        for path, _mtime in cached_files:
+            try:
+                sizes[path] = os.path.getsize(path)
+            except FileNotFoundError:
+                continue
+            self.size += sizes[path]
+
+        target = self.max_size * EVICTION_TARGET
+        for path, _mtime in cached_files:
+            if self.size <= target:
+                break
+            if path == keep or path not in sizes:
+                continue
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            self.size -= sizes[path]
@@ -0,0 +1,66 @@
+# column order of the tables in postgresql/create-schema.sql, used by the bulk
+# writers so that rows always end up in the same columns
+
+IMAGE_FEATURES_COLUMNS = [
+    'imaged_data',
+
+    # structural features
+    'nodes',
+    'edges',
+    'nodes_edge_ratio',
+
+    'in_degree',
+    'in_average_degree_connectivity',
+    'out_degree',
+    'out_average_degree_connectivity',
+    'in_out_degree',
+    'in_out_average_degree_connectivity',
+    'is_modified_by_script',
+
+    'parent_in_degree',
+    'parent_in_average_degree_connectivity',
+    'parent_out_degree',
+    'parent_out_average_degree_connectivity',
+    'parent_in_out_degree',
+    'parent_in_out_average_degree_connectivity',
+    'parent_modified_by_script',
+
+    # content features
+    'resource_url',
+    'resource_type',
+    'length_of_url',
+    'is_subdomain',
+    'is_third_party',
+    'base_domain_in_query_string',
+    'semi_colon_in_query_string',
+    'is_iframe',
+    'width',
+    'height',
+    'standard_ad_width',
+    'standard_ad_height',
+    'standard_ad_size',
+    'time_from_page_start',
+
+    # other, based on the old classifier
+    'is_classified_as_ad',
+    'ad_probability'
+]
+
+CLASSIFICATIONS_COLUMNS = [
+    'page_url',
+    'resource_url',
+    'resource_type',
+    'frame_url',
+    'imaged_data',
+    'is_classified_as_ad',
+    'is_classified_as_ad_easylist',
+    'is_classified_as_ad_supplement',
+    'is_classified_as_ad_easyprivacy',
+    'is_classified_as_ad_combined_filter_lists',
+    'chain_element_block'
+]
+
+def ordered_columns(table_columns, columns):
+    # the given columns, in the order they have in the table
+    columns = set(columns)
+    return [column for column in table_columns if column in columns]
@@ -0,0 +1,147 @@
+import ipaddress
+import os
+import re
+
+from functools import lru_cache
+from urllib.parse import urlsplit
+
+import publicsuffix2
+
+# the public suffix list publicsuffix2 ships with, a snapshot that is read
+# from disk, so looking up a suffix never downloads anything. the
+# PUBLIC_SUFFIX_LIST environment variable points to another copy
+DEFAULT_SUFFIX_LIST = os.path.join(os.path.dirname(os.path.abspath(publicsuffix2.__file__)), 'public_suffix_list.dat')
+
+CACHE_SIZE = 100000
+
+SCHEME_RE = re.compile(r'^[A-Za-z0-9+\-.]+:$')
+DOTS_RE = re.compile('[.。．｡]')
+
+class SuffixList:
+    # the rules of a public suffix list, with the private ones (blogspot.com,
+    # github.io, ...) kept apart so that lookups can leave them out
+    def __init__(self, path):
+        self.rules = [set(), set()]
+        self.wildcards = [set(), set()]
+        self.exceptions = [set(), set()]
+
+        private = 0
+        with open(path, 'r', encoding='utf-8') as suffix_file:
+            for line in suffix_file:
+                line = line.strip()
+                if line.startswith('// ===BEGIN PRIVATE DOMAINS'):
+                    private = 1
+                if not line or line.startswith('//'):
+                    continue
+
+                rule = line.split()[0].lower()
+                for form in self.forms(rule.lstrip('!*.')):
+                    if rule.startswith('!'):
+                        self.exceptions[private].add(form)
+                    elif rule.startswith('*.'):
+                        self.wildcards[private].add(form)
+                    else:
+                        self.rules[private].add(form)
+
+    def forms(self, rule):
+        # hosts can have international labels either way
+        forms = [rule]
+        try:
+            encoded = rule.encode('idna').decode('ascii')
+            if encoded != rule:
+                forms.append(encoded)
+        except UnicodeError:
+            pass
+        return forms
+
+    def suffix_length(self, labels, private=True):
+        # the number of labels at the end of labels that are the public suffix,
+        # 0 when no rule matches. the longest rule wins, exceptions first
+        lists = [0, 1] if private else [0]
+        labels = [label.lower() for label in labels]
+        for i in range(len(labels)):
+            candidate = '.'.join(labels[i:])
+            parent = '.'.join(labels[i + 1:])
+            for j in lists:
+                if candidate in self.exceptions[j]:
+                    return len(labels) - i - 1
+            for j in lists:
+                if candidate in self.rules[j] or (i + 1 < len(labels) and parent in self.wildcards[j]):
+                    return len(labels) - i
+        return 0
+
+@lru_cache(maxsize=1)
+def suffix_list():
+    return SuffixList(os.environ.get('PUBLIC_SUFFIX_LIST', DEFAULT_SUFFIX_LIST))
+
+@lru_cache(maxsize=CACHE_SIZE)
+def split_url(url):
+    # urlsplit, None for urls it can't parse
+    try:
+        return urlsplit(url)
+    except ValueError:
+        return None
+
+@lru_cache(maxsize=CACHE_SIZE)
+def hostname(url):
+    parts = split_url(url)
+    if parts is None:
+        return ''
+    try:
+        return parts.hostname or ''
+    except ValueError:
+        return ''
+
+@lru_cache(maxsize=CACHE_SIZE)
+def lenient_host(url):
+    # the host of a url, or of a bare host, port or path, the way tldextract
+    # finds it: without scheme, user, port and the final dot
+    double_slashes = url.find('//')
+    if double_slashes == 0:
+        url = url[2:]
+    elif double_slashes > 0 and SCHEME_RE.match(url[:double_slashes]):
+        url = url[double_slashes + 2:]
+
+    netloc = url.partition('/')[0].partition('?')[0].partition('#')[0].rpartition('@')[2]
+    if netloc.startswith('['):
+        # an ipv6 address, kept in its brackets
+        return netloc.partition(']')[0] + ']'
+    return netloc.partition(':')[0].strip().rstrip('.。．｡')
+
+def is_ip(host):
+    try:
+        ipaddress.ip_address(host.strip('[]'))
+        return True
+    except ValueError:
+        return False
+
+@lru_cache(maxsize=CACHE_SIZE)
+def split_host(host, private=False):
+    # (subdomain, domain, suffix) like tldextract, which leaves out the
+    # private suffixes unless asked to
+    if is_ip(host):
+        return '', host, ''
+
+    labels = DOTS_RE.split(host) if host else []
+    suffix_length = suffix_list().suffix_length(labels, private)
+    if suffix_length == len(labels):
+        return '', '', '.'.join(labels)
+    prefix = labels[:len(labels) - suffix_length]
+    return '.'.join(prefix[:-1]), prefix[-1], '.'.join(labels[len(labels) - suffix_length:])
+
+@lru_cache(maxsize=CACHE_SIZE)
+def split_url_host(url, private=False):
+    return split_host(lenient_host(url), private)
+
+@lru_cache(maxsize=CACHE_SIZE)
+def public_suffix(host):
+    return split_host(host, True)[2]
+
+@lru_cache(maxsize=CACHE_SIZE)
+def registrable_domain(host):
+    # the domain under its public suffix, private ones included, hosts without
+    # a known suffix (ip addresses, localhost) are their own registrable domain
+    subdomain, domain, suffix = split_host(host.lower(), True)
+    if domain and suffix:
+        return domain + '.' + suffix
+    return host.lower()
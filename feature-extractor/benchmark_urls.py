@@ -0,0 +1,112 @@
+import argparse
+import glob
+import os
+import re
+import sys
+import time
+from urllib.parse import urlparse
+
+import tldextract
+from publicsuffix2 import get_sld
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from common import urls
+
+BASE_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+ALEXA_LISTS = os.path.join(BASE_FOLDER, 'crawler', 'alexa-lists', '*.txt')
+TRAINING_DATA = os.path.join(BASE_FOLDER, 'classifier', 'training_data', '*.csv')
+RESOURCES = os.path.join(BASE_FOLDER, 'adblock-rust-checking', 'resources', '*', 'classified_*.txt')
+
+FIELD_RE = re.compile(r'("[^"]*")|[^,]+')
+
+CACHED = [urls.split_url, urls.hostname, urls.lenient_host, urls.split_host, urls.split_url_host, urls.public_suffix, urls.registrable_domain]
+
+def read_workload():
+    # (resource url, page domain) pairs like get_features sees them: the
+    # bundled resources of the regions, and the pages of the alexa lists and
+    # the training data, whose screenshots are named after their domain
+    pairs = []
+    for file_name in sorted(glob.glob(RESOURCES)):
+        with open(file_name, 'r', encoding='utf-8') as resource_file:
+            for line in resource_file:
+                fields = [match.group(0).replace('"', '') for match in FIELD_RE.finditer(line.rstrip('\n'))]
+                if len(fields) >= 3:
+                    pairs.append((fields[2], urls.lenient_host(fields[0])))
+
+    domains = []
+    for file_name in sorted(glob.glob(ALEXA_LISTS)):
+        with open(file_name, 'r') as alexa_list:
+            domains.extend(line.strip() for line in alexa_list if line.strip())
+    for file_name in sorted(glob.glob(TRAINING_DATA)):
+        with open(file_name, 'r') as training_file:
+            domains.extend(line.strip().rsplit('/', 1)[-1].split('_x')[0] for line in training_file if line.strip())
+    pairs.extend(('https://www.' + domain + '/index.html?ref=' + domain, domain) for domain in domains)
+    return pairs
+
+def features_before(extract, pairs):
+    values = []
+    for resource_url, domain in pairs:
+        image_address_parts = extract(resource_url)
+        site_address_parts = extract(domain)
+        query_string = urlparse(resource_url).query
+        values.append((
+            image_address_parts.domain == site_address_parts.domain and image_address_parts.subdomain != '',
+            image_address_parts.domain != site_address_parts.domain,
+            domain in query_string
+        ))
+    return values
+
+def features_after(pairs):
+    values = []
+    for resource_url, domain in pairs:
+        image_subdomain, image_domain, _image_suffix = urls.split_url_host(resource_url)
+        _site_subdomain, site_domain, _site_suffix = urls.split_url_host(domain)
+        url_parts = urls.split_url(resource_url)
+        query_string = url_parts.query if url_parts is not None else ''
+        values.append((
+            image_domain == site_domain and image_subdomain != '',
+            image_domain != site_domain,
+            domain in query_string
+        ))
+    return values
+
+def domains_before(pairs):
+    return [get_sld(urlparse(resource_url).hostname or '') for resource_url, _domain in pairs]
+
+def domains_after(pairs):
+    return [urls.registrable_domain(urls.hostname(resource_url)) for resource_url, _domain in pairs]
+
+def timed(name, function, *args):
+    start = time.time()
+    result = function(*args)
+    duration = time.time() - start
+    print('  ' + name + ': ' + '%.3f' % duration + 's')
+    return result, duration
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='url parsing and public suffix lookups, before and after common/urls.py')
+    parser.add_argument('--repeat', type=int, default=3, help='passes over the urls, the first one with empty caches')
+
+    args = parser.parse_args()
+    pairs = read_workload()
+    print(str(len(pairs)) + ' urls, ' + str(len(set(domain for _url, domain in pairs))) + ' page domains')
+
+    # tldextract only reads its bundled suffix list this way, by default it downloads one
+    start = time.time()
+    extract = tldextract.TLDExtract(suffix_list_urls=())
+    extract('example.com')
+    print('tldextract ready in ' + '%.3f' % (time.time() - start) + 's')
+    start = time.time()
+    urls.suffix_list()
+    print('suffix list loaded in ' + '%.3f' % (time.time() - start) + 's')
+
+    for function in CACHED:
+        function.cache_clear()
+    for run in range(args.repeat):
+        print('run ' + str(run + 1))
+        before, before_time = timed('tldextract and urlparse', features_before, extract, pairs)
+        after, after_time = timed('common/urls.py', features_after, pairs)
+        print('  ' + '%.1f' % (before_time / after_time) + 'x faster, ' + str(sum(1 for a, b in zip(before, after) if a != b)) + ' different features')
+        before, before_time = timed('publicsuffix2', domains_before, pairs)
+        after, after_time = timed('registrable_domain', domains_after, pairs)
+        print('  ' + '%.1f' % (before_time / after_time) + 'x faster, ' + str(sum(1 for a, b in zip(before, after) if a != b)) + ' different registrable domains')
@@ -1,24 +1,40 @@
 import argparse
 import os
+import sys
 import json
+import time
+import zlib
+
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing import Pool
 
-from tempfile import TemporaryDirectory
 from s3fs.core import S3FileSystem
 from PIL import Image
 import psycopg2
 import psycopg2.extras
-from psycopg2.extensions import AsIs
-
-from urllib.parse import urlparse
-import tldextract
 
-import html
 from tqdm import tqdm
 
-from networkx import graphml, average_neighbor_degree, average_degree_connectivity
-
 from adsidentifier import AdsIdentifier
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from common.pagegraph import (
+    load_compact_page_graph,
+    average_degree_connectivity,
+    UrlIndex,
+    NO_NODE,
+    REQUEST_START_EDGE,
+    CROSS_DOM_EDGE,
+    STRUCTURE_EDGE,
+    MODIFYING_EDGES
+)
+from common.s3cache import S3Cache, add_cache_arguments
+from common.pgwriter import BufferedWriter, DEFAULT_BATCH_SIZE
+from common.checkpoint import add_checkpoint_arguments, pending_entries, ProcessedPages
+from common.schema import IMAGE_FEATURES_COLUMNS
+from common.urls import split_url, split_url_host
+
 # standard ad information from https://blog.bannersnack.com/banner-standard-sizes/
 standard_ad_widths = [
     250,
@@ -54,314 +70,401 @@ standard_ad_sizes = [
     '970x90'
 ]
 
-# utility function
-def edges_from_mapping(edges):
-    mapping = dict()
-    for edge in edges:
-        if edge[0] in mapping:
-            mapping[edge[0]].append(edge)
-        else:
-            mapping[edge[0]] = [edge]
+# ordered, so that reruns and the workers produce the rows in the same order
+PAGES_QUERY = 'select distinct on (queried_url) queried_url, file_name from graphml_mappings order by queried_url, id'
+IMAGES_QUERY = 'select domain, resource_url, resource_type, imaged_data, width, height from image_data_table where page_url = %s order by id'
 
-    return mapping
+# utility function
+def get_image_node(url_index, resource_url):
+    node_id = url_index.images.get(resource_url)
+    return node_id is not None, node_id
 
-def edges_to_mapping(edges):
-    mapping = dict()
-    for edge in edges:
-        if edge[1] in mapping:
-            mapping[edge[1]].append(edge)
-        else:
-            mapping[edge[1]] = [edge]
-
-    return mapping
-
-def is_modifying_edge(edge):
-    edge_type = edge[2]['edge type']
-    return (
-        edge_type == 'set attribute'
-        or edge_type == 'delete attribute'
-        or edge_type == 'remove node'
-        or edge_type == 'delete node'
-    )
-
-def get_resource_nodes(all_nodes):
-    resource_nodes = []
-
-    for node in all_nodes:
-        node_info = node[1]
-        if node_info['node type'] == 'resource':
-            decoded_resource_url = html.unescape(node_info['url'])
-            while decoded_resource_url != html.unescape(decoded_resource_url):
-                decoded_resource_url = html.unescape(decoded_resource_url)
-
-            node_info['url'] = decoded_resource_url
-            resource_nodes.append(node)
-
-    return resource_nodes
-
-def get_remote_frame_nodes(all_nodes):
-    remote_frame_nodes = []
-    for node in all_nodes:
-        node_info = node[1]
-        if node_info['node type'] == 'remote frame':
-            decoded_resource_url = html.unescape(node_info['url'])
-            while decoded_resource_url != html.unescape(decoded_resource_url):
-                decoded_resource_url = html.unescape(decoded_resource_url)
-
-            node_info['url'] = decoded_resource_url
-            remote_frame_nodes.append(node)
-
-    return remote_frame_nodes
-
-def get_value_edges(all_edges):
-    value_edges = []
-    for edge in all_edges:
-        if 'value' in edge[2]:
-            decoded_url = html.unescape(edge[2]['value'])
-            while decoded_url != html.unescape(decoded_url):
-                decoded_url = html.unescape(decoded_url)
-
-            edge[2]['value'] = decoded_url
-            value_edges.append(edge)
-
-    return value_edges
-
-def get_image_node(resource_nodes, value_edges, resource_url):
-    for resource in resource_nodes:
-        node_id = resource[0]
-        node_info = resource[1]
-        if node_info['url'] == resource_url:
-            return True, node_id
-
-    for edge in value_edges:
-        node_id = edge[1]
-        edge_info = edge[2]
-        if edge_info['value'] == resource_url:
-            return True, node_id
-
-    return False, None
-
-def get_remote_frame_node(frame_nodes, frame_url):
-    for frame in frame_nodes:
-        node_id = frame[0]
-        node_info = frame[1]
-        if node_info['url'] == frame_url:
-            return True, node_id
-
-    return False, None
+def get_remote_frame_node(url_index, frame_url):
+    node_id = url_index.frames.get(frame_url)
+    return node_id is not None, node_id
 
 ###############################################################################
 
-def get_features(s3, pg_bucket):
-    identifier = AdsIdentifier()
-    pg_conn = psycopg2.connect(os.environ['PG_CONNECTION_STRING'])
-    page_graph_cur = pg_conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
-    page_graph_cur.execute('select distinct on (queried_url) queried_url, file_name from graphml_mappings')
-    img_cur = pg_conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
-
-    for entry in tqdm(page_graph_cur.fetchall()):
-        graphml_path = entry['file_name']
-        page_url = entry['queried_url']
-
-        with TemporaryDirectory() as temp_dir:
-            local_file = os.path.join(temp_dir, graphml_path.split('/')[-1])
+class GraphFeatures:
+    # the structural features of every node of a page graph, computed once per
+    # graph from its degree arrays. a row is built the first time an image maps
+    # to its node and shared by every other image that maps to the same node
+    def __init__(self, page_graph):
+        self.root = page_graph.root
+        self.timestamps = page_graph.timestamps
+
+        self.in_degree = page_graph.in_degree
+        self.out_degree = page_graph.out_degree
+        self.in_out_degree = page_graph.degree
+        self.in_average_degree_connectivity = average_degree_connectivity(page_graph, 'in', 'in')[self.in_degree]
+        self.out_average_degree_connectivity = average_degree_connectivity(page_graph, 'out', 'out')[self.out_degree]
+        self.in_out_average_degree_connectivity = average_degree_connectivity(page_graph)[self.in_out_degree]
+
+        self.modified_by_script = page_graph.has_in_edges(MODIFYING_EDGES)
+        self.parents = page_graph.last_in_neighbors((STRUCTURE_EDGE,))
+
+        # images are described by the node that requested them, frames by the
+        # node they were embedded from
+        self.starting_nodes = {
+            'image': page_graph.first_in_neighbors((REQUEST_START_EDGE,)),
+            'iframe': page_graph.first_in_neighbors((CROSS_DOM_EDGE,))
+        }
+
+        all_nodes_length = page_graph.number_of_nodes()
+        all_edges_length = page_graph.number_of_edges()
+        self.graph_features = {
+            'nodes': all_nodes_length,
+            'edges': all_edges_length,
+            'nodes_edge_ratio': all_nodes_length / all_edges_length
+        }
+
+        self.rows = dict()
+
+    def node_features(self, node, prefix):
+        return {
+            prefix + 'in_degree': int(self.in_degree[node]),
+            prefix + 'in_average_degree_connectivity': float(self.in_average_degree_connectivity[node]),
+            prefix + 'out_degree': int(self.out_degree[node]),
+            prefix + 'out_average_degree_connectivity': float(self.out_average_degree_connectivity[node]),
+            prefix + 'in_out_degree': int(self.in_out_degree[node]),
+            prefix + 'in_out_average_degree_connectivity': float(self.in_out_average_degree_connectivity[node])
+        }
+
+    def row(self, node_id, resource_type):
+        # the structural features of an image, None if they can't all be extracted
+        actual_node_id = node_id
+        starting_nodes = self.starting_nodes.get(resource_type)
+        if starting_nodes is not None:
+            if self.in_degree[node_id] == 0:
+                return None
+            if starting_nodes[node_id] != NO_NODE:
+                actual_node_id = int(starting_nodes[node_id])
+
+        if actual_node_id in self.rows:
+            return self.rows[actual_node_id]
+
+        row = None
+        parent = int(self.parents[actual_node_id])
+        if actual_node_id != self.root and parent != NO_NODE:
+            row = self.node_features(actual_node_id, '')
+            row['time_from_page_start'] = float(self.timestamps[actual_node_id])
+            row['is_modified_by_script'] = bool(self.modified_by_script[actual_node_id])
+            row.update(self.node_features(parent, 'parent_'))
+            row['parent_modified_by_script'] = bool(self.modified_by_script[parent])
+            row.update(self.graph_features)
+
+        self.rows[actual_node_id] = row
+        return row
+
+def get_page_features(page_graph_file, images, image_files, identifier, batch_size):
+    try:
+        page_graph = load_compact_page_graph(page_graph_file)
+    except:
+        return []
+
+    graph_features = GraphFeatures(page_graph)
+    url_index = UrlIndex(page_graph)
+
+    features = []
+    feature_image_files = []
+    for img in images:
+        domain = img['domain']
+        resource_url = img['resource_url']
+
+        local_image_file = image_files.get(img['imaged_data'])
+        if local_image_file is None:
+            # if the image can't be downloaded, just continue to the next one..
+            continue
+
+        width, height = None, None
+        if img['resource_type'] == 'iframe':
+            width = img['width']
+            height = img['height']
+        else:
             try:
-                s3.s3.download_file(pg_bucket, graphml_path, local_file)
+                with Image.open(local_image_file) as img_file:
+                    width, height = img_file.size
             except:
-                print('cannot find file ' + graphml_path)
                 continue
 
-            with open(local_file, 'r') as graphml_file:
-                page_graph_data = ''
-                for line in graphml_file:
-                    page_graph_data += line
 
+        if img['resource_type'] == 'iframe':
+            found, node_id = get_remote_frame_node(url_index, resource_url)
+        else:
+            found, node_id = get_image_node(url_index, resource_url)
+
+        if not found:
+            # ignore the entire image, since we can't extract all features
+            continue
+
+        # structural features
+        row = graph_features.row(node_id, img['resource_type'])
+        if row is None:
+            # ignore the entire image, since we can't extract all features
+            continue
+        image_dict = dict(row)
+
+        # content features
+        if width is not None and height is not None:
+            image_dict['width'] = width
+            image_dict['height'] = height
+            combined = str(width) + 'x' + str(height)
+            image_dict['standard_ad_width'] = width in standard_ad_widths
+            image_dict['standard_ad_height'] = width in standard_ad_heights
+            image_dict['standard_ad_size'] = combined in standard_ad_sizes
+
+        image_dict['length_of_url'] = len(resource_url)
+
+        # the page domain is the same for every image of the page, the cache
+        # only splits it once
+        image_subdomain, image_domain, _image_suffix = split_url_host(resource_url)
+        _site_subdomain, site_domain, _site_suffix = split_url_host(domain)
+        image_dict['is_subdomain'] = image_domain == site_domain and image_subdomain != ''
+        image_dict['is_third_party'] = image_domain != site_domain
+
+        url_parts = split_url(resource_url)
+        query_string = url_parts.query if url_parts is not None else ''
+        image_dict['base_domain_in_query_string'] = domain in query_string
+        image_dict['semi_colon_in_query_string'] = ';' in query_string
+
+        image_dict['is_iframe'] = img['resource_type'] == 'iframe'
+
+        image_dict['resource_url'] = resource_url
+        image_dict['resource_type'] = img['resource_type']
+        image_dict['imaged_data'] = img['imaged_data']
+
+        features.append(image_dict)
+        feature_image_files.append(local_image_file)
+
+    # get the classification probability for all images of the page at once
+    classified_features = []
+    predictions = predict_with_ad_prob(identifier, feature_image_files, batch_size)
+    for image_dict, prediction in zip(features, predictions):
+        if prediction is None:
+            # ignore the entire image, since we can't extract all features
+            continue
+
+        (classification, probability) = prediction
+        image_dict['is_classified_as_ad'] = classification == '1_Ads'
+        image_dict['ad_probability'] = probability
+        classified_features.append(image_dict)
+
+    return classified_features
+
+def predict_with_ad_prob(identifier, image_files, batch_size):
+    predictions = []
+    for start in range(0, len(image_files), batch_size):
+        batch = image_files[start:start + batch_size]
+        try:
+            predictions.extend(identifier.predict_with_ad_prob(batch))
+        except:
+            # a single broken image fails the whole batch, so retry one by one
+            for image_file in batch:
                 try:
-                    try:
-                        page_graph = graphml.parse_graphml(page_graph_data)
-                    except:
-                        continue
-                    graph_in_out_average_degree_connectivity = average_degree_connectivity(page_graph)
-                    graph_in_out_degree = page_graph.degree
-
-                    graph_in_average_degree_connectivity = average_degree_connectivity(page_graph, 'in', 'in')
-                    graph_in_degree = page_graph.in_degree
-
-                    graph_out_average_degree_connectivity = average_degree_connectivity(page_graph, 'out', 'out')
-                    graph_out_degree = page_graph.out_degree
-
-                    all_nodes = page_graph.nodes(data=True)
-                    all_edges = page_graph.edges(data=True)
-                    all_nodes_length = len(all_nodes)
-                    all_edges_length = len(all_edges)
-                    nodes_edge_ratio = all_nodes_length / all_edges_length
-                    edges_to_map = edges_to_mapping(all_edges)
-
-                    resource_nodes = get_resource_nodes(all_nodes)
-                    remote_frame_nodes = get_remote_frame_nodes(all_nodes)
-                    value_edges = get_value_edges(all_edges)
-
-                    img_cur.execute('select domain, resource_url, resource_type, imaged_data, width, height from image_data_table where page_url = %s', [page_url])
-                    for img in tqdm(img_cur.fetchall()):
-                        image_dict = dict()
-                        domain = img['domain']
-                        resource_url = img['resource_url']
-
-                        image_bucket, image_path = split_s3_path(img['imaged_data'])
-                        local_image_file = os.path.join(temp_dir, image_path.split('/')[-1])
-                        try:
-                            s3.s3.download_file(image_bucket, image_path, local_image_file)
-                        except:
-                            # if the image can't be downloaded, just continue to the next one..
-                            continue
-
-                        width, height = None, None
-                        if img['resource_type'] == 'iframe':
-                            width = img['width']
-                            height = img['height']
-                        else:
-                            try:
-                                with Image.open(local_image_file) as img_file:
-                                    width, height = img_file.size
-                            except:
-                                continue
-
-
-                        if img['resource_type'] == 'iframe':
-                            found, node_id = get_remote_frame_node(remote_frame_nodes, resource_url)
-                        else:
-                            found, node_id = get_image_node(resource_nodes, value_edges, resource_url)
-
-                        if found:
-                            actual_node_id = node_id
-                            node_have_in_edges = True
-                            if img['resource_type'] == 'image':
-                                try:
-                                    for edge in edges_to_map[node_id]:
-                                        if edge[2]['edge type'] == 'request start':
-                                            actual_node_id = edge[0]
-                                            break
-                                except KeyError:
-                                    node_have_in_edges = False
-                            elif img['resource_type'] == 'iframe':
-                                try:
-                                    for edge in edges_to_map[node_id]:
-                                        if edge[2]['edge type'] == 'cross DOM':
-                                            actual_node_id = edge[0]
-                                            break
-                                except KeyError:
-                                    node_have_in_edges = False
-
-                            if actual_node_id != 'n1' and node_have_in_edges:
-                                image_dict['time_from_page_start'] = all_nodes[actual_node_id]['timestamp']
-
-                                elem_in_degree = graph_in_degree[actual_node_id]
-                                image_dict['in_degree'] = elem_in_degree
-                                image_dict['in_average_degree_connectivity'] = graph_in_average_degree_connectivity[elem_in_degree]
-
-                                elem_out_degree = graph_out_degree[actual_node_id]
-                                image_dict['out_degree'] = elem_out_degree
-                                image_dict['out_average_degree_connectivity'] = graph_out_average_degree_connectivity[elem_out_degree]
-
-                                elem_in_out_degree = graph_in_out_degree[actual_node_id]
-                                image_dict['in_out_degree'] = elem_in_out_degree
-                                image_dict['in_out_average_degree_connectivity'] = graph_in_out_average_degree_connectivity[elem_in_out_degree]
-
-                                image_dict['is_modified_by_script'] = False
-                                for edge in edges_to_map[actual_node_id]:
-                                    if is_modifying_edge(edge):
-                                        image_dict['is_modified_by_script'] = True
-
-                                parent = None
-                                for edge in edges_to_map[actual_node_id]:
-                                    if edge[2]['edge type'] == 'structure':
-                                        parent = edge[0]
-
-                                if parent is not None:
-                                    parent_in_degree = graph_in_degree[parent]
-                                    image_dict['parent_in_degree'] = parent_in_degree
-                                    image_dict['parent_in_average_degree_connectivity'] = graph_in_average_degree_connectivity[parent_in_degree]
-
-                                    parent_out_degree = graph_out_degree[parent]
-                                    image_dict['parent_out_degree'] = parent_out_degree
-                                    image_dict['parent_out_average_degree_connectivity'] = graph_out_average_degree_connectivity[parent_out_degree]
-
-                                    parent_in_out_degree = graph_in_out_degree[parent]
-                                    image_dict['parent_in_out_degree'] = parent_in_out_degree
-                                    image_dict['parent_in_out_average_degree_connectivity'] = graph_in_out_average_degree_connectivity[parent_in_out_degree]
-
-                                    image_dict['parent_modified_by_script'] = False
-                                    for edge in edges_to_map[parent]:
-                                        if is_modifying_edge(edge):
-                                            image_dict['parent_modified_by_script'] = True
-                                            break
-                                else:
-                                    # ignore the entire image, since we can't extract all features
-                                    continue
-                            else:
-                                # ignore the entire image, since we can't extract all features
-                                continue
-                        else:
-                            # ignore the entire image, since we can't extract all features
-                            continue
-
-
-                        # get the classification probability for the image
-                        try:
-                            (classification, probability) = identifier.predict_with_ad_prob(local_image_file)
-                            image_dict['is_classified_as_ad'] = classification == '1_Ads'
-                            image_dict['ad_probability'] = probability
-                        except:
-                            # ignore the entire image, since we can't extract all features
-                            continue
-
-                        # structural features
-                        image_dict['nodes'] = all_nodes_length
-                        image_dict['edges'] = all_edges_length
-                        image_dict['nodes_edge_ratio'] = nodes_edge_ratio
-
-                        # content features
-                        if width is not None and height is not None:
-                            image_dict['width'] = width
-                            image_dict['height'] = height
-                            combined = str(width) + 'x' + str(height)
-                            image_dict['standard_ad_width'] = width in standard_ad_widths
-                            image_dict['standard_ad_height'] = width in standard_ad_heights
-                            image_dict['standard_ad_size'] = combined in standard_ad_sizes
-
-                        image_dict['length_of_url'] = len(resource_url)
-
-                        image_address_parts = tldextract.extract(resource_url)
-                        site_address_parts = tldextract.extract(domain)
-                        image_dict['is_subdomain'] = image_address_parts.domain == site_address_parts.domain and image_address_parts.subdomain != ''
-                        image_dict['is_third_party'] = image_address_parts.domain != site_address_parts.domain
-
-                        query_string = urlparse(resource_url).query
-                        image_dict['base_domain_in_query_string'] = domain in query_string
-                        image_dict['semi_colon_in_query_string'] = ';' in query_string
-
-                        image_dict['is_iframe'] = img['resource_type'] == 'iframe'
-
-                        image_dict['resource_url'] = resource_url
-                        image_dict['resource_type'] = img['resource_type']
-                        image_dict['imaged_data'] = img['imaged_data']
-
-                        columns = image_dict.keys()
-                        values = [image_dict[column] for column in columns]
-                        query = 'INSERT INTO image_features (%s) VALUES %s'
-                        cur = pg_conn.cursor()
-                        cur.execute(query, (AsIs(','.join(columns)), tuple(values)))
-
-                        pg_conn.commit()
-
-                except e:
-                    # with open('error.graphml', 'w') as output:
-                    #     output.write(page_graph_data)
-
-                    # print(e)
-                    # return True
-                    pass
+                    predictions.append(identifier.predict_with_ad_prob(image_file))
+                except:
+                    predictions.append(None)
+
+    return predictions
+
+def load_identifier(batch_size):
+    identifier = AdsIdentifier()
+    # run every batch through the model in a single pass
+    identifier.learn.data.batch_size = batch_size
+    return identifier
+
+def prefetch_page(s3_cache, pg_bucket, entry, images):
+    # runs in a prefetch thread, only downloads and never touches the database
+    start = time.perf_counter()
+    try:
+        page_graph_file, entry['content_hash'] = s3_cache.fetch_with_etag(pg_bucket, entry['file_name'])
+    except:
+        return None, dict(), time.perf_counter() - start
+
+    # a page with images that couldn't be downloaded is not complete, and is
+    # not marked as processed so that --resume tries it again
+    entry['complete'] = True
+    image_files = dict()
+    for img in images:
+        image_bucket, image_path = split_s3_path(img['imaged_data'])
+        try:
+            image_files[img['imaged_data']] = s3_cache.fetch(image_bucket, image_path)
+        except:
+            entry['complete'] = False
+            continue
+
+    return page_graph_file, image_files, time.perf_counter() - start
+
+def prefetch_pages(s3_cache, pg_bucket, entries, img_cur, prefetch, timings):
+    # downloads the files of the next `prefetch` pages while the current one is
+    # processed, and never more than that, so disk and memory stay bounded
+    entries = iter(entries)
+    pending = deque()
+    with ThreadPoolExecutor(max_workers=prefetch) as executor:
+        def submit_next():
+            entry = next(entries, None)
+            if entry is not None:
+                img_cur.execute(IMAGES_QUERY, [entry['queried_url']])
+                images = img_cur.fetchall()
+                pending.append((entry, images, executor.submit(prefetch_page, s3_cache, pg_bucket, entry, images)))
+
+        for _ in range(prefetch):
+            submit_next()
+
+        while pending:
+            entry, images, future = pending.popleft()
+            start = time.perf_counter()
+            page_graph_file, image_files, io_time = future.result()
+            timings['waiting for io'] += time.perf_counter() - start
+            timings['io'] += io_time
+
+            submit_next()
+            yield entry, images, page_graph_file, image_files
+
+def open_s3_cache(s3_options):
+    aws_access_key, aws_secret_key, cache_dir, cache_size = s3_options
+    s3Bucket = S3FileSystem(anon=False, key=aws_access_key, secret=aws_secret_key)
+    return S3Cache(s3Bucket.s3, cache_dir, cache_size)
+
+def in_shard(entry, shard):
+    # hash the url instead of using the row position, so the shards stay the
+    # same when new pages are crawled
+    shard_index, shard_count = shard
+    return zlib.crc32(entry['queried_url'].encode('utf-8')) % shard_count == shard_index
+
+def parse_shard(value):
+    try:
+        shard_index, shard_count = [int(part) for part in value.split('/')]
+    except ValueError:
+        raise argparse.ArgumentTypeError('shard should be given as i/n')
+
+    if shard_count < 1 or not 0 <= shard_index < shard_count:
+        raise argparse.ArgumentTypeError('shard should satisfy 0 <= i < n')
+
+    return shard_index, shard_count
+
+def positive_int(value):
+    try:
+        number = int(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError('should be a number')
+
+    if number < 1:
+        raise argparse.ArgumentTypeError('should be at least 1')
+
+    return number
+
+# state of a worker process, set up once by init_worker
+worker = dict()
+
+def init_worker(s3_options, batch_size):
+    worker['identifier'] = load_identifier(batch_size)
+    worker['batch_size'] = batch_size
+    worker['pg_conn'] = psycopg2.connect(os.environ['PG_CONNECTION_STRING'])
+    worker['s3_cache'] = open_s3_cache(s3_options)
+
+def process_entry(entry, pg_bucket):
+    img_cur = worker['pg_conn'].cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+    img_cur.execute(IMAGES_QUERY, [entry['queried_url']])
+    images = img_cur.fetchall()
+    img_cur.close()
+
+    page_graph_file, image_files, io_time = prefetch_page(worker['s3_cache'], pg_bucket, entry, images)
+    if page_graph_file is None:
+        return entry, None, io_time, 0
+
+    start = time.perf_counter()
+    features = get_page_features(page_graph_file, images, image_files, worker['identifier'], worker['batch_size'])
+    return entry, features, io_time, time.perf_counter() - start
+
+def process_in_workers(entries, pg_bucket, s3_options, workers, batch_size, timings):
+    # results are handed back in the same order as the entries, whichever
+    # worker finishes first, and at most two pages per worker are in flight
+    entries = iter(entries)
+    pending = deque()
+    with Pool(workers, initializer=init_worker, initargs=(s3_options, batch_size)) as pool:
+        def submit_next():
+            entry = next(entries, None)
+            if entry is not None:
+                pending.append(pool.apply_async(process_entry, (entry, pg_bucket)))
+
+        for _ in range(2 * workers):
+            submit_next()
+
+        while pending:
+            start = time.perf_counter()
+            entry, features, io_time, compute_time = pending.popleft().get()
+            timings['waiting for io'] += time.perf_counter() - start
+            timings['io'] += io_time
+            timings['compute'] += compute_time
+
+            submit_next()
+            yield entry, features
+
+def get_features(pg_bucket, s3_options, prefetch, workers, shard, batch_size, write_batch_size, resume=False, incremental=False):
+    pg_conn = psycopg2.connect(os.environ['PG_CONNECTION_STRING'])
+    page_graph_cur = pg_conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+    page_graph_cur.execute(PAGES_QUERY)
+    entries = [entry for entry in page_graph_cur.fetchall() if in_shard(entry, shard)]
+
+    # pages are only recorded when checkpointing, which needs the
+    # processed_pages table of migration 002
+    processed_pages = ProcessedPages(pg_conn, 'image_features') if resume or incremental else None
+    s3_cache = open_s3_cache(s3_options) if workers <= 1 or incremental else None
+    if processed_pages is not None:
+        entries = pending_entries(entries, processed_pages.load(), resume, incremental, lambda file_name: s3_cache.etag(pg_bucket, file_name))
+        print('pages left to process: ' + str(len(entries)))
+
+    def mark_processed(entry):
+        if not entry['complete']:
+            print('cannot download every image of ' + entry['file_name'])
+        elif processed_pages is not None:
+            processed_pages.mark(entry['file_name'], entry['content_hash'])
+
+    timings = {
+        'io': 0,
+        'waiting for io': 0,
+        'compute': 0
+    }
+    # a page is marked as processed after its rows are handed to the writer, in
+    # the same transaction, so a page is either done or redone after a crash
+    with BufferedWriter(pg_conn, 'image_features', IMAGE_FEATURES_COLUMNS, write_batch_size, upsert_key='imaged_data') as writer:
+        if workers > 1:
+            for entry, features in tqdm(process_in_workers(entries, pg_bucket, s3_options, workers, batch_size, timings), total=len(entries)):
+                if features is None:
+                    print('cannot find file ' + entry['file_name'])
+                    continue
+
+                for image_dict in features:
+                    writer.write(image_dict)
+                mark_processed(entry)
+
+            writer.flush()
+            pg_conn.commit()
+            # io and compute are summed over the workers, waiting is the time the
+            # main process spent waiting on them
+            print('io: %.1fs, compute: %.1fs, waiting for workers: %.1fs' % (timings['io'], timings['compute'], timings['waiting for io']))
+            return True
+
+        identifier = load_identifier(batch_size)
+        img_cur = pg_conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+        pages = prefetch_pages(s3_cache, pg_bucket, entries, img_cur, prefetch, timings)
+        for entry, images, page_graph_file, image_files in tqdm(pages, total=len(entries)):
+            if page_graph_file is None:
+                print('cannot find file ' + entry['file_name'])
+                continue
 
+            start = time.perf_counter()
+            for image_dict in get_page_features(page_graph_file, images, image_files, identifier, batch_size):
+                writer.write(image_dict)
+            timings['compute'] += time.perf_counter() - start
+            mark_processed(entry)
+
+    # the marks of pages after the last flush are still uncommitted
+    pg_conn.commit()
+    # io is summed over the prefetch threads, waiting for io is the part of it
+    # the main thread actually stalled on
+    print('io: %.1fs, waiting for io: %.1fs, compute: %.1fs' % (timings['io'], timings['waiting for io'], timings['compute']))
     return True
 
 
@@ -376,8 +479,15 @@ if __name__ == "__main__":
     parser.add_argument('--aws-access-key', help='aws access key')
     parser.add_argument('--aws-secret-key', help='aws secret key')
     parser.add_argument('--pg-bucket', help='aws page graph bucket address')
+    parser.add_argument('--prefetch', type=positive_int, default=4, help='amount of pages to download ahead of the one being processed')
+    parser.add_argument('--workers', type=positive_int, default=1, help='amount of worker processes to extract features with')
+    parser.add_argument('--batch-size', type=positive_int, default=64, help='amount of images the perceptual classifier is run on at once')
+    parser.add_argument('--write-batch-size', type=positive_int, default=DEFAULT_BATCH_SIZE, help='amount of feature rows written to the database at once')
+    parser.add_argument('--shard', type=parse_shard, default=(0, 1), help='only handle shard i out of n, given as i/n')
+    add_checkpoint_arguments(parser)
+    add_cache_arguments(parser)
 
     args = parser.parse_args()
-    s3Bucket = S3FileSystem(anon=False, key=args.aws_access_key, secret=args.aws_secret_key)
+    s3_options = (args.aws_access_key, args.aws_secret_key, args.cache_dir, args.cache_size)
 
-    get_features(s3Bucket, args.pg_bucket)
+    get_features(args.pg_bucket, s3_options, args.prefetch, args.workers, args.shard, args.batch_size, args.write_batch_size, args.resume, args.incremental)
@@ -1,34 +1,180 @@
 import argparse
-import os
 import json
-from urllib.parse import urlsplit
-from publicsuffix2 import get_sld
+import os
+import re
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from common.filterlist import FilterEngine, add_snapshot_arguments, load_engine
+from common.urls import hostname, registrable_domain, split_url
+
+CHECKING_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'adblock-rust-checking')
+LIST_FOLDER = os.path.join(CHECKING_FOLDER, 'filter_lists')
+RESOURCE_FOLDER = os.path.join(CHECKING_FOLDER, 'resources')
+CHAINS_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'chains_resources')
+
+# the chains resourcesFromChains.js takes the ads from
+CHAIN_FILES = ['upstream_lists.json', 'upstream_us_difference_lists.json']
+
+# the urls come from the tops of the chains (scripts) and the ads without a
+# chain (images and frames)
+REQUEST_TYPES = ['script', 'image', 'sub_frame']
+
+FIELD_RE = re.compile(r'("[^"]*")|[^,]+')
+
+class PathNode:
+    # a path segment of the urls of one registrable domain, with the ad urls
+    # and the number of non ad urls whose path ends at it
+    __slots__ = ['children', 'ads', 'non_ads', 'ad_paths', 'non_ad_paths']
+
+    def __init__(self):
+        self.children = dict()
+        self.ads = []
+        self.non_ads = 0
+
+    def add(self, path, url=None):
+        node = self
+        for segment in path.split('/')[1:]:
+            node = node.children.setdefault(segment, PathNode())
+        if url is None:
+            node.non_ads += 1
+        else:
+            node.ads.append(url)
+
+    def count(self):
+        # the number of paths with ads and without ads in the subtree
+        self.ad_paths = 1 if self.ads else 0
+        self.non_ad_paths = 1 if self.non_ads else 0
+        for child in self.children.values():
+            child.count()
+            self.ad_paths += child.ad_paths
+            self.non_ad_paths += child.non_ad_paths
+
+    def subtree_ads(self):
+        ads = list(self.ads)
+        for child in self.children.values():
+            ads.extend(child.subtree_ads())
+        return ads
+
+def url_path(url):
+    parts = split_url(url)
+    return (parts.path if parts is not None else '') or '/'
 
-def generate_filterlist(region):
+def synthesize(domain, node, segments, min_paths, rules):
+    # a whole subtree of ads, with enough different paths to be sure it isn't a
+    # coincidence, becomes one rule, everything else the rule of its own path
+    if node.non_ad_paths == 0 and node.ad_paths >= min_paths:
+        if segments:
+            rules['||' + domain + '/' + '/'.join(segments) + '^'] = node.subtree_ads()
+        else:
+            rules['||' + domain + '^'] = node.subtree_ads()
+        return
+
+    if node.ads:
+        rules.setdefault('||' + domain + url_path(node.ads[0]), []).extend(node.ads)
+    for segment in sorted(node.children):
+        synthesize(domain, node.children[segment], segments + [segment], min_paths, rules)
+
+def read_non_ads(files):
+    # the resource urls of files in the format of the classified_*.txt resources
+    urls = []
+    for file_name in files:
+        with open(file_name, 'r', encoding='utf-8') as resource_file:
+            for line in resource_file:
+                fields = [match.group(0).replace('"', '') for match in FIELD_RE.finditer(line.rstrip('\n'))]
+                if len(fields) >= 3:
+                    urls.append(fields[2])
+    return urls
+
+def default_non_ad_files(region):
+    folder = os.path.join(RESOURCE_FOLDER, region)
+    files = [os.path.join(folder, name) for name in ['classified_nonad_images.txt', 'classified_nonad_frames.txt']]
+    return [file_name for file_name in files if os.path.exists(file_name)]
+
+def is_blocked(engine, url):
+    # for the generated rules, which have no options, so the page doesn't matter
+    return any(engine.check(url, '', request_type) for request_type in REQUEST_TYPES)
+
+def read_ad_contexts(chains_folder, region):
+    # the pages and request types each ad was loaded with: the top of a chain
+    # is a script, an ad without a chain has the type of the resource
+    contexts = dict()
+    for file_name in CHAIN_FILES:
+        path = os.path.join(chains_folder, region, file_name)
+        if not os.path.exists(path):
+            print(path + ' not found, its ads only count as blocked by the lists if they are on every page')
+            continue
+        with open(path, 'r') as chains_file:
+            chains = json.load(chains_file)
+        for page_url, page_chains in chains.items():
+            for resource_url, resource_type, chain in page_chains.values():
+                if chain:
+                    contexts.setdefault(chain[-1], set()).add((page_url, 'script'))
+                else:
+                    contexts.setdefault(resource_url.replace('"', ''), set()).add((page_url, resource_type))
+    return contexts
+
+def is_covered(engine, url, contexts):
+    # an ad only counts as blocked by the lists if it is blocked on every page
+    # it was seen on. without its pages, it has to be blocked on every page,
+    # whatever type it was loaded as
+    if url in contexts:
+        return all(engine.check(url, page_url, request_type) for page_url, request_type in contexts[url])
+    return all(engine.check_on_every_page(url, request_type) for request_type in REQUEST_TYPES)
+
+def generate_filterlist(region, non_ad_files, chains_folder, min_paths, snapshot_dir):
     upstream_file = region + '.txt'
-    rules = set()
-    all_rules = dict()
     with open(upstream_file, 'r') as upstream:
-        for line in upstream.readlines():
-            line = line.strip()
-            url_to_use = line
-            url_parts = urlsplit(url_to_use)
-            rule = '||' + get_sld(url_parts.netloc) + url_parts.path
-            if rule in rules:
-                all_rules[rule] += 1
-            else:
-                all_rules[rule] = 1
-                rules.add(rule)
-
-    print(len(rules))
-    print(all_rules)
+        ads = [line.strip() for line in upstream if line.strip()]
+    non_ads = read_non_ads(non_ad_files)
+
+    tries = dict()
+    for url in ads:
+        domain = registrable_domain(hostname(url))
+        if domain:
+            tries.setdefault(domain, PathNode()).add(url_path(url), url)
+    for url in non_ads:
+        domain = registrable_domain(hostname(url))
+        if domain in tries:
+            tries[domain].add(url_path(url))
+
+    rules = dict()
+    for domain in sorted(tries):
+        tries[domain].count()
+        synthesize(domain, tries[domain], [], min_paths, rules)
+    print(str(len(ads)) + ' ads on ' + str(len(tries)) + ' domains, ' + str(sum(trie.ad_paths for trie in tries.values())) + ' rules with one per path')
+
+    # rules for which every ad is already blocked by the lists add nothing
+    with open(os.path.join(LIST_FOLDER, 'easylist.txt'), 'r', encoding='utf-8') as easylist:
+        lines = easylist.read().split('\n')
+    with open(os.path.join(LIST_FOLDER, 'easyprivacy.txt'), 'r', encoding='utf-8') as easyprivacy:
+        lines += easyprivacy.read().split('\n')
+    lists = load_engine(lines, snapshot_dir)
+    contexts = read_ad_contexts(chains_folder, region)
+    covered = {url: is_covered(lists, url, contexts) for url in set(ads)}
+    dropped = [rule for rule, rule_ads in rules.items() if all(covered[url] for url in rule_ads)]
+    for rule in dropped:
+        del rules[rule]
+
+    output_rules = sorted(rules)
+    print(str(len(output_rules)) + ' rules, ' + str(len(dropped)) + ' dropped as already in EasyList or EasyPrivacy')
+
+    generated = FilterEngine(output_rules)
+    matched = sum(1 for url in ads if covered[url] or is_blocked(generated, url))
+    print(str(matched) + ' of ' + str(len(ads)) + ' ads blocked by the rules or the lists')
+    print(str(sum(1 for url in non_ads if is_blocked(generated, url))) + ' of ' + str(len(non_ads)) + ' non ads blocked by the rules')
+
     with open(region + '.rules', 'w') as output:
-        output.write('\n'.join(rules))
+        output.write('\n'.join(output_rules) + '\n')
 
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description='Regional filterlist generator')
     parser.add_argument('--region', help='Region to generate filterlist for')
+    parser.add_argument('--non-ads', action='append', help='resources classified as no ad, in the format of adblock-rust-checking/resources, defaults to those of the region')
+    parser.add_argument('--chains-folder', default=CHAINS_FOLDER, help='folder with the upstream chains of the regions, for the pages the ads were seen on')
+    parser.add_argument('--min-paths', type=int, default=2, help='number of ad paths needed to turn a folder or domain into a single rule')
+    add_snapshot_arguments(parser)
 
     args = parser.parse_args()
-    generate_filterlist(args.region)
+    generate_filterlist(args.region, args.non_ads or default_non_ad_files(args.region), args.chains_folder, args.min_paths, args.snapshot_dir)
@@ -110,4 +110,18 @@ CREATE TABLE classifications (
   is_classified_as_ad_easyprivacy boolean default null,
   is_classified_as_ad_combined_filter_lists boolean default null,
   chain_element_block text default null
-);
\ No newline at end of file
+);
+
+CREATE INDEX classifications_imaged_data_idx ON classifications (imaged_data);
+
+-- image features are upserted on imaged_data, so reruns don't duplicate them
+CREATE UNIQUE INDEX image_features_imaged_data_idx ON image_features (imaged_data);
+
+-- page graph files a job has processed, with the etag they had at the time
+CREATE TABLE processed_pages (
+  job text,
+  file_name text,
+  content_hash text,
+  processed_at timestamp default now(),
+  primary key (job, file_name)
+);
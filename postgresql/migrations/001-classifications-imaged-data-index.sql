@@ -0,0 +1,5 @@
+-- the loaders in adblock-rust-checking update classifications by imaged_data
+\connect crawling_results
+SET ROLE crawler;
+
+CREATE INDEX IF NOT EXISTS classifications_imaged_data_idx ON classifications (imaged_data);
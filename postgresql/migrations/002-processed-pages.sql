@@ -0,0 +1,17 @@
+-- checkpoints for resumable and incremental feature extraction
+\connect crawling_results
+SET ROLE crawler;
+
+-- reruns used to insert the features of an image again, keep one row per image
+DELETE FROM image_features a USING image_features b
+  WHERE a.imaged_data = b.imaged_data AND a.ctid < b.ctid;
+
+CREATE UNIQUE INDEX IF NOT EXISTS image_features_imaged_data_idx ON image_features (imaged_data);
+
+CREATE TABLE IF NOT EXISTS processed_pages (
+  job text,
+  file_name text,
+  content_hash text,
+  processed_at timestamp default now(),
+  primary key (job, file_name)
+);
@@ -0,0 +1,297 @@
+import argparse
+import json
+import os
+import re
+import sys
+import psycopg2
+import psycopg2.extras
+from tqdm import tqdm
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+from common.filterlist import (COMMENT, COSMETIC, COSMETIC_EXCEPTION, COSMETIC_RE, EXCEPTION, FIRST_PARTY, HOSTNAME_ANCHOR,
+                               IMPORTANT, LEFT_ANCHOR, MATCH_CASE, NETWORK, NETWORK_EXCEPTION, REGEX, RIGHT_ANCHOR,
+                               THIRD_PARTY, TOKEN_RE, FilterIndex, NetworkFilter, Request, host_suffixes, parse_filter,
+                               rule_kind)
+
+EASYLIST = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'adblock-rust-checking', 'filter_lists', 'easylist.txt')
+
+FIELD_RE = re.compile(r'("[^"]*")|[^,]+')
+
+class Rule:
+    # a line of a filter list with what it parses into: a NetworkFilter, or the
+    # (separator, selector, domains, excluded domains) of a cosmetic rule
+    __slots__ = ['source', 'line', 'text', 'kind', 'network_filter', 'cosmetic', 'key', 'duplicate_of', 'subsumed_by', 'hits', 'ad_hits']
+
+    def __init__(self, source, line, text):
+        self.source = source
+        self.line = line
+        self.text = text
+        self.kind = rule_kind(text)
+        self.network_filter = None
+        self.cosmetic = None
+        self.duplicate_of = None
+        self.subsumed_by = None
+        self.hits = 0
+        self.ad_hits = 0
+
+        if self.kind in (COSMETIC, COSMETIC_EXCEPTION):
+            self.cosmetic = parse_cosmetic(text)
+            self.key = (self.kind,) + self.cosmetic
+        else:
+            network_filter = parse_filter(text)
+            if isinstance(network_filter, NetworkFilter):
+                self.network_filter = network_filter
+                # the order of the options doesn't matter
+                self.key = (self.kind, network_filter.pattern, network_filter.flags, network_filter.types, network_filter.domains, network_filter.not_domains)
+            else:
+                # filters the engine skips or a $badfilter, only exact copies are found
+                self.key = (self.kind, text)
+
+    def options(self):
+        if self.kind in (NETWORK, NETWORK_EXCEPTION) and '$' in self.text and not self.text.endswith('/'):
+            return self.text.rsplit('$', 1)[1].split(',')
+        return []
+
+    def describe(self):
+        return {'list': self.source, 'line': self.line, 'text': self.text}
+
+def parse_cosmetic(text):
+    separator = COSMETIC_RE.search(text)
+    domains = [domain.strip().lower() for domain in text[:separator.start()].split(',') if domain.strip()]
+    included = frozenset(domain for domain in domains if not domain.startswith('~')) or None
+    excluded = frozenset(domain[1:] for domain in domains if domain.startswith('~')) or None
+    return separator.group().replace('@', ''), text[separator.end():], included, excluded
+
+def read_rules(path, source):
+    rules = []
+    with open(path, 'r', encoding='utf-8') as list_file:
+        for number, line in enumerate(list_file, 1):
+            line = line.strip()
+            if rule_kind(line) != COMMENT:
+                rules.append(Rule(source, number, line))
+    return rules
+
+def domains_cover(domains, other_domains):
+    # every page other_domains applies to is one domains applies to as well
+    if domains is None:
+        return True
+    if other_domains is None:
+        return False
+    return all(not domains.isdisjoint(host_suffixes(domain)) for domain in other_domains)
+
+def pattern_covers(network_filter, other):
+    # every url other matches is matched by network_filter, with both patterns
+    # read as globs. a pattern covers those that start with it when both have
+    # the same left anchor, and an unanchored one those that contain it
+    pattern = network_filter.pattern
+    other_pattern = other.pattern if network_filter.flags & MATCH_CASE else other.pattern.lower()
+    anchors = HOSTNAME_ANCHOR | LEFT_ANCHOR | RIGHT_ANCHOR | REGEX
+    if network_filter.flags & (RIGHT_ANCHOR | REGEX):
+        return network_filter.flags & anchors == other.flags & anchors and pattern == other_pattern
+    if other.flags & REGEX:
+        return False
+    if network_filter.flags & (HOSTNAME_ANCHOR | LEFT_ANCHOR):
+        left = HOSTNAME_ANCHOR | LEFT_ANCHOR
+        return network_filter.flags & left == other.flags & left and other_pattern.startswith(pattern)
+    return pattern in other_pattern
+
+def network_covers(network_filter, other):
+    flags = network_filter.flags
+    if flags & (EXCEPTION | IMPORTANT) != other.flags & (EXCEPTION | IMPORTANT):
+        return False
+    if network_filter.types & other.types != other.types:
+        return False
+    for party in (THIRD_PARTY, FIRST_PARTY, MATCH_CASE):
+        if flags & party and not other.flags & party:
+            return False
+    if not domains_cover(network_filter.domains, other.domains):
+        return False
+    if network_filter.not_domains is not None and (other.not_domains is None or not network_filter.not_domains <= other.not_domains):
+        return False
+    return pattern_covers(network_filter, other)
+
+def cosmetic_covers(cosmetic, other):
+    # a generic rule never covers one for some sites: a $generichide exception,
+    # of the site or of another list, turns off only the generic one
+    separator, selector, included, excluded = cosmetic
+    if included is None and other[2] is not None:
+        return False
+    return separator == other[0] and selector == other[1] and excluded is None and domains_cover(included, other[2])
+
+class SubsumptionIndex:
+    # network rules in buckets by their rarest token: a rule can only cover
+    # another one whose pattern has all its tokens. cosmetic rules by selector
+    def __init__(self, rules):
+        counts = dict()
+        for rule in rules:
+            if rule.network_filter is not None:
+                for token in rule.network_filter.tokens():
+                    counts[token] = counts.get(token, 0) + 1
+
+        self.buckets = dict()
+        self.fallback = []
+        self.selectors = dict()
+        for rule in rules:
+            if rule.network_filter is not None:
+                tokens = rule.network_filter.tokens()
+                if tokens:
+                    self.buckets.setdefault(min(tokens, key=lambda token: counts[token]), []).append(rule)
+                else:
+                    self.fallback.append(rule)
+            elif rule.cosmetic is not None:
+                self.selectors.setdefault((rule.kind, rule.cosmetic[1]), []).append(rule)
+
+    def candidates(self, rule):
+        if rule.network_filter is not None:
+            for token in set(TOKEN_RE.findall(rule.network_filter.pattern.lower())):
+                yield from self.buckets.get(token, [])
+            yield from self.fallback
+        elif rule.cosmetic is not None:
+            yield from self.selectors.get((rule.kind, rule.cosmetic[1]), [])
+
+def covers(rule, other):
+    if rule.kind != other.kind:
+        return False
+    if rule.network_filter is not None and other.network_filter is not None:
+        return network_covers(rule.network_filter, other.network_filter)
+    if rule.cosmetic is not None and other.cosmetic is not None:
+        return cosmetic_covers(rule.cosmetic, other.cosmetic)
+    return False
+
+def find_redundant(rules, easylist_rules):
+    # exact copies of an earlier rule, then rules covered by a broader one of
+    # the list or of easylist. of two rules that cover each other, the later
+    # one is the redundant one
+    first = dict()
+    for rule in rules:
+        if rule.key in first:
+            rule.duplicate_of = first[rule.key]
+        else:
+            first[rule.key] = rule
+
+    unique_rules = [rule for rule in rules if rule.duplicate_of is None]
+    index = SubsumptionIndex(unique_rules + easylist_rules)
+    for rule in tqdm(unique_rules):
+        for candidate in index.candidates(rule):
+            if candidate is rule or not covers(candidate, rule):
+                continue
+            if candidate.source == rule.source and candidate.line > rule.line and covers(rule, candidate):
+                continue
+            rule.subsumed_by = candidate
+            break
+
+def read_classifications(pg_conn):
+    # the classified resources, and the scripts blocking them through their chain
+    cur = pg_conn.cursor('classifications', cursor_factory=psycopg2.extras.RealDictCursor)
+    cur.execute('select page_url, resource_url, resource_type, is_classified_as_ad, chain_element_block from classifications where is_classified_as_ad is not null')
+    for row in cur:
+        yield row['page_url'], row['resource_url'], row['resource_type'], row['is_classified_as_ad']
+        if row['chain_element_block']:
+            yield row['page_url'], row['chain_element_block'], 'script', row['is_classified_as_ad']
+    cur.close()
+
+def read_resource_files(files):
+    # files in the format of adblock-rust-checking/resources, ads unless nonad is in the name
+    for file_name in files:
+        is_ad = 'nonad' not in os.path.basename(file_name)
+        with open(file_name, 'r', encoding='utf-8') as resource_file:
+            for line in resource_file:
+                fields = [match.group(0).replace('"', '') for match in FIELD_RE.finditer(line.rstrip('\n'))]
+                if len(fields) >= 3:
+                    yield fields[0], fields[2], fields[1], is_ad
+
+def count_hits(rules, requests):
+    # how many requests each network rule matches, whether or not another rule
+    # would have decided them first
+    network_rules = [rule for rule in rules if rule.network_filter is not None and rule.duplicate_of is None]
+    index = FilterIndex([rule.network_filter for rule in network_rules])
+    total = 0
+    for page_url, resource_url, resource_type, is_ad in tqdm(requests):
+        if not resource_url or resource_url.startswith(('data:', 'blob:')):
+            continue
+        total += 1
+        request = Request(resource_url, page_url or '', resource_type or 'other')
+        for i in set(index.candidates(request)):
+            if index.filter(i).matches(request):
+                network_rules[i].hits += 1
+                if is_ad:
+                    network_rules[i].ad_hits += 1
+    return total
+
+def report(path, rules, requests_checked):
+    kinds = dict()
+    for rule in rules:
+        kinds[rule.kind] = kinds.get(rule.kind, 0) + 1
+
+    details = []
+    for rule in rules:
+        detail = {'line': rule.line, 'text': rule.text, 'kind': rule.kind, 'options': rule.options()}
+        if rule.duplicate_of is not None:
+            detail['duplicate_of'] = rule.duplicate_of.describe()
+        if rule.subsumed_by is not None:
+            detail['subsumed_by'] = rule.subsumed_by.describe()
+        if requests_checked is not None and rule.network_filter is not None and rule.duplicate_of is None:
+            detail['hits'] = rule.hits
+            detail['ad_hits'] = rule.ad_hits
+        details.append(detail)
+
+    summary = {
+        'list': path,
+        'rules': len(rules),
+        'kinds': kinds,
+        'duplicates': sum(1 for rule in rules if rule.duplicate_of is not None),
+        'subsumed': sum(1 for rule in rules if rule.subsumed_by is not None),
+        'subsumed_by_easylist': sum(1 for rule in rules if rule.subsumed_by is not None and rule.subsumed_by.source == 'easylist')
+    }
+    if requests_checked is not None:
+        summary['requests'] = requests_checked
+        summary['unused'] = sum(1 for rule in rules if rule.network_filter is not None and rule.duplicate_of is None and rule.hits == 0)
+    return summary, details
+
+def write_pruned(path, rules, drop_unused, output_path):
+    # the list without the duplicate and subsumed rules (and the unused ones),
+    # comments and everything else stay where they are
+    dropped = set(rule.line for rule in rules if rule.duplicate_of is not None or rule.subsumed_by is not None)
+    if drop_unused:
+        dropped.update(rule.line for rule in rules if rule.network_filter is not None and rule.hits == 0)
+    with open(path, 'r', encoding='utf-8') as list_file, open(output_path, 'w', encoding='utf-8') as output:
+        for number, line in enumerate(list_file, 1):
+            if number not in dropped:
+                output.write(line)
+    print(str(len(dropped)) + ' rules left out of ' + output_path)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='duplicate, subsumed and unused rules of a filter list')
+    parser.add_argument('filter_list', help='filter list to analyze')
+    parser.add_argument('--easylist', default=EASYLIST, help='list whose rules can cover those of the analyzed one, empty for none')
+    parser.add_argument('--classifications', action='store_true', help='count the hits of the rules on the classifications in PG_CONNECTION_STRING')
+    parser.add_argument('--resources', action='append', help='count the hits on files in the format of adblock-rust-checking/resources instead')
+    parser.add_argument('--report', default='filterlist_analysis.json', help='where to write the report')
+    parser.add_argument('--pruned', help='write the list without the duplicate and subsumed rules here')
+    parser.add_argument('--drop-unused', action='store_true', help='leave the rules without hits out of the pruned list as well')
+
+    args = parser.parse_args()
+    rules = read_rules(args.filter_list, 'list')
+    easylist_rules = []
+    if args.easylist and os.path.abspath(args.easylist) != os.path.abspath(args.filter_list):
+        easylist_rules = read_rules(args.easylist, 'easylist')
+    find_redundant(rules, easylist_rules)
+
+    requests_checked = None
+    if args.classifications:
+        pg_conn = psycopg2.connect(os.environ['PG_CONNECTION_STRING'])
+        requests_checked = count_hits(rules, read_classifications(pg_conn))
+        pg_conn.close()
+    elif args.resources:
+        requests_checked = count_hits(rules, read_resource_files(args.resources))
+    if args.drop_unused and requests_checked is None:
+        parser.error('--drop-unused needs --classifications or --resources')
+
+    summary, details = report(args.filter_list, rules, requests_checked)
+    for key, value in summary.items():
+        print(key + ': ' + str(value))
+    with open(args.report, 'w') as report_file:
+        json.dump({'summary': summary, 'rules': details}, report_file, indent=2)
+
+    if args.pruned:
+        write_pruned(args.filter_list, rules, args.drop_unused, args.pruned)
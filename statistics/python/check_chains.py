@@ -0,0 +1,96 @@
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+from common.filterlist import add_snapshot_arguments, load_engine
+from common.urls import hostname
+
+BASE_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+LIST_FOLDER = os.path.join(BASE_FOLDER, 'js', 'filter_lists')
+CHAINS_FOLDER = os.path.join(BASE_FOLDER, '..', 'chains_resources')
+
+def read_rules(path):
+    with open(path, 'r', encoding='utf-8') as list_file:
+        return list_file.read().split('\n')
+
+def read_combined_rules(region):
+    # same files as js/check.js
+    supplement_folder = os.path.join(LIST_FOLDER, region)
+    supplement_file = sorted(os.listdir(supplement_folder))[0]
+    return read_rules(os.path.join(LIST_FOLDER, 'easylist.txt')) + read_rules(os.path.join(supplement_folder, supplement_file)) + read_rules(os.path.join(LIST_FOLDER, 'easyprivacy.txt'))
+
+def is_inline(url):
+    return url.startswith('blob:') or url.startswith('data:')
+
+def check_chains(engine, chains):
+    # the counts of js/check.js: an ad is blocked by the top most blocked
+    # script of its chain, or by itself when none of them is blocked. the
+    # engine only looks at the host of the page, so checks are kept per host
+    checked = dict()
+
+    def is_blocked(url, page_url, request_type):
+        key = (url, hostname(page_url), request_type)
+        if key not in checked:
+            checked[key] = engine.check(url, page_url, request_type)
+        return checked[key]
+
+    found_blocked = set()
+    all_blocked_unique = set()
+    all_blocked = 0
+    blocked = {'image': 0, 'sub_frame': 0}
+    blocked_unique = {'image': set(), 'sub_frame': set()}
+    not_top_most_one = 0
+    for page_url, page_chains in chains.items():
+        for resource_url, resource_type, chain in page_chains.values():
+            resource_url = resource_url.replace('"', '')
+            request_type = 'image' if resource_type == 'image' else 'sub_frame'
+
+            found = False
+            top_down = chain[::-1]
+            for i, script_url in enumerate(top_down):
+                if not is_inline(script_url) and is_blocked(script_url, page_url, 'script'):
+                    if i != 0:
+                        not_top_most_one += 1
+                    found_blocked.add(script_url)
+                    all_blocked += len(top_down) - i
+                    all_blocked_unique.update(top_down[i:])
+                    found = True
+                    break
+
+            if not found:
+                if is_inline(resource_url) or not is_blocked(resource_url, page_url, request_type):
+                    continue
+                found_blocked.add(resource_url)
+
+            all_blocked += 1
+            all_blocked_unique.add(resource_url)
+            blocked[request_type] += 1
+            blocked_unique[request_type].add(resource_url)
+
+    print(str(len(checked)) + ' checks')
+    print('unique resources that is blocking: ' + str(len(found_blocked)))
+    print('all resources blocked: ' + str(len(all_blocked_unique)))
+    print('resources blocked: ' + str(all_blocked))
+    print('images blocked: ' + str(blocked['image']))
+    print('unique images blocked: ' + str(len(blocked_unique['image'])))
+    print('frames blocked: ' + str(blocked['sub_frame']))
+    print('unique frames blocked: ' + str(len(blocked_unique['sub_frame'])))
+    print('not top most one: ' + str(not_top_most_one))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='ads blocked by the combined lists of a region, directly or through their chain')
+    parser.add_argument('-s', '--supplement', help='supplement list to use')
+    parser.add_argument('--chains', help='chains to check, defaults to the downstream chains of generate_chains.py for the region')
+    add_snapshot_arguments(parser)
+
+    args = parser.parse_args()
+    start = time.time()
+    engine = load_engine(read_combined_rules(args.supplement), args.snapshot_dir)
+    print(str(len(engine)) + ' filters in ' + '%.2f' % (time.time() - start) + 's')
+
+    chains_path = args.chains or os.path.join(CHAINS_FOLDER, args.supplement, 'downstream_everything.json')
+    with open(chains_path, 'r') as chains_file:
+        check_chains(engine, json.load(chains_file))
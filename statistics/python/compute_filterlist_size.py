@@ -1,38 +1,33 @@
-with open('../../adblock-rust-checking/filter_lists/albania/Albania.txt', 'r') as albania:
-    total_rules = 0
-    network_rules = 0
-    for line in albania.readlines():
-        line = line.strip()
-        if line and not line.startswith('!'):
-            total_rules += 1
-        if line and not ('##' in line):
-            network_rules += 1
+import argparse
+import os
+import sys
 
-    print('Albania: ' + str(total_rules))
-    print('network rules: ' + str(network_rules))
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+from common.filterlist import COMMENT, NETWORK, NETWORK_EXCEPTION, rule_kind
 
-with open('../../adblock-rust-checking/filter_lists/hungary/hufilter.txt', 'r') as hungary:
-    total_rules = 0
-    network_rules = 0
-    for line in hungary.readlines():
-        line = line.strip()
-        if line and not line.startswith('!'):
-            total_rules += 1
-        if line and not ('##' in line):
-            network_rules += 1
+LIST_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'adblock-rust-checking', 'filter_lists')
 
-    print('Hungary: ' + str(total_rules))
-    print('network rules: ' + str(network_rules))
+LISTS = [
+    ('Albania', os.path.join(LIST_FOLDER, 'albania', 'Albania.txt')),
+    ('Hungary', os.path.join(LIST_FOLDER, 'hungary', 'hufilter.txt')),
+    ('Sri Lanka', os.path.join(LIST_FOLDER, 'sri_lanka', 'sri_lanka.txt'))
+]
 
-with open('../../adblock-rust-checking/filter_lists/sri_lanka/sri_lanka.txt', 'r') as sri_lanka:
-    total_rules = 0
-    network_rules = 0
-    for line in sri_lanka.readlines():
-        line = line.strip()
-        if line and not line.startswith('!'):
-            total_rules += 1
-        if line and not ('##' in line):
-            network_rules += 1
+def count_rules(path):
+    kinds = dict()
+    with open(path, 'r', encoding='utf-8') as filter_list:
+        for line in filter_list:
+            kind = rule_kind(line)
+            kinds[kind] = kinds.get(kind, 0) + 1
+    return kinds
 
-    print('Sri Lanka: ' + str(total_rules))
-    print('network rules: ' + str(network_rules))
\ No newline at end of file
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='number of rules and network rules of filter lists')
+    parser.add_argument('lists', nargs='*', help='filter lists to count, defaults to the supplement lists')
+
+    args = parser.parse_args()
+    lists = [(path, path) for path in args.lists] or LISTS
+    for name, path in lists:
+        kinds = count_rules(path)
+        print(name + ': ' + str(sum(count for kind, count in kinds.items() if kind != COMMENT)))
+        print('network rules: ' + str(kinds.get(NETWORK, 0) + kinds.get(NETWORK_EXCEPTION, 0)))
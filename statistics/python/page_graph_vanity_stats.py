@@ -1,19 +1,19 @@
-from networkx import graphml
-
 import argparse
 import os
+import sys
 import psycopg2
 import psycopg2.extras
 
 from s3fs.core import S3FileSystem
-from tempfile import TemporaryDirectory
 
 from urllib.parse import urlsplit
 from tqdm import tqdm
 
-import html
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+from common.pagegraph import load_page_graph
+from common.s3cache import S3Cache, add_cache_arguments
 
-def generate_vanity_stats(bucket, s3, region):
+def generate_vanity_stats(bucket, s3_cache, region):
     pg_conn = psycopg2.connect(os.environ['PG_CONNECTION_STRING'] + '/' + region)
     page_graph_cur = pg_conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
     page_graph_cur.execute('select distinct on (queried_url) file_name from graphml_mappings')
@@ -25,29 +25,23 @@ def generate_vanity_stats(bucket, s3, region):
     for entry in tqdm(page_graph_cur.fetchall()):
         graphml_path = entry['file_name']
 
-        with TemporaryDirectory() as temp_dir:
-            local_file = os.path.join(temp_dir, graphml_path.split('/')[-1])
-            try:
-                s3.s3.download_file(bucket, graphml_path, local_file)
-            except:
-                print('cannot find file ' + graphml_path)
-                continue
-
-            with open(local_file, 'r') as graphml_file:
-                page_graph_data = ''
-                for line in graphml_file:
-                    page_graph_data += line
+        try:
+            local_file = s3_cache.fetch(bucket, graphml_path)
+        except:
+            print('cannot find file ' + graphml_path)
+            continue
 
-                try:
-                    page_graph = graphml.parse_graphml(page_graph_data)
-                except:
-                    continue
+        try:
+            # only the node and edge counts are needed, so no attributes are kept
+            page_graph = load_page_graph(local_file, frozenset(), frozenset())
+        except:
+            continue
 
-                total_graph_files += 1
-                total_nodes += len(page_graph.nodes)
-                total_edges += len(page_graph.edges)
+        total_graph_files += 1
+        total_nodes += len(page_graph.nodes)
+        total_edges += len(page_graph.edges)
 
-                total_size_mb += (os.path.getsize(local_file) / 1000000)
+        total_size_mb += (os.path.getsize(local_file) / 1000000)
 
     return total_nodes / total_graph_files, total_edges / total_graph_files, total_size_mb / total_graph_files
 
@@ -56,13 +50,15 @@ if __name__ == "__main__":
     parser.add_argument('--aws-access-key', help='aws access key')
     parser.add_argument('--aws-secret-key', help='aws secret key')
     parser.add_argument('--pg-bucket', help='aws bucket address')
+    add_cache_arguments(parser)
 
     args = parser.parse_args()
     s3Bucket = S3FileSystem(anon=False, key=args.aws_access_key, secret=args.aws_secret_key)
+    s3_cache = S3Cache(s3Bucket.s3, args.cache_dir, args.cache_size)
 
     print('sri lanka: ')
-    print(generate_vanity_stats(args.pg_bucket, s3Bucket, 'sri_lanka'))
+    print(generate_vanity_stats(args.pg_bucket, s3_cache, 'sri_lanka'))
     print('hungary: ')
-    print(generate_vanity_stats(args.pg_bucket, s3Bucket, 'hungary'))
+    print(generate_vanity_stats(args.pg_bucket, s3_cache, 'hungary'))
     print('albania: ')
-    print(generate_vanity_stats(args.pg_bucket, s3Bucket, 'albania'))
\ No newline at end of file
+    print(generate_vanity_stats(args.pg_bucket, s3_cache, 'albania'))
\ No newline at end of file
@@ -0,0 +1,55 @@
+import importlib.util
+import os
+import shutil
+import tempfile
+import unittest
+
+BASE_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+spec = importlib.util.spec_from_file_location('analyze_filterlist', os.path.join(BASE_FOLDER, 'statistics', 'python', 'analyze_filterlist.py'))
+analyze_filterlist = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(analyze_filterlist)
+
+class CosmeticCoverageTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def write_list(self, name, lines):
+        path = os.path.join(self.folder, name)
+        with open(path, 'w', encoding='utf-8') as list_file:
+            list_file.write('\n'.join(lines) + '\n')
+        return path
+
+    def test_generic_rule_does_not_cover_site_rule(self):
+        # with @@||index.hu^$generichide in another list, only the site rule
+        # still hides the element on index.hu
+        path = self.write_list('hufilter.txt', ['! hufilter', 'index.hu##.ad_container', '##.ad_container'])
+        easylist = self.write_list('easylist.txt', ['##.ad_container', '@@||index.hu^$generichide'])
+        rules = analyze_filterlist.read_rules(path, 'list')
+        analyze_filterlist.find_redundant(rules, analyze_filterlist.read_rules(easylist, 'easylist'))
+        self.assertIsNone(rules[0].subsumed_by)
+        self.assertEqual(rules[1].subsumed_by.source, 'easylist')
+
+        pruned = os.path.join(self.folder, 'pruned.txt')
+        analyze_filterlist.write_pruned(path, rules, False, pruned)
+        with open(pruned, 'r', encoding='utf-8') as pruned_file:
+            self.assertEqual(pruned_file.read(), '! hufilter\nindex.hu##.ad_container\n')
+
+    def test_site_rule_covers_rule_of_subdomain(self):
+        rules = [
+            analyze_filterlist.Rule('list', 1, 'index.hu##.ad_container'),
+            analyze_filterlist.Rule('list', 2, 'divany.index.hu,totalcar.hu##.ad_container'),
+            analyze_filterlist.Rule('list', 3, 'divany.index.hu##.ad_container'),
+            analyze_filterlist.Rule('list', 4, 'index.hu#@#.ad_container')
+        ]
+        analyze_filterlist.find_redundant(rules, [])
+        self.assertIsNone(rules[0].subsumed_by)
+        self.assertIsNone(rules[1].subsumed_by)
+        self.assertIs(rules[2].subsumed_by, rules[0])
+        self.assertIsNone(rules[3].subsumed_by)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,49 @@
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from common.filterlist import DEFAULT_SNAPSHOT_DIR, FilterEngine, SnapshotEngine, load_engine
+from common.s3cache import DEFAULT_CACHE_DIR
+
+LINES = [
+    '||ads.example.com^',
+    '||tracker.com^$third-party',
+    '/banner/*$image,domain=news.com',
+    '@@||ads.example.com/allowed^'
+]
+
+REQUESTS = [
+    ('https://ads.example.com/x.js', 'https://news.com/', 'script'),
+    ('https://ads.example.com/allowed/x.js', 'https://news.com/', 'script'),
+    ('https://tracker.com/t.gif', 'https://news.com/', 'image'),
+    ('https://tracker.com/t.gif', 'https://tracker.com/', 'image'),
+    ('https://cdn.com/banner/1.png', 'https://news.com/', 'image'),
+    ('https://cdn.com/banner/1.png', 'https://other.com/', 'image')
+]
+
+class SnapshotTest(unittest.TestCase):
+    def setUp(self):
+        self.snapshot_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.snapshot_dir)
+
+    def test_snapshot_blocks_like_the_parsed_engine(self):
+        parsed = load_engine(LINES, self.snapshot_dir)
+        snapshot = load_engine(LINES, self.snapshot_dir)
+        self.assertIsInstance(snapshot, SnapshotEngine)
+        expected = [True, False, True, False, True, False]
+        self.assertEqual([parsed.check(*request) for request in REQUESTS], expected)
+        self.assertEqual([snapshot.check(*request) for request in REQUESTS], expected)
+        self.assertEqual([FilterEngine(LINES).check(*request) for request in REQUESTS], expected)
+
+    def test_snapshots_are_not_in_the_download_cache(self):
+        # the S3 cache evicts everything under its folder
+        cache_dir = os.path.join(os.path.abspath(DEFAULT_CACHE_DIR), '')
+        self.assertFalse(os.path.abspath(DEFAULT_SNAPSHOT_DIR).startswith(cache_dir))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,64 @@
+import importlib.util
+import json
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+BASE_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.append(BASE_FOLDER)
+from common.filterlist import FilterEngine
+
+spec = importlib.util.spec_from_file_location('generate_filterlist', os.path.join(BASE_FOLDER, 'filterlist-generator', 'generate_filterlist.py'))
+generate_filterlist = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(generate_filterlist)
+
+AD = 'https://ads.com/x.js'
+
+class CoverageTest(unittest.TestCase):
+    def setUp(self):
+        self.chains_folder = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.chains_folder)
+
+    def write_chains(self, file_name, chains):
+        os.makedirs(os.path.join(self.chains_folder, 'region'), exist_ok=True)
+        with open(os.path.join(self.chains_folder, 'region', file_name), 'w') as chains_file:
+            json.dump(chains, chains_file)
+
+    def test_third_party_filter_does_not_cover_first_party_ad(self):
+        engine = FilterEngine(['||ads.com^$third-party'])
+        self.assertFalse(generate_filterlist.is_covered(engine, AD, {AD: {('https://ads.com/', 'script')}}))
+        self.assertFalse(generate_filterlist.is_covered(engine, AD, {AD: {('https://news.com/', 'script'), ('https://ads.com/', 'script')}}))
+        self.assertTrue(generate_filterlist.is_covered(engine, AD, {AD: {('https://news.com/', 'script')}}))
+        # without its pages, the ad could be first party somewhere
+        self.assertFalse(generate_filterlist.is_covered(engine, AD, {}))
+
+    def test_ad_without_pages_needs_a_filter_for_every_page_and_type(self):
+        self.assertTrue(generate_filterlist.is_covered(FilterEngine(['||ads.com^']), AD, {}))
+        self.assertFalse(generate_filterlist.is_covered(FilterEngine(['||ads.com^$script']), AD, {}))
+        self.assertFalse(generate_filterlist.is_covered(FilterEngine(['||ads.com^$domain=news.com']), AD, {}))
+        self.assertFalse(generate_filterlist.is_covered(FilterEngine(['||ads.com^', '@@||ads.com/x.js$domain=other.com']), AD, {}))
+        self.assertTrue(generate_filterlist.is_covered(FilterEngine(['||ads.com^$important', '@@||ads.com/x.js$domain=other.com']), AD, {}))
+
+    def test_contexts_come_from_the_upstream_chains(self):
+        self.write_chains('upstream_lists.json', {
+            'https://news.com/': {'s3://images/1.png': ['"https://cdn.com/1.png"', 'image', ['https://news.com/app.js', AD]]}
+        })
+        self.write_chains('upstream_us_difference_lists.json', {
+            'https://ads.com/': {'s3://images/2.png': ['"https://ads.com/banner.html"', 'iframe', []]}
+        })
+        contexts = generate_filterlist.read_ad_contexts(self.chains_folder, 'region')
+        self.assertEqual(contexts, {
+            AD: {('https://news.com/', 'script')},
+            'https://ads.com/banner.html': {('https://ads.com/', 'iframe')}
+        })
+
+        engine = FilterEngine(['||ads.com^$third-party'])
+        self.assertTrue(generate_filterlist.is_covered(engine, AD, contexts))
+        self.assertFalse(generate_filterlist.is_covered(engine, 'https://ads.com/banner.html', contexts))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,107 @@
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from common.s3cache import S3Cache
+
+class FakeS3:
+    # head_object and download_file of a boto3 client, backed by a folder with
+    # one subfolder per bucket. the etag changes whenever an object is written
+    def __init__(self, folder):
+        self.folder = folder
+        self.etags = dict()
+        self.downloads = 0
+        self.fail_downloads = False
+
+    def put(self, bucket, key, content):
+        os.makedirs(os.path.join(self.folder, bucket), exist_ok=True)
+        with open(os.path.join(self.folder, bucket, key), 'wb') as s3_object:
+            s3_object.write(content)
+        self.etags[(bucket, key)] = self.etags.get((bucket, key), 0) + 1
+
+    def head_object(self, Bucket, Key):
+        return {'ETag': '"' + str(self.etags[(Bucket, Key)]) + '"'}
+
+    def download_file(self, bucket, key, path):
+        self.downloads += 1
+        with open(path, 'wb') as partial:
+            partial.write(b'partial')
+        if self.fail_downloads:
+            raise IOError('connection reset')
+        shutil.copyfile(os.path.join(self.folder, bucket, key), path)
+
+def cached_files(cache_dir):
+    return sorted(name for _folder, _dirs, files in os.walk(cache_dir) for name in files)
+
+class S3CacheTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.cache_dir = os.path.join(self.folder, 'cache')
+        self.s3 = FakeS3(os.path.join(self.folder, 's3'))
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def test_same_etag_is_a_hit(self):
+        self.s3.put('bucket', 'page.graphml', b'graph')
+        cache = S3Cache(self.s3, self.cache_dir)
+        path = cache.fetch('bucket', 'page.graphml')
+        self.assertEqual(cache.fetch('bucket', 'page.graphml'), path)
+        self.assertEqual(self.s3.downloads, 1)
+        self.assertTrue(path.endswith('.graphml'))
+        with open(path, 'rb') as cached:
+            self.assertEqual(cached.read(), b'graph')
+
+    def test_changed_etag_downloads_again(self):
+        self.s3.put('bucket', 'page.graphml', b'old graph')
+        cache = S3Cache(self.s3, self.cache_dir)
+        old_path, old_etag = cache.fetch_with_etag('bucket', 'page.graphml')
+
+        self.s3.put('bucket', 'page.graphml', b'new graph')
+        new_path, new_etag = cache.fetch_with_etag('bucket', 'page.graphml')
+        self.assertNotEqual(new_etag, old_etag)
+        self.assertNotEqual(new_path, old_path)
+        self.assertEqual(self.s3.downloads, 2)
+        with open(new_path, 'rb') as cached:
+            self.assertEqual(cached.read(), b'new graph')
+
+    def test_evicts_least_recently_used(self):
+        for name in ['a.png', 'b.png', 'c.png']:
+            self.s3.put('bucket', name, b'x' * 400000)
+        cache = S3Cache(self.s3, self.cache_dir, max_size_mb=1)
+        a = cache.fetch('bucket', 'a.png')
+        b = cache.fetch('bucket', 'b.png')
+        os.utime(a, (1, 1))
+        os.utime(b, (2, 2))
+
+        # 1.2MB is above the limit, the oldest files go until the cache is
+        # below 90% of it, but never the file that was just fetched
+        c = cache.fetch('bucket', 'c.png')
+        self.assertFalse(os.path.exists(a))
+        self.assertTrue(os.path.exists(b))
+        self.assertTrue(os.path.exists(c))
+        self.assertEqual(cache.size, 800000)
+
+    def test_keeps_the_fetched_file_even_above_the_limit(self):
+        self.s3.put('bucket', 'large.png', b'x' * 2000000)
+        cache = S3Cache(self.s3, self.cache_dir, max_size_mb=1)
+        path = cache.fetch('bucket', 'large.png')
+        self.assertTrue(os.path.exists(path))
+
+    def test_failed_download_leaves_no_part_file(self):
+        self.s3.put('bucket', 'page.graphml', b'graph')
+        cache = S3Cache(self.s3, self.cache_dir)
+        self.s3.fail_downloads = True
+        with self.assertRaises(IOError):
+            cache.fetch('bucket', 'page.graphml')
+        self.assertEqual(cached_files(self.cache_dir), [])
+
+        self.s3.fail_downloads = False
+        cache.fetch('bucket', 'page.graphml')
+        self.assertEqual(len(cached_files(self.cache_dir)), 1)
+
+if __name__ == '__main__':
+    unittest.main()